@@ -0,0 +1,5 @@
+import sys
+
+from iflag.cli import main
+
+sys.exit(main())
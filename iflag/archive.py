@@ -0,0 +1,348 @@
+"""
+Append-only archive of raw database records.
+
+The records are stored exactly as the meter sent them so they can be decoded again
+later, for example with a corrected layout. Layouts are only applied when reading.
+
+Each meter has a directory with two files per database:
+
+* `<database>.rec`: the raw records of all sessions, appended one after the other.
+* `<database>.idx`: one fixed size entry per session with the offset, number and
+  length of the records and their time range.
+
+Both files are read through `mmap`, so the index is scanned and records are accessed
+without reading whole files.
+"""
+import calendar
+import mmap
+import re
+import struct
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import List, Optional, Union, Iterator, Any, Sequence, Dict, BinaryIO
+
+import attr
+
+from iflag import parse, exceptions
+from iflag.client import DatabaseConfig
+from iflag.data import Date, DatabaseRecordParameter
+
+# offset, record count, record length, start, stop, archived at
+INDEX_ENTRY = struct.Struct("<QIHxxqqd")
+# Used in the index when the time range of a session is not known.
+NO_START = -(2 ** 63)
+NO_STOP = 2 ** 63 - 1
+
+_EPOCH = datetime(1970, 1, 1)
+_NAME = re.compile(r"^[A-Za-z0-9_\-][A-Za-z0-9_.\-]*$")
+
+
+def _to_seconds(value: datetime) -> int:
+    return calendar.timegm(value.timetuple())
+
+
+def _from_seconds(value: int) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+def time_offset(parameters: Sequence[DatabaseRecordParameter]) -> Optional[int]:
+    """
+    Returns the offset of the first Date parameter in a record layout, which is used
+    as the time of the record. None if the layout has no Date.
+    """
+    offset = 0
+    for parameter in parameters:
+        if parameter.data_class is Date:
+            return offset
+        offset += parameter.data_class.LENGTH
+    return None
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Segment:
+    """
+    The records archived from one session. start and stop are the oldest and newest
+    record time, None if not known.
+    """
+
+    meter: str
+    database: str
+    offset: int
+    record_count: int
+    record_length: int
+    start: Optional[datetime]
+    stop: Optional[datetime]
+    archived_at: float
+
+    @property
+    def size(self) -> int:
+        return self.record_count * self.record_length
+
+    def overlaps(self, since: Optional[datetime], until: Optional[datetime]) -> bool:
+        if since is not None and self.stop is not None and self.stop < since:
+            return False
+        if until is not None and self.start is not None and self.start > until:
+            return False
+        return True
+
+
+class ArchiveWriter:
+    """
+    Appends the records of one session to the archive. Records are written as they
+    are received and the session is added to the index when the writer is closed. If
+    the writer is never closed the records are not referenced from the index.
+
+    Only one writer should be used for the same meter and database at a time.
+    """
+
+    def __init__(
+        self,
+        records_path: Path,
+        index_path: Path,
+        database: str,
+        database_layout: Optional[DatabaseConfig] = None,
+    ):
+        self.records_path = records_path
+        self.index_path = index_path
+        self.database = database
+        self.database_layout = database_layout
+        self.record_count = 0
+        self.record_length: Optional[int] = None
+        self._first: Optional[bytes] = None
+        self._last: Optional[bytes] = None
+        self._file: Optional[BinaryIO] = None
+        self._offset = 0
+
+    def write(self, records: Sequence[bytes]) -> None:
+        if not records:
+            return
+        if self._file is None:
+            self._file = self.records_path.open("ab")
+            self._offset = self._file.tell()
+            self.record_length = len(records[0])
+            self._first = records[0]
+        for record in records:
+            if len(record) != self.record_length:
+                raise exceptions.DataError(
+                    "All records of an archived session must have the same length"
+                )
+        self._file.write(b"".join(records))
+        self.record_count += len(records)
+        self._last = records[-1]
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+        start, stop = NO_START, NO_STOP
+        times = self._record_times()
+        if times:
+            start, stop = min(times), max(times)
+        entry = INDEX_ENTRY.pack(
+            self._offset,
+            self.record_count,
+            self.record_length,
+            start,
+            stop,
+            time.time(),
+        )
+        with self.index_path.open("ab") as f:
+            f.write(entry)
+
+    def _record_times(self) -> List[int]:
+        # Databases are sent newest first, so the first and last records are enough
+        # for the time range.
+        if self.database_layout is None:
+            return []
+        parameters = self.database_layout.get(self.database, {}).get(
+            self.record_length
+        )
+        offset = time_offset(parameters) if parameters else None
+        if offset is None:
+            return []
+        times = []
+        for record in (self._first, self._last):
+            value = Date.from_bytes(record[offset : offset + Date.LENGTH]).value
+            if value is not None:
+                times.append(_to_seconds(value))
+        return times
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SegmentReader:
+    """
+    Zero copy access to the records of a segment. Records are memoryviews into the
+    memory mapped records file and are only valid until the reader is closed.
+    """
+
+    def __init__(self, records_path: Path, segment: Segment):
+        self.segment = segment
+        self._file = records_path.open("rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        end = segment.offset + segment.size
+        self._view = memoryview(self._mmap)[segment.offset : end]
+
+    def __len__(self) -> int:
+        return self.segment.record_count
+
+    def __getitem__(self, index: int) -> memoryview:
+        if not 0 <= index < len(self):
+            raise IndexError("Record index out of range")
+        length = self.segment.record_length
+        return self._view[index * length : (index + 1) * length]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self) -> None:
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordArchive:
+    """
+    Archive of raw database records by meter and database.
+
+    :param path: Directory of the archive.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def _paths(self, meter: str, database: str, create: bool = False):
+        for name in (meter, database):
+            if not _NAME.match(name):
+                raise ValueError(f"{name!r} can not be used as a name in the archive")
+        directory = self.path / meter
+        if create:
+            directory.mkdir(parents=True, exist_ok=True)
+        return directory / f"{database}.rec", directory / f"{database}.idx"
+
+    def writer(
+        self,
+        meter: str,
+        database: str,
+        database_layout: Optional[DatabaseConfig] = None,
+    ) -> ArchiveWriter:
+        """
+        Returns a writer for the records of a session. With a database layout the time
+        range of the session is stored in the index, which allows reads by time to
+        skip sessions.
+        """
+        records_path, index_path = self._paths(meter, database, create=True)
+        return ArchiveWriter(records_path, index_path, database, database_layout)
+
+    def meters(self) -> List[str]:
+        if not self.path.exists():
+            return []
+        return sorted(path.name for path in self.path.iterdir() if path.is_dir())
+
+    def segments(
+        self,
+        meter: str,
+        database: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Segment]:
+        """
+        Returns the archived sessions that may have records between since and until,
+        oldest session first.
+        """
+        _, index_path = self._paths(meter, database)
+        if not index_path.exists() or index_path.stat().st_size == 0:
+            return []
+        with index_path.open("rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as index:
+            # Ignore a partially written last entry.
+            end = len(index) - len(index) % INDEX_ENTRY.size
+            view = memoryview(index)[:end]
+            try:
+                entries = list(INDEX_ENTRY.iter_unpack(view))
+            finally:
+                view.release()
+
+        segments = []
+        for offset, count, length, start, stop, archived_at in entries:
+            segment = Segment(
+                meter=meter,
+                database=database,
+                offset=offset,
+                record_count=count,
+                record_length=length,
+                start=_from_seconds(start) if start != NO_START else None,
+                stop=_from_seconds(stop) if stop != NO_STOP else None,
+                archived_at=archived_at,
+            )
+            if segment.overlaps(since, until):
+                segments.append(segment)
+        return segments
+
+    def open_segment(self, segment: Segment) -> SegmentReader:
+        records_path, _ = self._paths(segment.meter, segment.database)
+        return SegmentReader(records_path, segment)
+
+    def read(
+        self,
+        meter: str,
+        database: str,
+        database_layout: DatabaseConfig,
+        input_pulse_weight: Decimal,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Decodes archived records with the given layout. Records are yielded per
+        session in the order they were received. With since or until only records in
+        the time window are yielded.
+        """
+        for segment in self.segments(meter, database, since, until):
+            try:
+                parameters = database_layout[database][segment.record_length]
+            except KeyError:
+                raise exceptions.CorusClientError(
+                    "Unable to find parsing config for database that fit the record "
+                    "length"
+                )
+            decoder = parse.RecordDecoder(parameters, fields)
+            offset = time_offset(parameters)
+            filter_time = offset is not None and (since or until) is not None
+            with self.open_segment(segment) as reader:
+                for view in reader:
+                    # Decoded straight from the memory map. The view is released
+                    # before the record is yielded so the reader can be closed.
+                    try:
+                        if filter_time:
+                            record_time = Date.from_bytes(
+                                view[offset : offset + Date.LENGTH]
+                            ).value
+                            if record_time is not None and (
+                                (since is not None and record_time < since)
+                                or (until is not None and record_time > until)
+                            ):
+                                continue
+                        record = decoder.decode(view, input_pulse_weight)
+                    finally:
+                        view.release()
+                    yield record
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
@@ -0,0 +1,71 @@
+import math
+import time
+from typing import Dict, Any, Optional, Callable, Tuple, Iterable, Type
+
+from iflag.data import IFlagParameter, CorusDataABC
+
+# Time to live values for different kinds of parameters, in seconds.
+STATIC = math.inf
+SLOW_CHANGING = 3600.0
+LIVE = 0.0
+
+
+class ParameterCache:
+    """
+    Cache of parameter values read from one device. Each parameter id has its own time
+    to live so static values like the serial number can be kept for good while live
+    values are always read. A time to live of 0 disables caching of the parameter.
+
+    :param ttls: Time to live in seconds by parameter id.
+    :param default_ttl: Time to live of parameters not in ttls.
+    """
+
+    def __init__(
+        self,
+        ttls: Optional[Dict[int, float]] = None,
+        default_ttl: float = LIVE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._clock = clock
+        # Values by parameter id and data class, with the time they expire.
+        self._values: Dict[int, Dict[Type[CorusDataABC], Tuple[float, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, parameter_id: int) -> float:
+        return self.ttls.get(parameter_id, self.default_ttl)
+
+    def get(self, parameter: IFlagParameter) -> Tuple[bool, Any]:
+        """
+        Returns a tuple of whether the parameter was cached and its value.
+        """
+        entry = self._values.get(parameter.id, {}).get(parameter.data_class)
+        if entry is not None and entry[0] > self._clock():
+            self.hits += 1
+            return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    def set(self, parameter: IFlagParameter, value: Any) -> None:
+        ttl = self.ttl(parameter.id)
+        if ttl <= 0:
+            return
+        self._values.setdefault(parameter.id, {})[parameter.data_class] = (
+            self._clock() + ttl,
+            value,
+        )
+
+    def invalidate(self, parameter_ids: Iterable[int]) -> None:
+        for parameter_id in parameter_ids:
+            self._values.pop(parameter_id, None)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(ttls={self.ttls!r}, "
+            f"default_ttl={self.default_ttl!r})"
+        )
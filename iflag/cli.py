@@ -0,0 +1,277 @@
+"""
+Command line interface for bulk reads from many meters.
+
+    iflag --meters meters.txt --layout b0040.json --database interval --workers 200
+
+Every record is written to stdout as one JSON object per line as soon as its frame is
+received, parameter results and errors when the session of the meter is done. A
+summary is written to stderr at the end.
+"""
+import argparse
+import functools
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Tuple, TextIO, Sequence, Dict, Any, Callable
+
+from iflag import exceptions
+from iflag.export import json_default
+from iflag.multiplex import (
+    Multiplexer,
+    MeterSession,
+    Operation,
+    ReadParameters,
+    ReadDatabase,
+)
+from iflag.registry import FirmwareRegistry, FirmwareDefinition
+
+
+def parse_meter_list(lines: Sequence[str]) -> List[Tuple[str, Tuple[str, int]]]:
+    """
+    Parses a meter list with one meter per line as `host:port` optionally followed by
+    a name. The name defaults to `host:port`. Empty lines and lines starting with # are
+    ignored.
+    """
+    meters = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        try:
+            host, port = parts[0].rsplit(":", 1)
+            address = (host, int(port))
+        except ValueError:
+            raise exceptions.CorusClientError(
+                f"Invalid meter address {parts[0]!r} on line {line_number}"
+            )
+        name = parts[1] if len(parts) > 1 else parts[0]
+        meters.append((name, address))
+    return meters
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parses an ISO format date or date and time without timezone.
+    """
+    for date_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Invalid date {value!r}")
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """
+    Nearest rank percentile of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def build_operations(
+    definition: FirmwareDefinition,
+    args: argparse.Namespace,
+    on_records: Optional[Callable[[str, MeterSession, List[Any]], None]] = None,
+) -> List[Operation]:
+    """
+    Creates the operations of each session from the arguments. on_records is called
+    with the database, the session and the records of every received frame.
+    """
+    operations: List[Operation] = []
+    if args.parameter:
+        try:
+            parameters = [definition.parameters[name] for name in args.parameter]
+        except KeyError as e:
+            raise exceptions.CorusClientError(
+                f"Parameter {e.args[0]!r} is not defined in firmware "
+                f"{definition.map_id!r}"
+            )
+        operations.append(ReadParameters(parameters))
+    for database in args.database:
+        if database not in definition.database_layout:
+            raise exceptions.CorusClientError(
+                f"Database {database!r} is not defined in firmware "
+                f"{definition.map_id!r}"
+            )
+        operations.append(
+            ReadDatabase(
+                database,
+                definition.database_layout,
+                start=args.start,
+                stop=args.stop,
+                input_pulse_weight=args.pulse_weight,
+                on_records=(
+                    None
+                    if on_records is None
+                    else functools.partial(on_records, database)
+                ),
+            )
+        )
+    return operations
+
+
+def session_lines(
+    name: str, session: MeterSession, parameter_names: Dict[int, str]
+) -> List[Dict[str, Any]]:
+    """
+    Converts the parameter results and the error of a finished session to the objects
+    written as NDJSON lines. Records are written as they are received.
+    """
+    lines = []
+    for operation, result in zip(session.operations, session.results):
+        if isinstance(operation, ReadParameters):
+            values = {
+                parameter_names.get(parameter_id, str(parameter_id)): value
+                for parameter_id, value in result.items()
+            }
+            lines.append({"meter": name, "type": "parameters", "values": values})
+    if session.error is not None:
+        lines.append(
+            {
+                "meter": name,
+                "type": "error",
+                "error": type(session.error).__name__,
+                "message": str(session.error),
+            }
+        )
+    return lines
+
+
+def run(args: argparse.Namespace, stdout: TextIO, stderr: TextIO) -> int:
+    registry = FirmwareRegistry()
+    try:
+        definition = registry.load_file(args.layout)
+    except ValueError as e:
+        raise exceptions.CorusClientError(f"Invalid layout file {args.layout}: {e}")
+
+    names: Dict[MeterSession, str] = {}
+    record_count = 0
+
+    def write_records(database: str, session: MeterSession, records: List[Any]):
+        nonlocal record_count
+        for record in records:
+            line = {
+                "meter": names[session],
+                "type": "record",
+                "database": database,
+                "record": record,
+            }
+            stdout.write(json.dumps(line, default=json_default) + "\n")
+        stdout.flush()
+        record_count += len(records)
+
+    operations = build_operations(definition, args, write_records)
+    if not operations:
+        raise exceptions.CorusClientError(
+            "Nothing to read, give --parameter or --database"
+        )
+    with open(args.meters) as f:
+        meters = parse_meter_list(f.readlines())
+
+    parameter_names = {
+        parameter.id: name for name, parameter in definition.parameters.items()
+    }
+    multiplexer = Multiplexer(
+        max_sessions=args.workers,
+        max_sessions_per_host=args.per_host,
+        connection_rate=args.rate,
+    )
+    for name, address in meters:
+        session = MeterSession(address, operations, timeout=args.timeout)
+        names[session] = name
+        multiplexer.add(session)
+
+    started = time.monotonic()
+    durations = []
+    errors: Counter = Counter()
+    for session in multiplexer.iter_finished():
+        for line in session_lines(names[session], session, parameter_names):
+            stdout.write(json.dumps(line, default=json_default) + "\n")
+        stdout.flush()
+        if session.error is not None:
+            errors[type(session.error).__name__] += 1
+        elif session.duration is not None:
+            durations.append(session.duration)
+    elapsed = time.monotonic() - started
+
+    failed = sum(errors.values())
+    stderr.write(
+        f"{len(meters) - failed}/{len(meters)} meters read, {record_count} records "
+        f"in {elapsed:.1f} s\n"
+    )
+    if durations:
+        stderr.write(
+            f"session time p50 {percentile(durations, 0.5):.2f} s, "
+            f"p99 {percentile(durations, 0.99):.2f} s\n"
+        )
+    for error, count in errors.most_common():
+        stderr.write(f"{count} x {error}\n")
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="iflag", description="Read parameters and databases from many meters."
+    )
+    parser.add_argument(
+        "--meters", required=True, help="File with one host:port [name] per line"
+    )
+    parser.add_argument(
+        "--layout", required=True, help="Firmware definition file, JSON or TOML"
+    )
+    parser.add_argument(
+        "--parameter",
+        action="append",
+        default=[],
+        help="Name of a parameter in the firmware definition to read. Repeatable.",
+    )
+    parser.add_argument(
+        "--database",
+        action="append",
+        default=[],
+        help="Database to read. Repeatable.",
+    )
+    parser.add_argument(
+        "--start", type=parse_datetime, help="Newest record to read, ISO format"
+    )
+    parser.add_argument(
+        "--stop", type=parse_datetime, help="Oldest record to read, ISO format"
+    )
+    parser.add_argument(
+        "--pulse-weight",
+        type=Decimal,
+        help="Input pulse weight. Read from each meter if not given.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=100, help="Number of concurrent sessions"
+    )
+    parser.add_argument(
+        "--per-host", type=int, help="Maximum concurrent sessions per host"
+    )
+    parser.add_argument("--rate", type=float, help="Maximum new connections per second")
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="Seconds a session may take"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log debug info")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr
+    )
+    try:
+        return run(args, sys.stdout, sys.stderr)
+    except (OSError, exceptions.CorusClientError) as e:
+        sys.stderr.write(f"iflag: {e}\n")
+        return 2
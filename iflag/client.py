@@ -1,38 +1,121 @@
+import itertools
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, tzinfo
 from decimal import Decimal
 
 from iflag.transport import TcpTransport, BaseTransport
-from iflag.messages import ReadDatabaseRequest, ReadRequest, WriteData, WriteRequest
-from iflag import parse, utils, exceptions
+from iflag.messages import (
+    ReadDatabaseRequest,
+    ReadRequest,
+    WriteData,
+    WriteRequest,
+    DatabaseCount,
+)
+from iflag import parse, exceptions
+from iflag.trace import WireTrace
+from iflag.pipeline import DecoderThread
+from iflag.cache import ParameterCache
+from iflag.spool import RecordSpool, SpooledRecords
+from iflag.clock import (
+    ClockReading,
+    ClockSyncResult,
+    plan_clock_write,
+    to_meter_time,
+)
+from iflag.protocol import (
+    CorusProtocol,
+    RetryPolicy,
+    Event,
+    SendData,
+    FrameReceived,
+    ProtocolFailed,
+    RecordsReceived,
+)
 from iflag.data import IFlagParameter, DatabaseRecordParameter, CorusString, Float
 
-from typing import Tuple, List, Any, Dict, Optional
+from typing import Tuple, List, Any, Dict, Optional, Iterator, Sequence, Callable
+from typing import TYPE_CHECKING, Union
+import attr
+
+if TYPE_CHECKING:
+    from iflag.registry import FirmwareRegistry, FirmwareDefinition
+    from iflag.archive import ArchiveWriter
+    from iflag.gaps import Gap
 
 logger = logging.getLogger(__name__)
 
 DatabaseConfig = Dict[str, Dict[int, List[DatabaseRecordParameter]]]
 
 
+def _parameters_key(parameters: Sequence[DatabaseRecordParameter]) -> tuple:
+    """
+    Hashable key derived from the content of a record layout, so cached results are
+    not shared between different layouts or reused for a new layout at the same
+    address.
+    """
+    return tuple(attr.astuple(parameter, recurse=False) for parameter in parameters)
+
+
+@attr.s(auto_attribs=True)
+class DatabaseProgress:
+    """
+    Progress of a database read. Reported for every received frame.
+    expected_records is only known if the records where counted before the read.
+    """
+
+    frames_received: int
+    records_received: int
+    expected_records: Optional[int] = None
+
+
+@attr.s(auto_attribs=True)
+class _DatabaseRead:
+    """
+    State of a database read that has been requested from the device.
+    """
+
+    database: str
+    database_layout: DatabaseConfig
+    pulse_weight: Decimal
+    fields: Optional[Sequence[str]]
+    batches: Iterator[List[bytes]]
+    named_tuples: bool = False
+
+
 class CorusClient:
     """
     Corus client class for interfacing with meters using the Corus protocol.
     """
 
-    DATABASES = {"interval", "hourly", "daily", "monthly"}
+    DATABASES = {"interval", "hourly", "daily", "monthly", "event", "parameter"}
 
     def __init__(
         self,
         transport: BaseTransport,
         database_layout: Optional[DatabaseConfig] = None,
         input_pulse_weight: Optional[Decimal] = None,
+        wire_trace_size: int = 64,
+        retry_policy: Optional[RetryPolicy] = None,
+        parameter_cache: Optional[ParameterCache] = None,
     ):
         """
         :param transport: Transport class to use for the Client.
+        :param wire_trace_size: Number of recent frames to keep in the wire trace.
+            The trace is logged when a communication error occurs.
+        :param retry_policy: How corrupt frames are retried.
+        :param parameter_cache: Cache for read_parameters. Only cache values of the
+            device the client is used for.
         """
         self.database_layout = database_layout
         self.transport = transport
         self._input_pulse_weight: Optional[Decimal] = input_pulse_weight
+        self.wire_trace = WireTrace(wire_trace_size)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.protocol = CorusProtocol(self.retry_policy)
+        self.parameter_cache = parameter_cache
+        self._record_decoders: Dict[tuple, parse.RecordDecoder] = {}
+        self._column_selections: Dict[tuple, Tuple[DatabaseConfig, bytes]] = {}
 
     @classmethod
     def with_tcp_transport(
@@ -58,20 +141,48 @@ class CorusClient:
 
     def read_parameters(self, parameters: List[IFlagParameter]) -> dict:
         """
-        Reads parameters from the device.
+        Reads parameters from the device. If the client has a parameter cache, cached
+        values are used and only the rest are read, in one request.
         :param parameters: List of parameters to read.
         :return: dict with all parameters that where requested.
         """
-
+        if self.parameter_cache is None:
+            return self._read_parameters(parameters)
+
+        cached = {}
+        missing = []
+        for parameter in parameters:
+            hit, value = self.parameter_cache.get(parameter)
+            if hit:
+                cached[parameter.id] = value
+            else:
+                missing.append(parameter)
+        if cached:
+            logger.debug("Using cached parameter data: %s", cached)
+        if missing:
+            read = self._read_parameters(missing)
+            for parameter in missing:
+                # None data is left out of the response and cached as None.
+                value = read.get(parameter.id)
+                self.parameter_cache.set(parameter, value)
+                cached[parameter.id] = value
+        return {
+            parameter.id: cached[parameter.id]
+            for parameter in parameters
+            if cached[parameter.id] is not None
+        }
+
+    def _read_parameters(self, parameters: List[IFlagParameter]) -> dict:
         parameter_ids = [parameter.id for parameter in parameters]
 
-        logger.info(f"Reading parameters: {parameters}")
+        logger.info("Reading parameters: %s", parameters)
         try:
             in_data = self._read_parameters_by_id(parameter_ids)
         except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            self._log_wire_trace()
             raise exceptions.CorusClientError from e
         data = parse.parse_corus_response(in_data, parameters)
-        logger.info(f"Received parameter data: {data}")
+        logger.debug("Received parameter data: %s", data)
         return data
 
     def get_parameter_map_id(self) -> str:
@@ -85,9 +196,21 @@ class CorusClient:
         value: str = self.read_parameters(
             [IFlagParameter(id=0x5E, data_class=CorusString)]
         )[0x5E]
-        map_id = value.split("_")[1]
+        map_id = value.split("_")[1].lower()
         return map_id
 
+    def load_firmware(self, registry: "FirmwareRegistry") -> "FirmwareDefinition":
+        """
+        Reads the parameter map id from the device and selects the database layout of
+        the matching firmware definition in the registry. The returned definition
+        holds the parameters of the firmware by name.
+        """
+        map_id = self.get_parameter_map_id()
+        definition = registry.get(map_id)
+        logger.info("Using firmware definition %s", definition.map_id)
+        self.database_layout = definition.database_layout
+        return definition
+
     @property
     def input_pulse_weight(self):
         if self._input_pulse_weight is None:
@@ -95,34 +218,79 @@ class CorusClient:
             self._input_pulse_weight = self.read_parameters(
                 [IFlagParameter(1, data_class=Float)]
             )[1]
-            logger.info(f"Set input_pulse_weight={self._input_pulse_weight} on client")
+            logger.info("Set input_pulse_weight=%s on client", self._input_pulse_weight)
         return self._input_pulse_weight
 
     def write_parameters(self, parameters: List[Tuple[IFlagParameter, Any]]) -> None:
         """
-        Writes parameters to the device.
+        Writes parameters to the device. Cached values of the parameters are
+        invalidated.
         :param parameters: List of tuples of the IFlagParameter and the values to write
         :return:
         """
+        if self.parameter_cache is not None:
+            self.parameter_cache.invalidate(parameter.id for parameter, _ in parameters)
 
         write_data = [
             WriteData(id=parameter.id, data=parameter.data_class(value).to_bytes())
             for parameter, value in parameters
         ]
         msg = WriteRequest(data=write_data)
-        logger.info(f"Writing parameters: {parameters}")
-        logger.info(f"Sending {msg}")
+        logger.info("Writing parameters: %s", parameters)
+        logger.debug("Sending %r", msg)
         try:
-            self.transport.send(msg.to_bytes())
-            ack = self.transport.recv(1)
+            self._send(self.protocol.write(msg.to_bytes()))
+            ack = self._complete_exchange()
         except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            self._log_wire_trace()
             raise exceptions.CorusClientError from e
 
-        if ack != b"\x06":
-            logger.info(f"Received non ACK on sending {msg}")
+        if not ack.accepted:
+            logger.info("Received non ACK on sending %r", msg)
+            self._log_wire_trace()
             raise exceptions.CommunicationError(f"Error in sending {msg}")
 
-        logger.info(f"Parameters {parameters} sent and accepted")
+        logger.info("Parameters %s sent and accepted", parameters)
+
+    def sync_clock(
+        self,
+        clock_parameter: IFlagParameter,
+        tolerance: float = 1.0,
+        align: bool = True,
+        timezone: Optional[tzinfo] = None,
+    ) -> ClockSyncResult:
+        """
+        Reads the clock of the device and sets it if it differs more than tolerance
+        seconds from the local clock. The written value is compensated for the half
+        round trip time it takes to reach the device. The clock is always read from
+        the device, never from the parameter cache.
+
+        :param clock_parameter: The Date parameter of the clock in the firmware.
+        :param tolerance: Seconds of difference that are accepted.
+        :param align: Time the write so the value is a whole second when it arrives.
+        :param timezone: Timezone of the device clock. Local time if None.
+        """
+        sent_at = time.time()
+        meter_time = self._read_parameters([clock_parameter])[clock_parameter.id]
+        received_at = time.time()
+        reading = ClockReading.from_exchange(
+            meter_time, sent_at, received_at, timezone
+        )
+        logger.info(
+            "Device clock is %.3f s off, round trip time %.3f s",
+            reading.offset,
+            reading.round_trip_time,
+        )
+        if abs(reading.offset) <= tolerance:
+            return ClockSyncResult(reading)
+
+        send_at, value = plan_clock_write(reading.round_trip_time, align)
+        delay = send_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        written_time = to_meter_time(value, timezone)
+        self.write_parameters([(clock_parameter, written_time)])
+        return ClockSyncResult(reading, written_time)
 
     def read_database(
         self,
@@ -131,17 +299,234 @@ class CorusClient:
         stop: Optional[datetime] = None,
         input_pulse_weight: Optional[Decimal] = None,
         database_layout: Optional[DatabaseConfig] = None,
-    ) -> List[Dict[str, Any]]:
+        fields: Optional[Sequence[str]] = None,
+        columns: Optional[Sequence[str]] = None,
+        count_records: bool = False,
+        progress: Optional[Callable[["DatabaseProgress"], None]] = None,
+        pipelined: bool = False,
+        named_tuples: bool = False,
+        take_while: Optional[Callable[[Any], bool]] = None,
+        archive: Optional["ArchiveWriter"] = None,
+        memory_budget: Optional[int] = None,
+    ) -> Union[List[Any], SpooledRecords]:
         """
         The database is read from the top and down. So start date is the latest value
         and stop date is for the oldest values.
-        Available databases are: interval, hourly, daily and monthly.
+        Available databases are: interval, hourly, daily, monthly, event and parameter.
+
+        :param fields: Names of the record parameters to decode. Other parameters in
+            the layout are skipped. None decodes all parameters.
+        :param columns: Names of the record parameters to request from the device.
+            Only parameters with an `option_bit` can be left out by the device. The
+            reduced record layout is derived from the database layout and parameters
+            without an `option_bit` are always part of it. If fields is not given all
+            parameters of the reduced layout are decoded.
+        :param count_records: Ask the device for the number of records before reading
+            them. The read is skipped if there are no records and the count is
+            included in the progress reports.
+        :param progress: Callable that is called with a `DatabaseProgress` for every
+            received frame.
+        :param pipelined: Decode records in a background thread while the next frames
+            are received.
+        :param named_tuples: Return the records as instances of a namedtuple class
+            that is generated once per record layout instead of dicts. Values that
+            are not available are None.
+        :param take_while: Callable that is called with each decoded record as it
+            arrives. Records are returned until it returns False. Then no more frames
+            are acknowledged, the session is ended with a break and the transport is
+            disconnected, so `startup` has to be called before the next request. Can't be combined with pipelined.
+        :param archive: `ArchiveWriter` that the raw records are written to as they
+            are received.
+        :param memory_budget: Bytes of raw record data to hold in memory. All frames
+            are received into a `RecordSpool` that moves the raw records to a
+            temporary file once the budget is exceeded. A `SpooledRecords` is returned
+            instead of a list, which decodes the records from the spool each time it
+            is iterated. Close it to remove the file. Can't be combined with pipelined
+            or take_while.
         """
-
-        if database not in self.DATABASES:
+        if pipelined and take_while is not None:
             raise exceptions.CorusClientError(
-                f"Database {database!r} is not a valid database"
+                "take_while can not be used with pipelined reads"
+            )
+        if memory_budget is not None and (pipelined or take_while is not None):
+            raise exceptions.CorusClientError(
+                "memory_budget can not be used with pipelined or take_while"
             )
+        read = self._start_database_read(
+            database=database,
+            start=start,
+            stop=stop,
+            input_pulse_weight=input_pulse_weight,
+            database_layout=database_layout,
+            fields=fields,
+            columns=columns,
+            count_records=count_records,
+            progress=progress,
+            named_tuples=named_tuples,
+            take_while=take_while,
+            archive=archive,
+        )
+        if pipelined:
+            return self._read_database_pipelined(read)
+        if memory_budget is not None:
+            return self._read_database_spooled(read, memory_budget)
+        return list(self._iter_read_records(read, take_while))
+
+    def read_databases(
+        self,
+        reads: Sequence[Tuple[str, Optional[datetime], Optional[datetime]]],
+        input_pulse_weight: Optional[Decimal] = None,
+        database_layout: Optional[DatabaseConfig] = None,
+        fields: Optional[Sequence[str]] = None,
+        pipelined: bool = False,
+        named_tuples: bool = False,
+    ) -> List[List[Any]]:
+        """
+        Reads several databases, or several ranges of a database, back to back in the
+        current session. All reads are validated before anything is sent to the device,
+        and the pulse weight is resolved once for all reads.
+
+        :param reads: Sequence of (database, start, stop) tuples.
+        :return: List with the records of each read, in the same order as reads.
+        """
+        _database_layout = self._get_database_layout(database_layout)
+        for database, _, _ in reads:
+            self._check_database(database)
+            if database not in _database_layout:
+                raise exceptions.CorusClientError(
+                    f"No record definitions for database {database!r} in layout"
+                )
+
+        pulse_weight = input_pulse_weight or self.input_pulse_weight
+
+        return [
+            self.read_database(
+                database=database,
+                start=start,
+                stop=stop,
+                input_pulse_weight=pulse_weight,
+                database_layout=_database_layout,
+                fields=fields,
+                pipelined=pipelined,
+                named_tuples=named_tuples,
+            )
+            for database, start, stop in reads
+        ]
+
+    def read_gaps(
+        self,
+        database: str,
+        gaps: Sequence["Gap"],
+        input_pulse_weight: Optional[Decimal] = None,
+        database_layout: Optional[DatabaseConfig] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Any]:
+        """
+        Reads only the records of the gaps found by `iflag.gaps.find_gaps`, with one
+        database request per gap in the current session.
+
+        :return: The records of all gaps, newest gap first.
+        """
+        reads = [gap.as_read(database) for gap in reversed(gaps)]
+        logger.info("Reading %s gaps in %s database", len(reads), database)
+        results = self.read_databases(
+            reads,
+            input_pulse_weight=input_pulse_weight,
+            database_layout=database_layout,
+            fields=fields,
+        )
+        return list(itertools.chain.from_iterable(results))
+
+    def iter_database(
+        self,
+        database: str,
+        start: Optional[datetime] = None,
+        stop: Optional[datetime] = None,
+        input_pulse_weight: Optional[Decimal] = None,
+        database_layout: Optional[DatabaseConfig] = None,
+        fields: Optional[Sequence[str]] = None,
+        columns: Optional[Sequence[str]] = None,
+        count_records: bool = False,
+        progress: Optional[Callable[["DatabaseProgress"], None]] = None,
+        named_tuples: bool = False,
+        take_while: Optional[Callable[[Any], bool]] = None,
+        archive: Optional["ArchiveWriter"] = None,
+    ) -> Iterator[Any]:
+        """
+        Same as `read_database` but records are decoded and yielded as the frames
+        arrive from the device, so large databases like the event log don't have to be
+        held in memory.
+        The iterator needs to be consumed completely before any other request is sent
+        to the device.
+        """
+        read = self._start_database_read(
+            database=database,
+            start=start,
+            stop=stop,
+            input_pulse_weight=input_pulse_weight,
+            database_layout=database_layout,
+            fields=fields,
+            columns=columns,
+            count_records=count_records,
+            progress=progress,
+            named_tuples=named_tuples,
+            take_while=take_while,
+            archive=archive,
+        )
+        return self._iter_read_records(read, take_while)
+
+    def _iter_read_records(
+        self, read: "_DatabaseRead", take_while: Optional[Callable[[Any], bool]]
+    ) -> Iterator[Any]:
+        """
+        Decodes the records of a database read. With take_while the read is stopped
+        at the first record that doesn't fulfill it.
+        """
+        records = self._decode_database_records(
+            read, itertools.chain.from_iterable(read.batches)
+        )
+        if take_while is None:
+            yield from records
+            return
+        for record in records:
+            if not take_while(record):
+                self._stop_database_read(read)
+                return
+            yield record
+
+    def _stop_database_read(self, read: "_DatabaseRead") -> None:
+        """
+        Stops a database read before all frames are received. The last frame is not
+        acknowledged and a break is sent instead, which ends the session, and the
+        transport is disconnected.
+        """
+        read.batches.close()
+        if self.protocol.is_idle:
+            return
+        logger.info("Stopping read of %s database with a break", read.database)
+        self._send(self.protocol.send_break())
+        self.transport.disconnect()
+
+    def _start_database_read(
+        self,
+        database: str,
+        start: Optional[datetime],
+        stop: Optional[datetime],
+        input_pulse_weight: Optional[Decimal],
+        database_layout: Optional[DatabaseConfig],
+        fields: Optional[Sequence[str]],
+        columns: Optional[Sequence[str]],
+        count_records: bool,
+        progress: Optional[Callable[["DatabaseProgress"], None]],
+        named_tuples: bool = False,
+        take_while: Optional[Callable[[Any], bool]] = None,
+        archive: Optional["ArchiveWriter"] = None,
+    ) -> "_DatabaseRead":
+        """
+        Validates the arguments of a database read and sends the request. The records
+        are received when the batches of the returned read are iterated.
+        """
+        self._check_database(database)
 
         pulse_weight = input_pulse_weight or self.input_pulse_weight
         if pulse_weight is None:
@@ -150,91 +535,375 @@ class CorusClient:
                 f"Define it on client init or in the read_database call."
             )
 
+        _database_layout = self._get_database_layout(database_layout)
+        if fields is not None:
+            self._check_fields(_database_layout, database, fields)
+
+        record_layout = _database_layout
+        options_bitmask = None
+        if columns is not None:
+            record_layout, options_bitmask = self._select_columns(
+                _database_layout, database, columns
+            )
+            if fields is not None:
+                sent = {
+                    parameter.name
+                    for parameters in record_layout[database].values()
+                    for parameter in parameters
+                }
+                not_sent = [field for field in fields if field not in sent]
+                if not_sent:
+                    raise exceptions.CorusClientError(
+                        f"Fields {not_sent!r} are not sent with the requested columns"
+                    )
+
+        expected_records = None
+        if count_records:
+            count = self.count_database_records(
+                database, start, stop, columns=columns, database_layout=_database_layout
+            )
+            expected_records = count.record_count
+
+        if named_tuples:
+            self._check_record_class_names(record_layout, database, fields)
+
+        read = _DatabaseRead(
+            database=database,
+            database_layout=record_layout,
+            pulse_weight=pulse_weight,
+            fields=fields,
+            batches=iter([]),
+            named_tuples=named_tuples,
+        )
+        if expected_records == 0:
+            return read
+
+        msg = ReadDatabaseRequest(
+            database=database, start=start, stop=stop, options_bitmask=options_bitmask
+        )
+
+        logger.debug("Sending %r", msg)
+        try:
+            self._send(
+                self.protocol.read_database(
+                    msg.to_bytes(), ack_after_records=take_while is not None
+                )
+            )
+        except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            self._log_wire_trace()
+            raise exceptions.CorusClientError from e
+
+        read.batches = self._iter_database_batches(progress, expected_records)
+        if archive is not None:
+            read.batches = self._archive_batches(read.batches, archive)
+        return read
+
+    @staticmethod
+    def _archive_batches(
+        batches: Iterator[List[bytes]], archive: "ArchiveWriter"
+    ) -> Iterator[List[bytes]]:
+        for batch in batches:
+            archive.write(batch)
+            yield batch
+
+    def _read_database_pipelined(self, read: "_DatabaseRead") -> List[Any]:
+        """
+        Receives the frames of a database read in the calling thread while the records
+        are decoded in a background thread. Frames are acknowledged as soon as they
+        have passed the CRC check so decoding is hidden behind the network latency.
+        """
+        decoder = DecoderThread(
+            lambda records: self._decode_database_records(read, records)
+        )
+        decoder.start()
+        try:
+            for batch in read.batches:
+                decoder.put(batch)
+        except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            decoder.stop()
+            self._log_wire_trace()
+            raise exceptions.CorusClientError from e
+        except BaseException:
+            decoder.stop()
+            raise
+        return decoder.finish()
+
+    def _read_database_spooled(
+        self, read: "_DatabaseRead", memory_budget: int
+    ) -> SpooledRecords:
+        """
+        Receives all frames of a database read into a spool. The records are decoded
+        when the result is iterated.
+        """
+        spool = RecordSpool(memory_budget)
+        try:
+            for batch in read.batches:
+                spool.write(batch)
+        except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            spool.close()
+            self._log_wire_trace()
+            raise exceptions.CorusClientError from e
+        except BaseException:
+            spool.close()
+            raise
+        if spool.spilled:
+            logger.info(
+                "Spooled %s records of %s database to disk", len(spool), read.database
+            )
+        return SpooledRecords(
+            spool, lambda records: self._decode_database_records(read, records)
+        )
+
+    def count_database_records(
+        self,
+        database: str,
+        start: Optional[datetime] = None,
+        stop: Optional[datetime] = None,
+        columns: Optional[Sequence[str]] = None,
+        database_layout: Optional[DatabaseConfig] = None,
+    ) -> DatabaseCount:
+        """
+        Asks the device how many records a database read would return, without
+        transferring them. The result can be used to show progress and to estimate
+        the transfer time of the read.
+
+        :param columns: Same as in `read_database`. Affects the record size.
+        """
+        self._check_database(database)
+
+        options_bitmask = None
+        if columns is not None:
+            _, options_bitmask = self._select_columns(
+                self._get_database_layout(database_layout), database, columns
+            )
+
+        msg = ReadDatabaseRequest(
+            database=database,
+            start=start,
+            stop=stop,
+            options_bitmask=options_bitmask,
+            count_records=True,
+        )
+
+        logger.debug("Sending %r", msg)
+        try:
+            self._send(self.protocol.request(msg.to_bytes()))
+            frame_data = self._read_response_data()
+        except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            self._log_wire_trace()
+            raise exceptions.CorusClientError from e
+
+        count = DatabaseCount.from_frame_data(database, frame_data)
+        logger.info("Received record count: %r", count)
+        return count
+
+    def _check_database(self, database: str):
+        if database not in self.DATABASES:
+            raise exceptions.CorusClientError(
+                f"Database {database!r} is not a valid database"
+            )
+
+    @staticmethod
+    def _check_fields(
+        database_layout: DatabaseConfig, database: str, fields: Sequence[str]
+    ):
+        """
+        Checks that the fields are in the record layout of the database before the
+        request is sent, so a read is not aborted after the device started sending.
+        """
+        layouts = database_layout.get(database)
+        if not layouts:
+            raise exceptions.CorusClientError(
+                f"No record definitions for database {database!r} in layout"
+            )
+        names = {
+            parameter.name
+            for parameters in layouts.values()
+            for parameter in parameters
+        }
+        unknown = [field for field in fields if field not in names]
+        if unknown:
+            raise exceptions.CorusClientError(
+                f"Fields {unknown!r} are not in the {database!r} record layout"
+            )
+
+    @staticmethod
+    def _check_record_class_names(
+        database_layout: DatabaseConfig,
+        database: str,
+        fields: Optional[Sequence[str]],
+    ):
+        """
+        Checks that the decoded names of all record layouts of the database can be
+        fields of a namedtuple class, before the request is sent.
+        """
+        for parameters in database_layout.get(database, {}).values():
+            names = [
+                parameter.name
+                for parameter in parameters
+                if fields is None or parameter.name in fields
+            ]
+            invalid = parse.invalid_field_names(names)
+            if invalid:
+                raise exceptions.DataError(
+                    f"Names {invalid!r} can not be used as fields of a record class"
+                )
+
+    def _get_database_layout(
+        self, database_layout: Optional[DatabaseConfig]
+    ) -> DatabaseConfig:
         _database_layout = database_layout or self.database_layout
         if _database_layout is None:
             raise exceptions.CorusClientError(
                 f"Trying to read database records without a predefined database layout."
                 f"Define it on client init or in the read_database call."
             )
+        return _database_layout
 
-        msg = ReadDatabaseRequest(database=database, start=start, stop=stop)
-
-        logger.info(f"Sending {msg!r}")
+    def _decode_database_records(
+        self, read: "_DatabaseRead", records: Iterator[bytes]
+    ) -> Iterator[Any]:
+        """
+        Decodes raw records using the layout that fits the length of the records.
+        """
+        decoder: Optional[parse.RecordDecoder] = None
         try:
-            self.transport.send(msg.to_bytes())
-            records = self._read_database_data()
+            for record in records:
+                if decoder is None:
+                    decoder = self._get_record_decoder(
+                        read.database_layout,
+                        read.database,
+                        len(record),
+                        read.fields,
+                        read.named_tuples,
+                    )
+                if read.named_tuples:
+                    yield decoder.decode_record(record, read.pulse_weight)
+                else:
+                    yield decoder.decode(record, read.pulse_weight)
         except (exceptions.ProtocolError, exceptions.CommunicationError) as e:
+            self._log_wire_trace()
             raise exceptions.CorusClientError from e
 
-        if not records:
-            return []
-
-        record_length = len(records[0])
+    @staticmethod
+    def _get_record_parameters(
+        database_layout: DatabaseConfig, database: str, record_length: int
+    ) -> List[DatabaseRecordParameter]:
+        """
+        Finds the record definition in the layout that fits the record length.
+        """
         try:
-            record_parameters = _database_layout[database][record_length]
-            return [
-                parse.parse_corus_database_record(
-                    record, record_parameters, pulse_weight
-                )
-                for record in records
-            ]
-
+            return database_layout[database][record_length]
         except KeyError:
             logger.error(
-                f"No record definition in {database!r} database with length "
-                f"of {record_length}"
+                "No record definition in %r database with length of %s",
+                database,
+                record_length,
             )
             raise exceptions.CorusClientError(
                 "Unable to find parsing config for database that fit the record length"
             )
 
-    def _wakeup(self):
+    def _select_columns(
+        self, database_layout: DatabaseConfig, database: str, columns: Sequence[str]
+    ) -> Tuple[DatabaseConfig, bytes]:
+        """
+        Derives the reduced database layout and the options bitmask to request only
+        the given columns from the device. The result is cached per layout.
         """
-        Similar to IEC62056-21 it is needed to send a sequence of null bytes to the
-        device for it to wake up the interface. Protocol docs says at least 12 bytes but
-        other software uses 200 bytes. We will stick to 200 bytes to not get any issues.
-        The device should return 3 null bytes when it is ready.
-        """
-        wakeup_data = bytes(200)
-        logger.info(f"Sending wakeup sequence")
-        self.transport.send(wakeup_data)
-        response = self.transport.recv(3)
-        if response != b"\x00\x00\x00":
-            raise exceptions.ProtocolError(
-                f"Received non null wakeup response: {response!r}"
+        layouts = database_layout.get(database)
+        if not layouts:
+            raise exceptions.CorusClientError(
+                f"No record definitions for database {database!r} in layout"
             )
-        logger.info(f"Received proper wakeup response")
+        key = (
+            database,
+            tuple(
+                (length, _parameters_key(parameters))
+                for length, parameters in layouts.items()
+            ),
+            tuple(columns),
+        )
+        selection = self._column_selections.get(key)
+        if selection is None:
+            names = {
+                parameter.name
+                for parameters in layouts.values()
+                for parameter in parameters
+            }
+            unknown = [column for column in columns if column not in names]
+            if unknown:
+                raise exceptions.CorusClientError(
+                    f"Columns {unknown!r} are not in the {database!r} record layout"
+                )
+            reduced_layouts = {}
+            for parameters in layouts.values():
+                reduced = parse.reduce_record_layout(parameters, columns)
+                length = sum(parameter.data_class.LENGTH for parameter in reduced)
+                reduced_layouts[length] = reduced
+            bitmask = parse.options_bitmask_for_columns(layouts.values(), columns)
+            selection = ({database: reduced_layouts}, bitmask)
+            self._column_selections[key] = selection
+        return selection
+
+    def _get_record_decoder(
+        self,
+        database_layout: DatabaseConfig,
+        database: str,
+        record_length: int,
+        fields: Optional[Sequence[str]] = None,
+        named_tuples: bool = False,
+    ) -> parse.RecordDecoder:
+        """
+        Returns a compiled decoder for the record definition that fits the record
+        length. Decoders are cached so the layout is only compiled once per client.
+        """
+        record_parameters = self._get_record_parameters(
+            database_layout, database, record_length
+        )
+        key = (
+            _parameters_key(record_parameters),
+            None if fields is None else tuple(fields),
+            named_tuples,
+        )
+        decoder = self._record_decoders.get(key)
+        if decoder is None:
+            try:
+                decoder = parse.RecordDecoder(record_parameters, fields, named_tuples)
+            except ValueError as e:
+                raise exceptions.CorusClientError(str(e)) from e
+            self._record_decoders[key] = decoder
+        return decoder
+
+    def _wakeup(self):
+        """
+        Sends the wakeup sequence and waits for the device to answer.
+        See `CorusProtocol.wakeup`.
+        """
+        logger.info("Sending wakeup sequence")
+        self._send(self.protocol.wakeup())
+        self._complete_exchange()
+        logger.info("Received proper wakeup response")
 
     def startup(self):
         """
-        Similar sign on as IEC 62056-21. But no need to send a meter address. Device
-        returns identification that has no special meaning. At least not over TCP.
-        Then a standard Ack is sent.
-        Then a "Password" exchange is done, but not really, just send the code PASS back
-        and forth. So we just fast forward all of this to get to the correct state.
+        Connects, wakes up the device and signs on. See `CorusProtocol.sign_on`.
+        A new protocol state and an empty wire trace are used for each session.
         """
+        self.protocol = CorusProtocol(self.retry_policy)
+        self.wire_trace.clear()
         self.transport.connect()
         self._wakeup()
-        logger.info(f"Initiating device communications")
-        sign_on_message = b"/?!\r\n"
-        self.transport.send(sign_on_message)
-        ident = self.transport.simple_read(start_char=b"/", end_char=b"\x0a")
-        ack_message = b"\x06\x30\x37\x36\x0d\x0a"
-        self.transport.send(ack_message)
-        pass_msg = self.transport.recv(6)
-        # TODO: check the crc
-        self.transport.send(pass_msg)
-        ack = self.transport.recv(1)
-        if ack != b"\x06":
-            raise exceptions.ProtocolError("Ack not received after sign on")
+        logger.info("Initiating device communications")
+        self._send(self.protocol.sign_on())
+        self._complete_exchange()
 
     def shutdown(self):
         """
         Sends a BREAK message to the device to indicate end of communication.
         """
-        logger.info(f"Sending break message")
-        msg = b"\x01B0\x03!1"  # pre calculated CRC.
-        self.transport.send(msg)
+        logger.info("Sending break message")
+        self._send(self.protocol.send_break())
         self.transport.disconnect()
 
     def _read_parameters_by_id(self, parameters_ids: List[int]) -> bytes:
@@ -248,8 +917,8 @@ class CorusClient:
         """
         msg = ReadRequest(parameters_ids)
 
-        logger.info(f"Sending {msg!r}")
-        self.transport.send(msg.to_bytes())
+        logger.debug("Sending %r", msg)
+        self._send(self.protocol.request(msg.to_bytes()))
         read_data = self._read_response_data()
         return read_data
 
@@ -258,130 +927,83 @@ class CorusClient:
         Reads the response data for a read request.
         :return: Response data
         """
-        in_bytes = b""
-
-        first_char = self.transport.recv(1)
-        if not first_char == b"\x01":
-            raise exceptions.ProtocolError("first char is not SOH")
+        event = self._complete_exchange()
+        return event.data
 
-        length_byte = self.transport.recv(1)
-        data_length = int.from_bytes(bytes=length_byte, byteorder="big")
-
-        data = self.transport.recv(data_length)
-
-        end_char = self.transport.recv(1)
-        if not end_char == b"\x03":
-            raise exceptions.ProtocolError("end char not ETX")
-
-        in_bytes += first_char + length_byte + data + end_char
-
-        crc = self.transport.recv(2)
-
-        total_data = in_bytes + crc
-        logger.debug(f"Received {total_data!r}")
-
-        if not utils.crc_valid(in_bytes, crc):
-            # Send nack if crc is not valid
-            logger.debug(
-                f"Message failed CRC validation. Message: {in_bytes!r}, "
-                f"received_crc: {crc!r}"
-            )
-            raise exceptions.ProtocolError("Failed CRC check")
-
-        return data
-
-    def _read_database_data(self) -> List[bytes]:
+    def _complete_exchange(self) -> Event:
         """
-        Reads the response data for a database read request. The rules for receiving are
-        a but tricky, mainly because first frame have extra data. It is described in
-        more detail in the protocol documentation.
-        :return: Response data
+        Drives the protocol until the current exchange is done.
+        :return: The last event of the exchange
         """
-        _data = b""
-        record_size: int = 0
-        read_next = True
-        is_first_frame = True
-        retry_count = 0
-        previous_frame_number: int = 0
-        current_frame_number = -1
+        event = None
+        for event in self._events():
+            pass
+        return event
 
+    def _events(self) -> Iterator[Event]:
+        """
+        Receives data and feeds it to the protocol until the current exchange is done.
+        Data the protocol wants to send is sent, received frames are recorded in the
+        wire trace and a failure is raised. All other events are yielded.
+        """
+        data = b""
+        while True:
+            for event in self.protocol.feed(data):
+                if isinstance(event, SendData):
+                    if event.delay:
+                        time.sleep(event.delay)
+                    self._send(event.data)
+                elif isinstance(event, FrameReceived):
+                    self.wire_trace.received(event.data)
+                elif isinstance(event, ProtocolFailed):
+                    raise event.error
+                else:
+                    yield event
+            if self.protocol.is_idle:
+                return
+            data = self.transport.recv_some()
+
+    def _iter_database_batches(
+        self,
+        progress: Optional[Callable[[DatabaseProgress], None]] = None,
+        expected_records: Optional[int] = None,
+    ) -> Iterator[List[bytes]]:
+        """
+        Reads the response data for a database read request. The records that end in
+        a frame are yielded as a batch as soon as the frame has passed the CRC check
+        and has been acknowledged.
+        :param progress: Called with a DatabaseProgress after every received frame.
+        :param expected_records: Number of records to report as expected in progress.
+        :return: Iterator of record batches
+        """
         logger.debug("Initiating database read")
-
-        while read_next:
-            in_bytes = b""
-
-            first_char = self.transport.recv(1)
-            if not first_char == b"\x01":
-                raise exceptions.ProtocolError("first char is not SOH")
-
-            length = self.transport.recv(1)
-            frame_data_length = int.from_bytes(bytes=length, byteorder="big")
-            frame_data = self.transport.recv(frame_data_length)
-
-            # Framenumber is little endian!
-            frame_number_data = frame_data[:2]
-            current_frame_number = (
-                int.from_bytes(frame_number_data, "little") & 0b0111111111111111
-            )
-
-            end_char = self.transport.recv(1)
-            if not end_char == b"\x03":
-                raise exceptions.ProtocolError("end char not ETX")
-
-            in_bytes += first_char + length + frame_data + end_char
-
-            if is_first_frame:
-                # record_size is only sent in first frame...
-                record_size = int.from_bytes(frame_data[2:3], "big")
-                if record_size == 0:
-                    # en empty response is indicated by the first frame alos being
-                    # the last frame and record size is 0.
-                    raise exceptions.ProtocolError(
-                        "Empty response"
-                    )  # TODO: better handling
-                _data = _data + frame_data[3:]
-
-            else:
-                _data = _data + frame_data[2:]
-                if current_frame_number != (previous_frame_number + 1):
-                    raise exceptions.ProtocolError("Data frames not received in order")
-
-            crc = self.transport.recv(2)
-
-            total_data = in_bytes + crc
-
-            logger.debug(f"Received data: {total_data.hex()!r}")
-
-            if not utils.crc_valid(in_bytes, crc):
-                # Send nack if crc is not valid
-                logger.debug(
-                    f"Message failed CRC validation. Message: {in_bytes!r}, "
-                    f"received_crc: {crc!r}"
-                )
-                if retry_count >= 3:
-                    raise exceptions.CommunicationError(
-                        "Maximum amounts of retries done. Aborting."
+        for event in self._events():
+            if isinstance(event, RecordsReceived):
+                if progress is not None:
+                    progress(
+                        DatabaseProgress(
+                            event.frames_received,
+                            event.records_received,
+                            expected_records,
+                        )
                     )
-                self.transport.send(b"\x15")  # NACK
-                retry_count += 1
-                continue
+                yield event.records
 
-            is_first_frame = False
-            is_last_frame = bool(
-                int.from_bytes(frame_number_data, "little") & 0b1000000000000000
-            )
-
-            if is_last_frame:
-                read_next = False
-            else:
-                self.transport.send(b"\x06")  # ACK
-                retry_count = 0  # Reset retry for a message part
-                previous_frame_number = current_frame_number
+    def _send(self, data: bytes):
+        """
+        Sends data over the transport and records it in the wire trace.
+        """
+        self.wire_trace.sent(data)
+        self.transport.send(data)
 
-        records = [
-            _data[i : i + record_size] for i in range(0, len(_data), record_size)
-        ]
-        return records
+    def _log_wire_trace(self):
+        """
+        Logs the recent frames of the session. Called when communication fails.
+        """
+        if self.wire_trace and logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Communication failed. Recent frames:\n%s", self.wire_trace.format()
+            )
 
     def __repr__(self):
         return (
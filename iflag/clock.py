@@ -0,0 +1,96 @@
+"""
+Helpers to set meter clocks accurately.
+
+A clock value written to a meter is applied when the request arrives, half a round
+trip after it was sent, so the written value is compensated with the round trip time
+measured when reading the clock. Meter clocks have a resolution of one second, so by
+default the write is timed so the value is a whole second when it arrives.
+"""
+import math
+import time
+from datetime import datetime, tzinfo
+from typing import Optional, Tuple
+
+import attr
+
+
+@attr.s(auto_attribs=True)
+class ClockReading:
+    """
+    The clock of a meter compared to the local clock.
+
+    :param meter_time: Time read from the meter.
+    :param reference_time: Local time when the meter read its clock, estimated as the
+        middle of the request.
+    :param round_trip_time: Seconds from sending the request to receiving the response.
+    """
+
+    meter_time: datetime
+    reference_time: datetime
+    round_trip_time: float
+
+    @classmethod
+    def from_exchange(
+        cls,
+        meter_time: datetime,
+        sent_at: float,
+        received_at: float,
+        timezone: Optional[tzinfo] = None,
+    ) -> "ClockReading":
+        """
+        :param sent_at: `time.time()` when the request was sent.
+        :param received_at: `time.time()` when the response was received.
+        """
+        return cls(
+            meter_time=meter_time,
+            reference_time=to_meter_time((sent_at + received_at) / 2, timezone),
+            round_trip_time=received_at - sent_at,
+        )
+
+    @property
+    def offset(self) -> float:
+        """
+        Seconds the meter clock is ahead of the local clock. The meter truncates its
+        clock to whole seconds so on average it is half a second later than read.
+        """
+        return (self.meter_time - self.reference_time).total_seconds() + 0.5
+
+
+@attr.s(auto_attribs=True)
+class ClockSyncResult:
+    """
+    Result of synchronising the clock of a meter. written_time is None if the clock
+    was within tolerance and was not written.
+    """
+
+    reading: ClockReading
+    written_time: Optional[datetime] = None
+
+    @property
+    def synced(self) -> bool:
+        return self.written_time is not None
+
+
+def to_meter_time(timestamp: float, timezone: Optional[tzinfo] = None) -> datetime:
+    """
+    Converts a `time.time()` timestamp to the naive datetime the meter uses. Local
+    time is used if no timezone is given.
+    """
+    return datetime.fromtimestamp(timestamp, timezone).replace(tzinfo=None)
+
+
+def plan_clock_write(
+    round_trip_time: float, align: bool = True, now: Optional[float] = None
+) -> Tuple[float, float]:
+    """
+    Returns the `time.time()` timestamp to send the write at and the timestamp to
+    write, so that the value is correct when the meter applies it. With align the
+    write is delayed until the value arrives on a whole second.
+    """
+    if now is None:
+        now = time.time()
+    one_way = round_trip_time / 2
+    value = now + one_way
+    if align:
+        value = float(math.ceil(value))
+    return value - one_way, value
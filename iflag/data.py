@@ -79,6 +79,33 @@ class CorusDataABC(abc.ABC):
             return self.from_python(self.value)
 
 
+class MemoizedDecodeMixin:
+    """
+    Mixin for 16 bit data classes. They only have 65536 possible values, so decoded
+    values are memoized in a table per class that is shared by all users and filled
+    lazily, so only values that are actually seen are held. Decoded values are
+    immutable which makes them safe to share.
+    Subclasses implement `_to_python` instead of `to_python`.
+    """
+
+    @classmethod
+    def to_python(cls, in_bytes: bytes):
+        table = cls.__dict__.get("_decoded_values")
+        if table is None:
+            table = {}
+            cls._decoded_values = table
+        try:
+            return table[in_bytes]
+        except KeyError:
+            value = cls._to_python(in_bytes)
+            table[bytes(in_bytes)] = value
+            return value
+
+    @classmethod
+    def _to_python(cls, in_bytes: bytes):
+        raise NotImplementedError("_to_python must be implemented in subclass")
+
+
 class Date(CorusDataABC):
     LENGTH = 4
     VALUE_TYPE = datetime
@@ -117,14 +144,13 @@ class EWord(CorusDataABC):
 
     @classmethod
     def to_python(cls, in_bytes: bytes):
-        in_bytes = in_bytes + b"\x00"  # padding 1 bytes so it is possible to use struct
-        return float_to_decimal(struct.unpack("<I", in_bytes)[0])
+        return float_to_decimal(int.from_bytes(in_bytes, "little"))
 
     def from_python(self, value: Decimal):
         return struct.pack("<I", int(value))[:-1]  # removed last unused byte.
 
 
-class Word(CorusDataABC):
+class Word(MemoizedDecodeMixin, CorusDataABC):
     """
     16 bit unsigned integer
     """
@@ -133,7 +159,7 @@ class Word(CorusDataABC):
     VALUE_TYPE = Decimal
 
     @classmethod
-    def to_python(cls, in_bytes: bytes):
+    def _to_python(cls, in_bytes: bytes):
         return float_to_decimal(struct.unpack("<H", in_bytes)[0])
 
     def from_python(self, value: Decimal):
@@ -166,8 +192,7 @@ class EULong(CorusDataABC):
 
     @classmethod
     def to_python(cls, in_bytes: bytes):
-        in_bytes = in_bytes + b"\x00\x00\x00"  # pad with 3 bytes to use struct
-        return float_to_decimal(struct.unpack("<Q", in_bytes)[0])
+        return float_to_decimal(int.from_bytes(in_bytes, "little"))
 
     def from_python(self, value: Decimal):
         return struct.pack("<Q", int(value))[:-3]
@@ -189,7 +214,7 @@ class Float(CorusDataABC):
         return struct.pack("<f", float(value))
 
 
-class Float1(CorusDataABC):
+class Float1(MemoizedDecodeMixin, CorusDataABC):
     """
     16 bit signed integer with multiplier coefficient of 100.
     Only used for temperatures in the database.
@@ -200,7 +225,7 @@ class Float1(CorusDataABC):
     VALUE_TYPE = Decimal
 
     @classmethod
-    def to_python(cls, in_bytes: bytes):
+    def _to_python(cls, in_bytes: bytes):
 
         return float_to_decimal(struct.unpack("<h", in_bytes)[0]) / Decimal("100")
 
@@ -208,7 +233,7 @@ class Float1(CorusDataABC):
         return struct.pack("<h", int(value))
 
 
-class Float2(CorusDataABC):
+class Float2(MemoizedDecodeMixin, CorusDataABC):
     """
     16 bit structure containing value and exponent.
     bit 0-14 = number, bit 15 = exponent
@@ -220,7 +245,7 @@ class Float2(CorusDataABC):
     VALUE_TYPE = Decimal
 
     @classmethod
-    def to_python(cls, in_bytes: bytes):
+    def _to_python(cls, in_bytes: bytes):
         val = struct.unpack("<H", in_bytes)[0]
         num = val & 0b0111111111111111
         exp = ((val & 0b1000000000000000) >> 15) - 3
@@ -237,7 +262,7 @@ class Float2(CorusDataABC):
         return struct.pack("<H", (integer + encoded_exponent))
 
 
-class Float3(CorusDataABC):
+class Float3(MemoizedDecodeMixin, CorusDataABC):
     """
     16 bit structure containing value and exponent.
     bit 0-13 = number, bit 14-15 = exponent
@@ -249,7 +274,7 @@ class Float3(CorusDataABC):
     VALUE_TYPE = Decimal
 
     @classmethod
-    def to_python(cls, in_bytes: bytes):
+    def _to_python(cls, in_bytes: bytes):
         val = struct.unpack("<H", in_bytes)[0]
         num = val & 0b0011111111111111
         exp = ((val & 0b1100000000000000) >> 14) - 1
@@ -300,10 +325,8 @@ class Index9(CorusDataABC):
 
     @classmethod
     def to_python(cls, in_bytes: bytes):
-        integer_bytes = in_bytes[:5] + b"\x00\x00\x00"  # pad so we can use struct.
-        fraction_bytes = in_bytes[5:]
-        integer = struct.unpack("<Q", integer_bytes)[0]
-        fraction = struct.unpack("<I", fraction_bytes)[0]
+        integer = int.from_bytes(in_bytes[:5], "little")
+        fraction = int.from_bytes(in_bytes[5:], "little")
 
         return (
             Decimal(integer) + (Decimal(fraction) / Decimal("100000000"))
@@ -344,7 +367,7 @@ class CorusString(CorusDataABC):
 
     @classmethod
     def to_python(cls, in_bytes: bytes):
-        return in_bytes.rstrip(b"\x00").decode("latin-1")
+        return bytes(in_bytes).rstrip(b"\x00").decode("latin-1")
 
     def from_python(self, value: str):
         out_bytes = value.encode("latin-1")
@@ -367,6 +390,12 @@ class DatabaseRecordParameter:
     data_class: Type[CorusDataABC]
     affected_by_pulse_input: bool = attr.ib(default=False)
     multiplied: Optional[Decimal] = attr.ib(default=None)
+    # Bit in the options bitmask of a database read request that selects the value.
+    # Values without an option bit are always sent by the device.
+    option_bit: Optional[int] = attr.ib(default=None)
+    # How the value is combined into rollups over longer periods: "sum", "min", "max"
+    # or "average". Values without an aggregate are left out of rollups.
+    aggregate: Optional[str] = attr.ib(default=None)
 
 
 @attr.s(auto_attribs=True)
@@ -0,0 +1,264 @@
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Sequence, Dict, Any, Iterable, List, Optional, Type, TextIO
+
+from iflag import data
+from iflag.data import DatabaseRecordParameter, CorusDataABC
+
+# Column types used by the writers. Data classes that are not listed are numeric
+# values that are handled as decimal.Decimal.
+TIMESTAMP = "timestamp"
+INTEGER = "integer"
+STRING = "string"
+DECIMAL = "decimal"
+
+COLUMN_TYPES: Dict[Type[CorusDataABC], Optional[str]] = {
+    data.Date: TIMESTAMP,
+    data.Byte: INTEGER,
+    data.CorusString: STRING,
+    data.Null2: None,
+    data.Null4: None,
+}
+
+
+def column_type(data_class: Type[CorusDataABC]) -> Optional[str]:
+    """
+    Returns the column type used when exporting values of the data class. None means
+    the data class never holds a value and no column is written for it.
+    """
+    return COLUMN_TYPES.get(data_class, DECIMAL)
+
+
+def json_default(value: Any) -> Any:
+    """
+    Default function for json.dumps that keeps the precision of Decimals by encoding
+    them as strings and encodes datetimes in ISO 8601 format.
+    """
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+def record_as_dict(record: Any) -> Dict[str, Any]:
+    """
+    Returns the record as a dict. Records decoded to namedtuples are converted, dicts
+    are returned as is.
+    """
+    if isinstance(record, tuple) and hasattr(record, "_asdict"):
+        return record._asdict()
+    return record
+
+
+class RecordWriter:
+    """
+    Base class for writers that take database records incrementally and write them to
+    a sink without keeping them in memory.
+
+    :param layout: The DatabaseRecordParameters of the records that will be written.
+        Columns are written in the layout order.
+    """
+
+    def __init__(self, layout: Sequence[DatabaseRecordParameter]):
+        self.columns: List[DatabaseRecordParameter] = [
+            parameter
+            for parameter in layout
+            if column_type(parameter.data_class) is not None
+        ]
+        self.column_names = [parameter.name for parameter in self.columns]
+        self.records_written = 0
+
+    def write(self, record: Any) -> None:
+        """
+        Writes a single record.
+        """
+        self.write_batch([record])
+
+    def write_batch(self, records: Sequence[Any]) -> None:
+        """
+        Writes a batch of records. Records can be dicts or namedtuples.
+        """
+        self._write_batch([record_as_dict(record) for record in records])
+        self.records_written += len(records)
+
+    def write_all(self, records: Iterable[Any], batch_size: int = 1000):
+        """
+        Consumes an iterable of records and writes them in batches of batch_size.
+        """
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+    def _write_batch(self, records: Sequence[Dict[str, Any]]) -> None:
+        raise NotImplementedError("Must be defined in subclass")
+
+    def close(self) -> None:
+        """
+        Flushes any pending data to the sink.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CsvRecordWriter(RecordWriter):
+    """
+    Writes records as CSV with a header row. Missing values are written as empty
+    fields.
+
+    :param file: Text file object opened with newline="".
+    """
+
+    def __init__(self, file: TextIO, layout: Sequence[DatabaseRecordParameter]):
+        super().__init__(layout)
+        self.file = file
+        self._writer = csv.writer(file)
+        self._header_written = False
+
+    def _write_batch(self, records: Sequence[Dict[str, Any]]) -> None:
+        if not self._header_written:
+            self._writer.writerow(self.column_names)
+            self._header_written = True
+        for record in records:
+            self._writer.writerow(
+                [self._format(record.get(name)) for name in self.column_names]
+            )
+
+    @staticmethod
+    def _format(value: Any) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    def close(self) -> None:
+        self.file.flush()
+
+
+class NdjsonRecordWriter(RecordWriter):
+    """
+    Writes records as newline delimited JSON. One JSON object per line.
+
+    :param file: Text file object.
+    """
+
+    def __init__(self, file: TextIO, layout: Sequence[DatabaseRecordParameter]):
+        super().__init__(layout)
+        self.file = file
+
+    def _write_batch(self, records: Sequence[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        lines = [
+            json.dumps(
+                {name: record.get(name) for name in self.column_names},
+                default=json_default,
+            )
+            for record in records
+        ]
+        self.file.write("\n".join(lines) + "\n")
+
+    def close(self) -> None:
+        self.file.flush()
+
+
+class ParquetRecordWriter(RecordWriter):
+    """
+    Writes records to a Parquet file. Each batch passed to `write_batch` is written as
+    a row group. Single records passed to `write` are buffered until row_group_size
+    records are collected.
+
+    Requires pyarrow, install with `pip install iflag[parquet]`.
+
+    :param path: Path or writable binary file object.
+    :param row_group_size: Number of buffered single records that make a row group.
+    :param decimal_scale: Number of decimals to keep for decimal columns.
+    """
+
+    def __init__(
+        self,
+        path,
+        layout: Sequence[DatabaseRecordParameter],
+        row_group_size: int = 10000,
+        decimal_scale: int = 9,
+    ):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                "ParquetRecordWriter requires pyarrow. "
+                "Install it with `pip install iflag[parquet]`"
+            ) from e
+        super().__init__(layout)
+        self._pa = pyarrow
+        self.row_group_size = row_group_size
+        self._quantize = Decimal(1).scaleb(-decimal_scale)
+        arrow_types = {
+            TIMESTAMP: pyarrow.timestamp("s"),
+            INTEGER: pyarrow.int64(),
+            STRING: pyarrow.string(),
+            DECIMAL: pyarrow.decimal128(38, decimal_scale),
+        }
+        self.schema = pyarrow.schema(
+            [
+                (parameter.name, arrow_types[column_type(parameter.data_class)])
+                for parameter in self.columns
+            ]
+        )
+        self._decimal_columns = {
+            parameter.name
+            for parameter in self.columns
+            if column_type(parameter.data_class) == DECIMAL
+        }
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self._buffer: List[Dict[str, Any]] = []
+
+    def write(self, record: Any) -> None:
+        self._buffer.append(record_as_dict(record))
+        self.records_written += 1
+        if len(self._buffer) >= self.row_group_size:
+            self._flush_buffer()
+
+    def _write_batch(self, records: Sequence[Dict[str, Any]]) -> None:
+        self._flush_buffer()
+        if not records:
+            return
+        columns = []
+        for name in self.column_names:
+            values = [record.get(name) for record in records]
+            if name in self._decimal_columns:
+                values = [
+                    None if value is None else value.quantize(self._quantize)
+                    for value in values
+                ]
+            columns.append(values)
+        table = self._pa.Table.from_arrays(
+            [
+                self._pa.array(values, type=field.type)
+                for values, field in zip(columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self._writer.write_table(table)
+
+    def _flush_buffer(self) -> None:
+        if self._buffer:
+            buffered, self._buffer = self._buffer, []
+            self._write_batch(buffered)
+
+    def close(self) -> None:
+        self._flush_buffer()
+        self._writer.close()
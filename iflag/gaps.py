@@ -0,0 +1,92 @@
+"""
+Detection of missing records in stored database histories.
+
+Interval records are stored with the time they end. With the interval duration known,
+the missing records between two points in time can be computed from the stored times
+alone, so only the missing ranges have to be read from the meter again.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+import attr
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Gap:
+    """
+    A range of missing records. start is the time of the oldest missing record and
+    stop the time of the newest, both inclusive.
+    """
+
+    start: datetime
+    stop: datetime
+    interval: timedelta
+
+    @property
+    def record_count(self) -> int:
+        return (self.stop - self.start) // self.interval + 1
+
+    def as_read(self, database: str) -> Tuple[str, datetime, datetime]:
+        """
+        Returns the (database, start, stop) tuple for `CorusClient.read_databases`.
+        Databases are read newest first so the stop of the gap is the start of the
+        read.
+        """
+        return database, self.stop, self.start
+
+
+def find_gaps(
+    times: Iterable[datetime],
+    interval: timedelta,
+    since: datetime,
+    until: datetime,
+    merge_within: int = 0,
+) -> List[Gap]:
+    """
+    Finds the ranges of missing records between since and until, both inclusive.
+
+    :param times: Times of the stored records, in any order. Times outside the window
+        are ignored.
+    :param interval: Time between two records.
+    :param since: Time of the oldest record that should be stored.
+    :param until: Time of the newest record that should be stored.
+    :param merge_within: Gaps separated by this many stored records or less are
+        merged, trading a few records read twice for fewer requests.
+
+    If since and until are not on the grid of the stored record times they are moved
+    inwards to the first and last record time of the window.
+    """
+    if interval <= timedelta(0):
+        raise ValueError("interval must be positive")
+    times = set(times)
+    if times:
+        anchor = next(iter(times))
+        since += (anchor - since) % interval
+        until -= (until - anchor) % interval
+    if since > until:
+        return []
+    stored = sorted(time for time in times if since <= time <= until)
+
+    gaps: List[Gap] = []
+    # The last stored time before the current position, starting just before since.
+    previous = since - interval
+    for time in stored + [until + interval]:
+        if time - previous > interval:
+            gaps.append(Gap(previous + interval, time - interval, interval))
+        previous = time
+
+    if merge_within <= 0 or len(gaps) < 2:
+        return gaps
+    merged = [gaps[0]]
+    for gap in gaps[1:]:
+        last = merged[-1]
+        present = (gap.start - last.stop) // interval - 1
+        if present <= merge_within:
+            merged[-1] = Gap(last.start, gap.stop, interval)
+        else:
+            merged.append(gap)
+    return merged
+
+
+def missing_record_count(gaps: Iterable[Gap]) -> int:
+    return sum(gap.record_count for gap in gaps)
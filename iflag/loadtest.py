@@ -0,0 +1,217 @@
+"""
+Load test of `CorusClient` sessions against fake meters.
+
+    python -m iflag.loadtest --meters 200 --records 2000 --concurrency 1,10,50,200
+
+The fake meters of `iflag.testing` are served from a thread in this process and speak
+the real framing, so the whole client stack is exercised: connect, wakeup, sign on, a
+multi frame database read with an ACK per frame, decoding and break. For each
+concurrency level every meter is read once by blocking sessions in a thread pool of
+that size. Used to size collector hosts and to catch scaling regressions.
+
+CPU per session is the CPU time of the thread that ran the session, so the fake meters
+are not counted. Peak RSS is the peak of the whole process so far, including the fake
+meters, and never goes down between levels.
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Sequence, TextIO, Tuple
+
+import attr
+
+from iflag import CorusClient
+from iflag.cli import percentile
+from iflag.testing import FakeMeter, FakeMeterServer, INTERVAL_LAYOUT, interval_records
+from iflag.transport import TcpTransport
+
+try:
+    _thread_time = time.thread_time
+except AttributeError:  # Python 3.6
+    _thread_time = time.process_time
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process in bytes, or None where the
+    resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+@attr.s(auto_attribs=True)
+class LoadResult:
+    """
+    Result of reading all meters once at a concurrency level.
+    """
+
+    concurrency: int
+    elapsed: float
+    records: int = 0
+    latencies: List[float] = attr.ib(factory=list)
+    cpu_times: List[float] = attr.ib(factory=list)
+    errors: Counter = attr.ib(factory=Counter)
+    peak_rss: Optional[int] = None
+
+    @property
+    def sessions(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def meters_per_minute(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return len(self.latencies) * 60 / self.elapsed
+
+    @property
+    def cpu_per_session(self) -> float:
+        if not self.cpu_times:
+            return 0.0
+        return sum(self.cpu_times) / len(self.cpu_times)
+
+    def format(self) -> str:
+        rss = "-" if self.peak_rss is None else f"{self.peak_rss / 2 ** 20:.0f}"
+        return (
+            f"{self.concurrency:>11} {self.meters_per_minute:>12.0f} "
+            f"{percentile(self.latencies, 0.5) * 1000:>8.1f} "
+            f"{percentile(self.latencies, 0.99) * 1000:>8.1f} "
+            f"{self.cpu_per_session * 1000:>12.2f} {rss:>8} "
+            f"{sum(self.errors.values()):>6}"
+        )
+
+
+HEADER = (
+    f"{'concurrency':>11} {'meters/min':>12} {'p50 ms':>8} {'p99 ms':>8} "
+    f"{'cpu/sess ms':>12} {'rss MiB':>8} {'errors':>6}"
+)
+
+
+def read_meter(
+    address: Tuple[str, int], database: str, timeout: float
+) -> Tuple[float, float, int]:
+    """
+    Reads a database in one session. Returns the session time, the CPU time of the
+    session and the number of records.
+    """
+    started = time.monotonic()
+    cpu_started = _thread_time()
+    client = CorusClient(
+        TcpTransport(address, timeout=timeout),
+        database_layout=INTERVAL_LAYOUT,
+        input_pulse_weight=Decimal("1"),
+    )
+    try:
+        client.startup()
+        records = client.read_database(database)
+        client.shutdown()
+    except Exception:
+        client.transport.disconnect()
+        raise
+    return time.monotonic() - started, _thread_time() - cpu_started, len(records)
+
+
+def run_level(
+    addresses: Sequence[Tuple[str, int]],
+    concurrency: int,
+    database: str = "interval",
+    timeout: float = 60,
+) -> LoadResult:
+    """
+    Reads every meter once with concurrency sessions at a time.
+    """
+    started = time.monotonic()
+    result = LoadResult(concurrency=concurrency, elapsed=0.0)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(read_meter, address, database, timeout)
+            for address in addresses
+        ]
+        for future in futures:
+            try:
+                latency, cpu_time, records = future.result()
+            except Exception as e:
+                result.errors[type(e).__name__] += 1
+                continue
+            result.latencies.append(latency)
+            result.cpu_times.append(cpu_time)
+            result.records += records
+    result.elapsed = time.monotonic() - started
+    result.peak_rss = peak_rss()
+    return result
+
+
+def run(args: argparse.Namespace, stdout: TextIO) -> List[LoadResult]:
+    records = interval_records(args.records, newest=datetime(2020, 1, 1))
+    meters = [FakeMeter(databases={"interval": records}) for _ in range(args.meters)]
+    results = []
+    with FakeMeterServer(meters, latency=args.latency) as server:
+        stdout.write(
+            f"{args.meters} meters, {args.records} records of "
+            f"{len(records[0]) if records else 0} bytes each, "
+            f"latency {args.latency * 1000:.0f} ms\n"
+        )
+        stdout.write(HEADER + "\n")
+        for concurrency in args.concurrency:
+            result = run_level(server.addresses, concurrency, timeout=args.timeout)
+            stdout.write(result.format() + "\n")
+            stdout.flush()
+            for error, count in result.errors.most_common():
+                stdout.write(f"{'':>11} {count} x {error}\n")
+            results.append(result)
+    return results
+
+
+def parse_concurrency(value: str) -> List[int]:
+    try:
+        levels = [int(level) for level in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid concurrency levels {value!r}")
+    if not levels or min(levels) < 1:
+        raise argparse.ArgumentTypeError("Concurrency levels must be at least 1")
+    return levels
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m iflag.loadtest",
+        description="Read fake meters at increasing concurrency and report throughput.",
+    )
+    parser.add_argument("--meters", type=int, default=100, help="Number of meters")
+    parser.add_argument(
+        "--records", type=int, default=1000, help="Interval records per meter"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=parse_concurrency,
+        default=[1, 10, 50, 100],
+        help="Comma separated concurrent session counts to run",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds each answer of the meters is delayed",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Socket timeout of the sessions"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    results = run(parse_args(argv), sys.stdout)
+    return 1 if any(result.errors for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@ import attr
 from iflag import utils
 from typing import List
 
+# Options bitmask of a database read request that requests all values in the records.
+ALL_VALUES_BITMASK = b"\xF9\xFF\xFF\xFF"
+
 
 class CorusMessageABC(abc.ABC):
     """
@@ -82,12 +85,16 @@ class ReadDatabaseRequest(CorusMessageABC):
     Class to structure a read database request to device.
     The session persistence feature has been turned off to make a more predictable
     client implementation.
-    The "count records" feature has been turned off since it is not used.
-    The request will always request all data available in the database.
+    With the "count records" feature the device responds with the number of records
+    that match the request instead of the records. See `DatabaseCount`.
+    By default the request will request all data available in the database. A subset of
+    the values can be requested by clearing bits in the options bitmask.
 
     :param database: The database to read.
     :param start: The date for the newest values to request
     :param stop: The date for the oldest value to request
+    :param options_bitmask: 4 bytes selecting which values to include in the records.
+    :param count_records: Only request the number of records.
     """
 
     db_id_map = {
@@ -99,15 +106,20 @@ class ReadDatabaseRequest(CorusMessageABC):
         "parameter": 5,
     }
 
-    def __init__(self, database="interval", start=None, stop=None):
+    def __init__(
+        self,
+        database="interval",
+        start=None,
+        stop=None,
+        options_bitmask=None,
+        count_records=False,
+    ):
         self.database = database
         self.start = start
         self.stop = stop
         self.session_persistence = False  # otherwise it will resend last failure.
-        self.count_records = (
-            False
-        )  # otherwise we would get number of records in first frame
-        self.options_bitmask = b"\xF9\xFF\xFF\xFF"  # all values!
+        self.count_records = count_records
+        self.options_bitmask = options_bitmask or ALL_VALUES_BITMASK
 
     @property
     def db_byte(self) -> bytes:
@@ -118,10 +130,10 @@ class ReadDatabaseRequest(CorusMessageABC):
 
         b = self.db_id_map[self.database]
         if self.session_persistence:
-            b &= 0b10000000
+            b |= 0b10000000
 
         if self.count_records:
-            b &= 0b00010000
+            b |= 0b00010000
 
         return b.to_bytes(1, "big")
 
@@ -142,6 +154,67 @@ class ReadDatabaseRequest(CorusMessageABC):
             f"{self.__class__.__name__}("
             f"database={self.database!r}, "
             f"start={self.start!r}, "
-            f"stop={self.stop!r}"
+            f"stop={self.stop!r}, "
+            f"options_bitmask={self.options_bitmask!r}, "
+            f"count_records={self.count_records!r}"
             f")"
         )
+
+
+# Maximum amount of record data in a database response frame. The length byte limits the
+# frame data to 255 bytes and 2 of them are used for the frame number.
+DATABASE_FRAME_PAYLOAD = 253
+# Bytes in a frame that are not frame data. SOH, length, ETX and CRC.
+FRAME_OVERHEAD = 5
+
+
+@attr.s(auto_attribs=True)
+class DatabaseCount:
+    """
+    The response to a database read request with the "count records" feature. Used to
+    know how large a database read will be before it is made.
+    """
+
+    database: str
+    record_count: int
+    record_size: int
+
+    @classmethod
+    def from_frame_data(cls, database: str, frame_data: bytes):
+        """
+        The count response is a single frame with the frame number, the record size and
+        the number of records as a little endian 16 bit integer.
+        """
+        record_size = frame_data[2]
+        if record_size == 0:
+            return cls(database=database, record_count=0, record_size=0)
+        record_count = int.from_bytes(frame_data[3:5], "little")
+        return cls(database=database, record_count=record_count, record_size=record_size)
+
+    @property
+    def total_bytes(self) -> int:
+        return self.record_count * self.record_size
+
+    @property
+    def frame_count(self) -> int:
+        """
+        Number of frames the database read will be sent in. The first frame also
+        holds the record size.
+        """
+        if not self.record_count:
+            return 1
+        return -(-(self.total_bytes + 1) // DATABASE_FRAME_PAYLOAD)
+
+    def estimated_transfer_time(
+        self, bytes_per_second: float = 960.0, round_trip_time: float = 0.5
+    ) -> float:
+        """
+        Estimates the time in seconds to transfer the records. Each frame costs a round
+        trip for the ACK and the frame bytes at the speed of the link.
+
+        :param bytes_per_second: Speed of the link. Default is 9600 baud.
+        :param round_trip_time: Latency for sending an ACK and receiving the start of
+            the next frame.
+        """
+        frame_bytes = self.total_bytes + 1 + self.frame_count * (FRAME_OVERHEAD + 2)
+        return self.frame_count * round_trip_time + frame_bytes / bytes_per_second
@@ -0,0 +1,552 @@
+"""
+Single threaded multiplexer that collects data from many meters at the same time.
+
+Each meter is a `MeterSession` with a non-blocking socket and its own `CorusProtocol`.
+The `Multiplexer` waits on all sockets with `selectors` and advances the session of a
+socket when it is readable or writable, so thousands of sessions that mostly wait on
+network latency can run in one thread.
+"""
+import errno
+import logging
+import selectors
+import socket
+import time
+from collections import deque
+from datetime import datetime, tzinfo
+from decimal import Decimal
+from typing import (
+    List,
+    Optional,
+    Tuple,
+    Any,
+    Dict,
+    Sequence,
+    Generator,
+    Deque,
+    Union,
+    Iterator,
+    Callable,
+)
+
+import attr
+
+from iflag import parse, exceptions
+from iflag.client import DatabaseConfig
+from iflag.data import IFlagParameter, Float
+from iflag.clock import (
+    ClockReading,
+    ClockSyncResult,
+    plan_clock_write,
+    to_meter_time,
+)
+from iflag.messages import ReadRequest, ReadDatabaseRequest, WriteRequest, WriteData
+from iflag.protocol import (
+    CorusProtocol,
+    RetryPolicy,
+    Event,
+    SendData,
+    ProtocolFailed,
+    ResponseReceived,
+    RecordsReceived,
+    WriteAcknowledged,
+)
+from iflag.scheduler import Scheduler, Job
+
+logger = logging.getLogger(__name__)
+
+
+
+@attr.s(auto_attribs=True)
+class Stream:
+    """
+    Step that starts an exchange like bytes do, but resumes the operation with the
+    events received so far each time data arrives instead of once when the exchange
+    is done. The operation yields None to wait for more events until the protocol is
+    idle.
+    """
+
+    data: bytes
+
+
+# Generator that yields bytes to send, SendData to send them after a delay, or Stream,
+# and receives the events of the exchange.
+Steps = Generator[Union[bytes, SendData, Stream, None], List[Event], Any]
+
+
+class Operation:
+    """
+    Base class for operations of a meter session. Operations can be shared between
+    sessions.
+    """
+
+    def run(self, session: "MeterSession") -> Steps:
+        raise NotImplementedError("Must be defined in subclass")
+
+
+class ReadParameters(Operation):
+    """
+    Reads parameters. The result is a dict like `CorusClient.read_parameters`.
+    """
+
+    def __init__(self, parameters: List[IFlagParameter]):
+        self.parameters = parameters
+
+    def run(self, session: "MeterSession") -> Steps:
+        msg = ReadRequest([parameter.id for parameter in self.parameters])
+        events = yield session.protocol.request(msg.to_bytes())
+        response = [event for event in events if isinstance(event, ResponseReceived)]
+        return parse.parse_corus_response(response[-1].data, self.parameters)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(parameters={self.parameters!r})"
+
+
+class ReadDatabase(Operation):
+    """
+    Reads a database. The result is a list of dicts like `CorusClient.read_database`.
+    If no pulse weight is given it is read from the meter first. Compiled record
+    layouts are cached on the operation. Records are decoded as the frames arrive.
+
+    :param on_records: Called with the session and the decoded records of each
+        received frame. The records are then not kept and the result is the number
+        of records read.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        database_layout: DatabaseConfig,
+        start: Optional[datetime] = None,
+        stop: Optional[datetime] = None,
+        input_pulse_weight: Optional[Decimal] = None,
+        fields: Optional[Sequence[str]] = None,
+        on_records: Optional[Callable[["MeterSession", List[Any]], None]] = None,
+    ):
+        self.database = database
+        self.database_layout = database_layout
+        self.start = start
+        self.stop = stop
+        self.input_pulse_weight = input_pulse_weight
+        self.fields = fields
+        self.on_records = on_records
+        self._decoders: Dict[int, parse.RecordDecoder] = {}
+
+    def _decoder(self, record_length: int) -> parse.RecordDecoder:
+        decoder = self._decoders.get(record_length)
+        if decoder is None:
+            try:
+                parameters = self.database_layout[self.database][record_length]
+            except KeyError:
+                raise exceptions.CorusClientError(
+                    "Unable to find parsing config for database that fit the record "
+                    "length"
+                )
+            decoder = parse.RecordDecoder(parameters, self.fields)
+            self._decoders[record_length] = decoder
+        return decoder
+
+    def run(self, session: "MeterSession") -> Steps:
+        pulse_weight = self.input_pulse_weight or session.input_pulse_weight
+        if pulse_weight is None:
+            weight_parameter = IFlagParameter(1, data_class=Float)
+            parameters = yield from ReadParameters([weight_parameter]).run(session)
+            pulse_weight = session.input_pulse_weight = parameters[1]
+
+        msg = ReadDatabaseRequest(
+            database=self.database, start=self.start, stop=self.stop
+        )
+        events = yield Stream(session.protocol.read_database(msg.to_bytes()))
+        out = []
+        count = 0
+        while True:
+            for event in events:
+                if not isinstance(event, RecordsReceived) or not event.records:
+                    continue
+                decoder = self._decoder(len(event.records[0]))
+                records = [
+                    decoder.decode(record, pulse_weight) for record in event.records
+                ]
+                count += len(records)
+                if self.on_records is None:
+                    out.extend(records)
+                else:
+                    self.on_records(session, records)
+            if session.protocol.is_idle:
+                break
+            events = yield None
+        return out if self.on_records is None else count
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(database={self.database!r}, "
+            f"start={self.start!r}, stop={self.stop!r})"
+        )
+
+
+class SyncClock(Operation):
+    """
+    Reads the clock of the meter and sets it if it differs more than tolerance
+    seconds, like `CorusClient.sync_clock`. The result is a `ClockSyncResult`.
+    """
+
+    def __init__(
+        self,
+        clock_parameter: IFlagParameter,
+        tolerance: float = 1.0,
+        align: bool = True,
+        timezone: Optional[tzinfo] = None,
+    ):
+        self.clock_parameter = clock_parameter
+        self.tolerance = tolerance
+        self.align = align
+        self.timezone = timezone
+
+    def run(self, session: "MeterSession") -> Steps:
+        sent_at = time.time()
+        values = yield from ReadParameters([self.clock_parameter]).run(session)
+        reading = ClockReading.from_exchange(
+            values[self.clock_parameter.id], sent_at, time.time(), self.timezone
+        )
+        if abs(reading.offset) <= self.tolerance:
+            return ClockSyncResult(reading)
+
+        send_at, value = plan_clock_write(reading.round_trip_time, self.align)
+        written_time = to_meter_time(value, self.timezone)
+        data = self.clock_parameter.data_class(written_time).to_bytes()
+        msg = WriteRequest([WriteData(id=self.clock_parameter.id, data=data)])
+        events = yield SendData(
+            session.protocol.write(msg.to_bytes()), max(0.0, send_at - time.time())
+        )
+        ack = [event for event in events if isinstance(event, WriteAcknowledged)]
+        if not ack[-1].accepted:
+            raise exceptions.CommunicationError(f"Error in sending {msg}")
+        return ClockSyncResult(reading, written_time)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(clock_parameter={self.clock_parameter!r}, "
+            f"tolerance={self.tolerance!r})"
+        )
+
+
+class MeterSession:
+    """
+    A collection session with one meter: connect, wakeup, sign on, run the operations
+    in order and send break. The result of each operation is added to results. If
+    the session fails error is set and the remaining operations are not run.
+
+    :param address: TCP/IP address and port tuple
+    :param operations: Operations to run in the session.
+    :param timeout: Seconds the whole session may take.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        operations: Sequence[Operation],
+        timeout: float = 120,
+        input_pulse_weight: Optional[Decimal] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
+        self.address = address
+        self.operations = operations
+        self.timeout = timeout
+        self.input_pulse_weight = input_pulse_weight
+        self.protocol = CorusProtocol(retry_policy)
+        self.results: List[Any] = []
+        self.error: Optional[Exception] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = False
+
+        self.socket: Optional[socket.socket] = None
+        self._steps: Optional[Steps] = None
+        self._connected = False
+        self._closing = False
+        self._out = bytearray()
+        self._delayed: Deque[Tuple[float, bytes]] = deque()
+        self._events: List[Event] = []
+        self._streaming = False
+
+    @property
+    def deadline(self) -> float:
+        return (self.started_at or 0.0) + self.timeout
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def _run_steps(self) -> Steps:
+        yield self.protocol.wakeup()
+        yield self.protocol.sign_on()
+        for operation in self.operations:
+            result = yield from operation.run(self)
+            self.results.append(result)
+
+    # Driven by the Multiplexer
+
+    def start(self) -> socket.socket:
+        self.started_at = time.monotonic()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(False)
+        code = self.socket.connect_ex(self.address)
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise exceptions.CommunicationError(
+                f"Unable to connect to {self.address}: {errno.errorcode.get(code)}"
+            )
+        return self.socket
+
+    def wants_write(self) -> bool:
+        return not self._connected or bool(self._out)
+
+    def on_writable(self) -> None:
+        if not self._connected:
+            code = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                raise exceptions.CommunicationError(
+                    f"Unable to connect to {self.address}: {errno.errorcode.get(code)}"
+                )
+            self._connected = True
+            self._steps = self._run_steps()
+            self._queue_step(next(self._steps))
+            return
+        sent = self.socket.send(self._out)
+        del self._out[:sent]
+        if self._closing and not self._out:
+            self.finish()
+
+    def on_readable(self) -> None:
+        data = self.socket.recv(4096)
+        if not data:
+            raise exceptions.CommunicationError(
+                f"Connection closed by device {self.address}"
+            )
+        for event in self.protocol.feed(data):
+            if isinstance(event, SendData):
+                if event.delay:
+                    self._delayed.append((time.monotonic() + event.delay, event.data))
+                else:
+                    self._queue(event.data)
+            elif isinstance(event, ProtocolFailed):
+                raise event.error
+            else:
+                self._events.append(event)
+        if self.protocol.is_idle or (self._streaming and self._events):
+            self._advance()
+
+    def on_timer(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            self._queue(self._delayed.popleft()[1])
+        if now > self.deadline:
+            raise exceptions.CommunicationError(
+                f"Session with {self.address} timed out"
+            )
+
+    def next_timer(self) -> float:
+        if self._delayed:
+            return min(self._delayed[0][0], self.deadline)
+        return self.deadline
+
+    def _advance(self) -> None:
+        events, self._events = self._events, []
+        try:
+            data = self._steps.send(events)
+        except StopIteration:
+            logger.debug("Session with %s done, sending break", self.address)
+            self._queue(self.protocol.send_break())
+            self._closing = True
+            return
+        self._queue_step(data)
+
+    def _queue_step(self, step: Union[bytes, SendData, Stream, None]) -> None:
+        if step is None:
+            # A streaming operation waits for more events.
+            return
+        self._streaming = isinstance(step, Stream)
+        if isinstance(step, Stream):
+            step = step.data
+        elif isinstance(step, SendData):
+            if step.delay > 0:
+                self._delayed.append((time.monotonic() + step.delay, step.data))
+                return
+            step = step.data
+        self._queue(step)
+
+    def _queue(self, data: bytes) -> None:
+        self._out += data
+
+    def fail(self, error: Exception) -> None:
+        logger.info("Session with %s failed: %s", self.address, error)
+        self.error = error
+        self.finish()
+
+    def finish(self) -> None:
+        if not self.done:
+            self.done = True
+            self.finished_at = time.monotonic()
+
+    def close(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(address={self.address!r}, "
+            f"operations={self.operations!r})"
+        )
+
+
+class Multiplexer:
+    """
+    Runs many meter sessions concurrently in a single thread. Sessions wait in a
+    `Scheduler` until they may be started.
+
+    :param max_sessions: Maximum number of sessions with an open connection.
+    :param max_sessions_per_host: Maximum number of open connections to the same host,
+        for meters behind the same gateway.
+    :param connection_rate: Maximum number of new connections per second.
+    :param scheduler: Scheduler to use instead of one created from the limits.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_sessions_per_host: Optional[int] = None,
+        connection_rate: Optional[float] = None,
+        scheduler: Optional[Scheduler] = None,
+    ):
+        self.scheduler = scheduler or Scheduler(
+            max_active=max_sessions,
+            max_active_per_host=max_sessions_per_host,
+            connection_rate=connection_rate,
+        )
+        self._active: Dict[MeterSession, Job] = {}
+        self._selector = selectors.DefaultSelector()
+        self.finished: List[MeterSession] = []
+
+    def add(
+        self,
+        session: MeterSession,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ) -> None:
+        """
+        Queues a session. Sessions with lower priority are started first. A session
+        that can't be started before the `time.monotonic()` deadline fails.
+        """
+        self.scheduler.add(
+            Job(
+                host=session.address[0],
+                item=session,
+                priority=priority,
+                deadline=deadline,
+            )
+        )
+
+    def run(self) -> List[MeterSession]:
+        """
+        Runs until all added sessions are done and returns them in the order they
+        finished.
+        """
+        for _ in self.iter_finished():
+            pass
+        return self.finished
+
+    def iter_finished(self) -> Iterator[MeterSession]:
+        """
+        Runs until all added sessions are done and yields each session as soon as it
+        has finished.
+        """
+        yielded = len(self.finished)
+        try:
+            while len(self.scheduler) or self._active:
+                self._start_pending()
+                self._poll()
+                while yielded < len(self.finished):
+                    yield self.finished[yielded]
+                    yielded += 1
+        finally:
+            self._selector.close()
+            self._selector = selectors.DefaultSelector()
+        # Sessions that expired or failed to start after the last poll.
+        yield from self.finished[yielded:]
+
+    def _start_pending(self) -> None:
+        while True:
+            job = self.scheduler.next_job()
+            self._expire_jobs()
+            if job is None:
+                return
+            session: MeterSession = job.item
+            try:
+                sock = session.start()
+            except (OSError, exceptions.CorusClientError) as e:
+                self.scheduler.release(job)
+                session.fail(e)
+                session.close()
+                self.finished.append(session)
+                continue
+            self._active[session] = job
+            self._selector.register(
+                sock, selectors.EVENT_READ | selectors.EVENT_WRITE, session
+            )
+
+    def _expire_jobs(self) -> None:
+        for job in self.scheduler.expired:
+            session: MeterSession = job.item
+            session.fail(
+                exceptions.CorusClientError("Deadline passed before session started")
+            )
+            self.finished.append(session)
+        self.scheduler.expired.clear()
+
+    def _poll(self) -> None:
+        now = time.monotonic()
+        timers = [session.next_timer() for session in self._active]
+        wait = self.scheduler.time_until_ready()
+        if wait is not None:
+            timers.append(now + wait)
+        if not timers:
+            return
+        timeout = max(0.0, min(timers) - now)
+        if not self._active:
+            time.sleep(timeout)
+            return
+        for key, mask in self._selector.select(timeout):
+            session: MeterSession = key.data
+            if session.done:
+                continue
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    session.on_writable()
+                if mask & selectors.EVENT_READ and not session.done:
+                    session.on_readable()
+            except Exception as e:
+                # Operations decode in these calls. Any error, like a decode error
+                # of a bad record, only fails the session it happened in.
+                session.fail(e)
+            self._update(session)
+
+        now = time.monotonic()
+        for session in list(self._active):
+            if session.done:
+                continue
+            try:
+                session.on_timer(now)
+            except Exception as e:
+                session.fail(e)
+            self._update(session)
+
+    def _update(self, session: MeterSession) -> None:
+        if session.done:
+            self.scheduler.release(self._active.pop(session))
+            self._selector.unregister(session.socket)
+            session.close()
+            self.finished.append(session)
+            return
+        events = selectors.EVENT_READ
+        if session.wants_write():
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(session.socket, events, session)
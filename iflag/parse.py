@@ -1,7 +1,11 @@
-from typing import Sequence, Dict, Any
+import collections
+import keyword
+from typing import Sequence, Dict, Any, Optional, List, Tuple, Type, Iterable
 from decimal import Decimal
 
-from iflag.data import IFlagParameter, DatabaseRecordParameter
+from iflag import exceptions
+from iflag.data import IFlagParameter, DatabaseRecordParameter, CorusDataABC
+from iflag.messages import ALL_VALUES_BITMASK
 
 
 def parse_corus_response(
@@ -51,28 +55,178 @@ def parse_corus_database_record(
     :param record: The record data in bytes.
     :return:
     """
-    correct_length = sum([parameter.data_class.LENGTH for parameter in parameters])
-    if len(record) != correct_length:
-        raise ValueError(
-            f"In data is not of correct length. Should be {correct_length} "
-            f"but is {len(record)}"
-        )
-    out_data = {}
-    index = 0
-    for parameter in parameters:
-        end_index = index + parameter.data_class.LENGTH
-        data = record[index:end_index]
-        index = end_index
-        data_instance = parameter.data_class.from_bytes(data)
-        value = data_instance.value
-        if value is None:
-            continue
-        if parameter.affected_by_pulse_input:
-            value = value * input_pulse_weight
+    return RecordDecoder(parameters).decode(record, input_pulse_weight)
 
-        if parameter.multiplied:
-            value = value / parameter.multiplied
 
-        out_data[parameter.name] = value
+def invalid_field_names(names: Iterable[str]) -> List[str]:
+    """
+    Returns the names that can't be fields of a namedtuple class. Fields must be
+    unique identifiers that are not keywords and don't start with an underscore.
+    """
+    seen = set()
+    invalid = []
+    for name in names:
+        if (
+            not name.isidentifier()
+            or keyword.iskeyword(name)
+            or name.startswith("_")
+            or name in seen
+        ):
+            invalid.append(name)
+        seen.add(name)
+    return invalid
 
-    return out_data
+
+class RecordDecoder:
+    """
+    A database record layout compiled for decoding many records. The offset of each
+    parameter in the record is computed once from the data class lengths. If fields
+    are given only those parameters are decoded, the rest of the record is skipped.
+
+    Records can be decoded to dicts or to instances of a namedtuple class that is
+    generated once for the decoder, with the decoded parameter names as fields. The
+    namedtuple uses a fraction of the memory of a dict per record.
+
+    :param parameters: Sequence of DatabaseRecordParameters. The positions in the list
+        reflects the data position in the record data.
+    :param fields: Names of the parameters to decode. None decodes all parameters.
+    :param named_tuples: Generate the namedtuple class when the decoder is built, so
+        names that can't be fields are rejected before any record is decoded.
+    """
+
+    def __init__(
+        self,
+        parameters: Sequence[DatabaseRecordParameter],
+        fields: Optional[Sequence[str]] = None,
+        named_tuples: bool = False,
+    ):
+        self.parameters = parameters
+        self.fields = fields
+        names = {parameter.name for parameter in parameters}
+        if fields is not None:
+            unknown = [field for field in fields if field not in names]
+            if unknown:
+                raise ValueError(f"Fields {unknown!r} are not in the record layout")
+
+        self.record_length = 0
+        self._decoders: List[Tuple[str, int, int, Type[CorusDataABC], bool, Any]] = []
+        for parameter in parameters:
+            start = self.record_length
+            self.record_length += parameter.data_class.LENGTH
+            if fields is not None and parameter.name not in fields:
+                continue
+            self._decoders.append(
+                (
+                    parameter.name,
+                    start,
+                    self.record_length,
+                    parameter.data_class,
+                    parameter.affected_by_pulse_input,
+                    parameter.multiplied,
+                )
+            )
+        self.names = [decoder[0] for decoder in self._decoders]
+        self._record_class: Optional[type] = None
+        if named_tuples:
+            self.record_class
+
+    @property
+    def record_class(self) -> type:
+        """
+        namedtuple class with a field for each decoded parameter.
+        """
+        if self._record_class is None:
+            invalid = invalid_field_names(self.names)
+            if invalid:
+                raise exceptions.DataError(
+                    f"Names {invalid!r} can not be used as fields of a record class"
+                )
+            self._record_class = collections.namedtuple("DatabaseRecord", self.names)
+        return self._record_class
+
+    def decode(self, record: bytes, input_pulse_weight: Decimal) -> Dict[str, Any]:
+        """
+        Converts a record to a result dict with the name of the
+        DatabaseRecordParameter as key. None values are left out.
+        """
+        if len(record) != self.record_length:
+            raise ValueError(
+                f"In data is not of correct length. Should be {self.record_length} "
+                f"but is {len(record)}"
+            )
+        out_data = {}
+        for name, start, end, data_class, pulse_input, multiplied in self._decoders:
+            data = record[start:end]
+            if data_class.is_none_data(data):
+                continue
+            value = data_class.to_python(data)
+            if value is None:
+                continue
+            if pulse_input:
+                value = value * input_pulse_weight
+
+            if multiplied:
+                value = value / multiplied
+
+            out_data[name] = value
+
+        return out_data
+
+    def decode_record(self, record: bytes, input_pulse_weight: Decimal) -> tuple:
+        """
+        Converts a record to an instance of the record class. None values are kept as
+        None.
+        """
+        if len(record) != self.record_length:
+            raise ValueError(
+                f"In data is not of correct length. Should be {self.record_length} "
+                f"but is {len(record)}"
+            )
+        values = []
+        for name, start, end, data_class, pulse_input, multiplied in self._decoders:
+            data = record[start:end]
+            if data_class.is_none_data(data):
+                values.append(None)
+                continue
+            value = data_class.to_python(data)
+            if value is not None:
+                if pulse_input:
+                    value = value * input_pulse_weight
+                if multiplied:
+                    value = value / multiplied
+            values.append(value)
+
+        return self.record_class._make(values)
+
+
+def options_bitmask_for_columns(
+    layouts: Iterable[Sequence[DatabaseRecordParameter]], columns: Sequence[str]
+) -> bytes:
+    """
+    Computes the options bitmask of a database read request that only requests the
+    given columns. The option bits of all other parameters in the layouts are cleared.
+
+    :param layouts: The record layouts of the database that is read.
+    :param columns: Names of the DatabaseRecordParameters to request.
+    :return: bitmask bytes
+    """
+    mask = int.from_bytes(ALL_VALUES_BITMASK, "little")
+    for parameters in layouts:
+        for parameter in parameters:
+            if parameter.option_bit is not None and parameter.name not in columns:
+                mask &= ~(1 << parameter.option_bit)
+    return mask.to_bytes(len(ALL_VALUES_BITMASK), "little")
+
+
+def reduce_record_layout(
+    parameters: Sequence[DatabaseRecordParameter], columns: Sequence[str]
+) -> List[DatabaseRecordParameter]:
+    """
+    Derives the layout of the records the device sends when only the given columns
+    are requested. Parameters without an option bit are always sent and are kept.
+    """
+    return [
+        parameter
+        for parameter in parameters
+        if parameter.option_bit is None or parameter.name in columns
+    ]
@@ -0,0 +1,63 @@
+import queue
+import threading
+from typing import Callable, Iterator, Iterable, List, Any, Optional
+
+
+class DecoderThread(threading.Thread):
+    """
+    Decodes batches of raw records in a background thread. The receiving thread puts
+    batches on a bounded queue so it is held back if decoding can't keep up, instead
+    of buffering without limit.
+
+    :param decode: Callable that takes an iterator of raw records and returns an
+        iterable of decoded records.
+    :param maxsize: Maximum number of batches waiting to be decoded.
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[Iterator[bytes]], Iterable[Any]],
+        maxsize: int = 64,
+    ):
+        super().__init__(name="iflag-decoder", daemon=True)
+        self.queue: "queue.Queue[Optional[List[bytes]]]" = queue.Queue(maxsize=maxsize)
+        self.results: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self._decode = decode
+
+    def _records(self) -> Iterator[bytes]:
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            yield from batch
+
+    def run(self):
+        records = self._records()
+        try:
+            self.results.extend(self._decode(records))
+        except BaseException as e:
+            self.error = e
+            # Keep emptying the queue so the receiving thread is never blocked.
+            for _ in records:
+                pass
+
+    def put(self, batch: List[bytes]) -> None:
+        self.queue.put(batch)
+
+    def finish(self) -> List[Any]:
+        """
+        Waits for all batches to be decoded and returns the decoded records. Errors in
+        decoding are raised here.
+        """
+        self.stop()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def stop(self) -> None:
+        """
+        Signals that no more batches will be put and waits for the thread to end.
+        """
+        self.queue.put(None)
+        self.join()
@@ -0,0 +1,478 @@
+"""
+Sans-I/O implementation of the Corus protocol.
+
+`CorusProtocol` holds the state of a session with a device but does no I/O itself.
+Methods that start an exchange return the bytes to send. Bytes received from the
+device, in chunks of any size, are passed to `feed` which returns the events they
+caused. Events of type `SendData` contain bytes the driver must send, like ACKs, and
+all other events report progress of the exchange. This lets blocking clients, threads,
+selector loops or asyncio drive the protocol the same way.
+"""
+import enum
+import logging
+from typing import List, Optional
+
+import attr
+
+from iflag import utils, exceptions
+
+logger = logging.getLogger(__name__)
+
+SOH = 0x01
+ETX = 0x03
+ACK = b"\x06"
+NACK = b"\x15"
+BREAK = b"\x01B0\x03!1"  # pre calculated CRC.
+WAKEUP = bytes(200)
+WAKEUP_RESPONSE = b"\x00\x00\x00"
+SIGN_ON = b"/?!\r\n"
+SIGN_ON_ACK = b"\x06\x30\x37\x36\x0d\x0a"
+PASS_LENGTH = 6
+
+
+@attr.s(auto_attribs=True)
+class RetryPolicy:
+    """
+    How corrupt frames are handled. A NACK is sent for a corrupt frame so the device
+    retransmits it, up to max_retries times per frame. The NACK can be delayed with an
+    exponential backoff to let a noisy line settle.
+
+    :param max_retries: Number of retransmits to request for a single frame.
+    :param backoff: Seconds to wait before the first NACK.
+    :param backoff_factor: Factor the wait is multiplied with for every retry.
+    :param resync_limit: Number of bytes to skip when looking for the start of the
+        next frame.
+    """
+
+    max_retries: int = 3
+    backoff: float = 0.0
+    backoff_factor: float = 2.0
+    resync_limit: int = 512
+
+    def delay(self, attempt: int) -> float:
+        return self.backoff * (self.backoff_factor ** attempt)
+
+
+class Event:
+    """Base class for events returned by `CorusProtocol.feed`"""
+
+
+@attr.s(auto_attribs=True)
+class SendData(Event):
+    """Data the driver must send to the device after waiting delay seconds"""
+
+    data: bytes
+    delay: float = 0.0
+
+
+@attr.s(auto_attribs=True)
+class FrameReceived(Event):
+    """A complete frame or message was received. Invalid frames are also reported."""
+
+    data: bytes
+    valid: bool = True
+
+
+@attr.s(auto_attribs=True)
+class WakeupCompleted(Event):
+    """The device answered the wakeup sequence"""
+
+
+@attr.s(auto_attribs=True)
+class SignOnCompleted(Event):
+    """The sign on is done and the device accepts requests"""
+
+    ident: bytes
+
+
+@attr.s(auto_attribs=True)
+class ResponseReceived(Event):
+    """The single frame response to a request"""
+
+    data: bytes
+
+
+@attr.s(auto_attribs=True)
+class WriteAcknowledged(Event):
+    """The device answered a write request"""
+
+    accepted: bool
+    response: bytes
+
+
+@attr.s(auto_attribs=True)
+class RecordsReceived(Event):
+    """
+    The records that were completed by a database frame. Progress counters include
+    this frame.
+    """
+
+    records: List[bytes]
+    frames_received: int
+    records_received: int
+
+
+@attr.s(auto_attribs=True)
+class DatabaseCompleted(Event):
+    """The last frame of a database read was received"""
+
+    frames_received: int
+    records_received: int
+
+
+@attr.s(auto_attribs=True)
+class ProtocolFailed(Event):
+    """The exchange failed. The protocol is ready for a new exchange."""
+
+    error: exceptions.CorusClientError
+
+
+class State(enum.Enum):
+    IDLE = "idle"
+    WAKEUP = "wakeup"
+    SIGN_ON_IDENT = "sign_on_ident"
+    SIGN_ON_PASS = "sign_on_pass"
+    SIGN_ON_ACK = "sign_on_ack"
+    RESPONSE = "response"
+    WRITE_ACK = "write_ack"
+    DATABASE = "database"
+    CLOSED = "closed"
+
+
+class CorusProtocol:
+    """
+    State machine of a Corus session.
+
+    :param retry_policy: How corrupt frames are retried.
+    """
+
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None):
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.state = State.IDLE
+        self._buffer = bytearray()
+        self._reset_exchange()
+
+    def _reset_exchange(self):
+        self._attempt = 0
+        self._record_data = bytearray()
+        self._record_size = 0
+        self._is_first_frame = True
+        self._previous_frame_number = 0
+        self._frames_received = 0
+        self._records_received = 0
+        self._ack_after_records = False
+
+    def _start(self, state: State, data: bytes) -> bytes:
+        if self.state is not State.IDLE:
+            raise exceptions.ProtocolError(
+                f"Can not start a new exchange in state {self.state.value!r}"
+            )
+        self._reset_exchange()
+        self.state = state
+        return data
+
+    @property
+    def is_idle(self) -> bool:
+        return self.state is State.IDLE
+
+    def wakeup(self) -> bytes:
+        """
+        Similar to IEC62056-21 it is needed to send a sequence of null bytes to the
+        device for it to wake up the interface. Protocol docs says at least 12 bytes but
+        other software uses 200 bytes. We will stick to 200 bytes to not get any issues.
+        The device should return 3 null bytes when it is ready.
+        """
+        return self._start(State.WAKEUP, WAKEUP)
+
+    def sign_on(self) -> bytes:
+        """
+        Similar sign on as IEC 62056-21. But no need to send a meter address. Device
+        returns identification that has no special meaning. At least not over TCP.
+        Then a standard Ack is sent.
+        Then a "Password" exchange is done, but not really, just send the code PASS back
+        and forth. So we just fast forward all of this to get to the correct state.
+        """
+        return self._start(State.SIGN_ON_IDENT, SIGN_ON)
+
+    def request(self, message: bytes) -> bytes:
+        """
+        Starts a request that is answered with a single frame, like a read request.
+        """
+        return self._start(State.RESPONSE, message)
+
+    def write(self, message: bytes) -> bytes:
+        """
+        Starts a write request that is answered with an ACK.
+        """
+        return self._start(State.WRITE_ACK, message)
+
+    def read_database(self, message: bytes, ack_after_records: bool = False) -> bytes:
+        """
+        Starts a database read request that is answered with one or more frames.
+
+        :param ack_after_records: Return the ACK of a frame after its RecordsReceived
+            event instead of before, so the records can be inspected before the next
+            frame is requested. Used to stop a read with a break.
+        """
+        data = self._start(State.DATABASE, message)
+        self._ack_after_records = ack_after_records
+        return data
+
+    def send_break(self) -> bytes:
+        """
+        Ends the session. Can be sent in any state.
+        """
+        self.state = State.CLOSED
+        self._buffer.clear()
+        return BREAK
+
+    def feed(self, data: bytes) -> List[Event]:
+        """
+        Processes received data and returns the events it caused. Data that is not
+        enough for a complete frame is kept until more data is fed.
+        """
+        self._buffer += data
+        events: List[Event] = []
+        while self._buffer and self.state not in (State.IDLE, State.CLOSED):
+            progressed = self._handlers[self.state](self, events)
+            if not progressed:
+                break
+        return events
+
+    def _fail(self, events: List[Event], error: exceptions.CorusClientError):
+        logger.debug("Protocol failed in state %s: %s", self.state.value, error)
+        self.state = State.IDLE
+        self._buffer.clear()
+        events.append(ProtocolFailed(error))
+
+    def _take(self, length: int) -> Optional[bytes]:
+        if len(self._buffer) < length:
+            return None
+        data = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+
+    def _handle_wakeup(self, events: List[Event]) -> bool:
+        response = self._take(len(WAKEUP_RESPONSE))
+        if response is None:
+            return False
+        events.append(FrameReceived(response, response == WAKEUP_RESPONSE))
+        if response != WAKEUP_RESPONSE:
+            self._fail(
+                events,
+                exceptions.ProtocolError(
+                    f"Received non null wakeup response: {response!r}"
+                ),
+            )
+            return True
+        self.state = State.IDLE
+        events.append(WakeupCompleted())
+        return True
+
+    def _handle_sign_on_ident(self, events: List[Event]) -> bool:
+        start = self._buffer.find(b"/")
+        if start < 0:
+            self._buffer.clear()
+            return False
+        end = self._buffer.find(b"\n", start)
+        if end < 0:
+            return False
+        self._ident = bytes(self._buffer[start : end + 1])
+        del self._buffer[: end + 1]
+        events.append(FrameReceived(self._ident))
+        events.append(SendData(SIGN_ON_ACK))
+        self.state = State.SIGN_ON_PASS
+        return True
+
+    def _handle_sign_on_pass(self, events: List[Event]) -> bool:
+        pass_msg = self._take(PASS_LENGTH)
+        if pass_msg is None:
+            return False
+        events.append(FrameReceived(pass_msg))
+        # TODO: check the crc
+        events.append(SendData(pass_msg))
+        self.state = State.SIGN_ON_ACK
+        return True
+
+    def _handle_sign_on_ack(self, events: List[Event]) -> bool:
+        ack = self._take(1)
+        if ack is None:
+            return False
+        events.append(FrameReceived(ack, ack == ACK))
+        if ack != ACK:
+            self._fail(events, exceptions.ProtocolError("Ack not received after sign on"))
+            return True
+        self.state = State.IDLE
+        events.append(SignOnCompleted(self._ident))
+        return True
+
+    def _handle_write_ack(self, events: List[Event]) -> bool:
+        ack = self._take(1)
+        if ack is None:
+            return False
+        events.append(FrameReceived(ack, ack == ACK))
+        self.state = State.IDLE
+        events.append(WriteAcknowledged(accepted=ack == ACK, response=ack))
+        return True
+
+    def _next_frame(self, events: List[Event]) -> Optional[bytes]:
+        """
+        Takes the next frame from the buffer and returns the frame data. Bytes before
+        the SOH, for example the rest of a corrupted frame, are skipped to resynchronise
+        with the stream. A corrupt frame is answered with a NACK.
+        Returns None if there is not enough data for a frame or the frame was corrupt.
+        """
+        start = self._buffer.find(bytes([SOH]))
+        skipped = len(self._buffer) if start < 0 else start
+        if skipped:
+            if skipped > self.retry_policy.resync_limit:
+                self._fail(
+                    events,
+                    exceptions.ProtocolError(
+                        f"No SOH received in {skipped} bytes. Unable to resynchronise"
+                    ),
+                )
+                return None
+            if start < 0:
+                return None
+            logger.debug("Skipped %s bytes before SOH", skipped)
+            del self._buffer[:skipped]
+
+        if len(self._buffer) < 2:
+            return None
+        data_length = self._buffer[1]
+        frame = self._take(data_length + 5)
+        if frame is None:
+            return None
+
+        in_bytes, crc = frame[:-2], frame[-2:]
+        if in_bytes[-1] != ETX:
+            self._frame_error(events, frame, "end char not ETX")
+            return None
+        if not utils.crc_valid(in_bytes, crc):
+            self._frame_error(events, frame, "Failed CRC check")
+            return None
+
+        events.append(FrameReceived(frame))
+        self._attempt = 0
+        return in_bytes[2:-1]
+
+    def _frame_error(self, events: List[Event], frame: bytes, reason: str):
+        events.append(FrameReceived(frame, valid=False))
+        if self._attempt >= self.retry_policy.max_retries:
+            self._fail(
+                events,
+                exceptions.CommunicationError("Maximum amounts of retries done. Aborting."),
+            )
+            return
+        delay = self.retry_policy.delay(self._attempt)
+        logger.debug("Frame error: %s. Sending NACK in %s s", reason, delay)
+        self._attempt += 1
+        events.append(SendData(NACK, delay=delay))
+
+    def _handle_response(self, events: List[Event]) -> bool:
+        event_count = len(events)
+        data = self._next_frame(events)
+        if data is None:
+            return len(events) > event_count
+        self.state = State.IDLE
+        events.append(ResponseReceived(data))
+        return True
+
+    def _handle_database(self, events: List[Event]) -> bool:
+        """
+        The rules for receiving are a but tricky, mainly because first frame have extra
+        data. It is described in more detail in the protocol documentation.
+        Records can span several frames so received data is buffered until a complete
+        record is available.
+        """
+        event_count = len(events)
+        frame_data = self._next_frame(events)
+        if frame_data is None:
+            return len(events) > event_count
+
+        # Framenumber is little endian!
+        frame_number = int.from_bytes(frame_data[:2], "little")
+        current_frame_number = frame_number & 0b0111111111111111
+        is_last_frame = bool(frame_number & 0b1000000000000000)
+
+        if self._is_first_frame:
+            # record_size is only sent in first frame...
+            self._record_size = frame_data[2] if len(frame_data) > 2 else 0
+            if self._record_size == 0:
+                # An empty response is indicated by the first frame also being
+                # the last frame and record size is 0. There are no records in the
+                # requested range.
+                if not is_last_frame:
+                    self._fail(events, exceptions.ProtocolError("Empty response"))
+                    return True
+                self.state = State.IDLE
+                self._frames_received = 1
+                events.append(RecordsReceived([], 1, 0))
+                events.append(DatabaseCompleted(1, 0))
+                return True
+            self._record_data += frame_data[3:]
+        else:
+            if current_frame_number == self._previous_frame_number:
+                # Our ACK was lost and the device sent the frame again.
+                logger.debug("Received frame %s again", current_frame_number)
+                events.append(SendData(ACK))
+                return True
+            if current_frame_number != self._previous_frame_number + 1:
+                self._fail(
+                    events,
+                    exceptions.ProtocolError("Data frames not received in order"),
+                )
+                return True
+            self._record_data += frame_data[2:]
+
+        self._is_first_frame = False
+        self._previous_frame_number = current_frame_number
+        if not is_last_frame and not self._ack_after_records:
+            events.append(SendData(ACK))
+
+        record_size = self._record_size
+        complete_length = len(self._record_data) - (
+            len(self._record_data) % record_size
+        )
+        records = [
+            bytes(self._record_data[i : i + record_size])
+            for i in range(0, complete_length, record_size)
+        ]
+        del self._record_data[:complete_length]
+        self._frames_received += 1
+        self._records_received += len(records)
+        events.append(
+            RecordsReceived(records, self._frames_received, self._records_received)
+        )
+        if not is_last_frame and self._ack_after_records:
+            events.append(SendData(ACK))
+
+        if is_last_frame:
+            if self._record_data:
+                self._fail(
+                    events,
+                    exceptions.ProtocolError(
+                        f"Database response ended with an incomplete record of "
+                        f"{len(self._record_data)} bytes"
+                    ),
+                )
+                return True
+            self.state = State.IDLE
+            events.append(
+                DatabaseCompleted(self._frames_received, self._records_received)
+            )
+        return True
+
+    _handlers = {
+        State.WAKEUP: _handle_wakeup,
+        State.SIGN_ON_IDENT: _handle_sign_on_ident,
+        State.SIGN_ON_PASS: _handle_sign_on_pass,
+        State.SIGN_ON_ACK: _handle_sign_on_ack,
+        State.RESPONSE: _handle_response,
+        State.WRITE_ACK: _handle_write_ack,
+        State.DATABASE: _handle_database,
+    }
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(state={self.state.value!r})"
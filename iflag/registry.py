@@ -0,0 +1,299 @@
+import hashlib
+import json
+import logging
+import os
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional, Union, Any, Type
+
+import attr
+
+from iflag import data, exceptions
+from iflag.client import CorusClient, DatabaseConfig
+from iflag.data import IFlagParameter, DatabaseRecordParameter, CorusDataABC
+from iflag.rollup import AGGREGATES
+
+logger = logging.getLogger(__name__)
+
+# Bump when the compiled format changes so old cache files are not used.
+CACHE_VERSION = 3
+
+
+@attr.s(auto_attribs=True)
+class FirmwareDefinition:
+    """
+    Parameter ids and database layouts of a firmware, identified by the parameter map
+    id of the firmware.
+    """
+
+    map_id: str
+    parameters: Dict[str, IFlagParameter]
+    database_layout: DatabaseConfig
+
+
+def get_data_class(name: str) -> Type[CorusDataABC]:
+    """
+    Looks up a data class in iflag.data by name.
+    """
+    data_class = getattr(data, name, None)
+    if not (isinstance(data_class, type) and issubclass(data_class, CorusDataABC)):
+        raise exceptions.DataError(f"{name!r} is not a valid data class")
+    return data_class
+
+
+def compile_definition(definition: Dict[str, Any]) -> FirmwareDefinition:
+    """
+    Validates a firmware definition loaded from JSON or TOML and converts it to
+    IFlagParameters and DatabaseRecordParameters.
+
+    The definition looks like:
+        {
+            "map_id": "b0040",
+            "parameters": {"pulse_weight": {"id": 1, "data_class": "Float"}},
+            "databases": {
+                "interval": {
+                    "52": [{"name": "record_duration", "data_class": "Byte"}, ...]
+                }
+            }
+        }
+    The keys of the record parameters are the same as the arguments of
+    DatabaseRecordParameter, including the optional `option_bit` and `aggregate`.
+    `multiplied` is given as a string to keep precision.
+    """
+    try:
+        map_id = str(definition["map_id"]).lower()
+    except KeyError:
+        raise exceptions.DataError("Firmware definition is missing map_id")
+
+    parameters = {}
+    for name, parameter in definition.get("parameters", {}).items():
+        try:
+            parameters[name] = IFlagParameter(
+                id=int(parameter["id"]),
+                data_class=get_data_class(parameter["data_class"]),
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise exceptions.DataError(
+                f"Invalid parameter {name!r} in firmware {map_id!r}"
+            ) from e
+
+    database_layout: DatabaseConfig = {}
+    for database, layouts in definition.get("databases", {}).items():
+        if database not in CorusClient.DATABASES:
+            raise exceptions.DataError(
+                f"{database!r} in firmware {map_id!r} is not a valid database"
+            )
+        database_layout[database] = {}
+        for record_length, record_parameters in layouts.items():
+            location = f"{database!r} record of length {record_length} in {map_id!r}"
+            try:
+                compiled = [
+                    DatabaseRecordParameter(
+                        name=parameter["name"],
+                        data_class=get_data_class(parameter["data_class"]),
+                        affected_by_pulse_input=bool(
+                            parameter.get("affected_by_pulse_input", False)
+                        ),
+                        multiplied=(
+                            Decimal(str(parameter["multiplied"]))
+                            if parameter.get("multiplied") is not None
+                            else None
+                        ),
+                        option_bit=parameter.get("option_bit"),
+                        aggregate=parameter.get("aggregate"),
+                    )
+                    for parameter in record_parameters
+                ]
+                length = int(record_length)
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                raise exceptions.DataError(f"Invalid parameter in {location}") from e
+            invalid_bits = [
+                parameter.option_bit
+                for parameter in compiled
+                if parameter.option_bit is not None
+                and not _is_option_bit(parameter.option_bit)
+            ]
+            if invalid_bits:
+                raise exceptions.DataError(
+                    f"Invalid option bits {invalid_bits!r} in {location}"
+                )
+            invalid = [
+                parameter.aggregate
+                for parameter in compiled
+                if parameter.aggregate is not None
+                and parameter.aggregate not in AGGREGATES
+            ]
+            if invalid:
+                raise exceptions.DataError(
+                    f"Invalid aggregates {invalid!r} in {location}"
+                )
+            names = [parameter.name for parameter in compiled]
+            if len(set(names)) != len(names):
+                raise exceptions.DataError(f"Duplicate names in {location}")
+            actual_length = sum(parameter.data_class.LENGTH for parameter in compiled)
+            if actual_length != length:
+                raise exceptions.DataError(
+                    f"Parameters of {location} have a total length of {actual_length}"
+                )
+            database_layout[database][length] = compiled
+
+    return FirmwareDefinition(
+        map_id=map_id, parameters=parameters, database_layout=database_layout
+    )
+
+
+def _is_option_bit(value: Any) -> bool:
+    # The options bitmask of a database request is 4 bytes.
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 32
+
+
+def definition_to_dict(definition: FirmwareDefinition) -> Dict[str, Any]:
+    """
+    Converts a compiled definition back to the JSON compatible format read by
+    `compile_definition`.
+    """
+    databases: Dict[str, Any] = {}
+    for database, layouts in definition.database_layout.items():
+        databases[database] = {
+            str(length): [
+                {
+                    "name": parameter.name,
+                    "data_class": parameter.data_class.__name__,
+                    "affected_by_pulse_input": parameter.affected_by_pulse_input,
+                    "multiplied": (
+                        None
+                        if parameter.multiplied is None
+                        else str(parameter.multiplied)
+                    ),
+                    "option_bit": parameter.option_bit,
+                    "aggregate": parameter.aggregate,
+                }
+                for parameter in parameters
+            ]
+            for length, parameters in layouts.items()
+        }
+    return {
+        "map_id": definition.map_id,
+        "parameters": {
+            name: {"id": parameter.id, "data_class": parameter.data_class.__name__}
+            for name, parameter in definition.parameters.items()
+        },
+        "databases": databases,
+    }
+
+
+def _load_toml(content: bytes) -> Dict[str, Any]:
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError as e:
+            raise ImportError(
+                "Loading TOML firmware definitions requires Python 3.11 or tomli. "
+                "Install it with `pip install iflag[toml]`"
+            ) from e
+    return tomllib.loads(content.decode("utf-8"))
+
+
+class FirmwareRegistry:
+    """
+    Holds firmware definitions by parameter map id. Definitions are loaded from JSON
+    or TOML files and validated once. If a cache directory is given definitions
+    loaded from TOML are stored there as JSON, keyed by the content of the file, so
+    following process starts can skip parsing TOML. Cache files are only read as
+    data, but are validated again when loaded as anyone who can write to the
+    directory can change them. JSON files are not cached as reading the cache would
+    cost the same as reading the file.
+
+    :param cache_dir: Directory for TOML definitions converted to JSON. None
+        disables the cache.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._definitions: Dict[str, FirmwareDefinition] = {}
+
+    def add(self, definition: FirmwareDefinition) -> None:
+        self._definitions[definition.map_id.lower()] = definition
+
+    def get(self, map_id: str) -> FirmwareDefinition:
+        try:
+            return self._definitions[map_id.lower()]
+        except KeyError:
+            raise exceptions.CorusClientError(
+                f"No firmware definition for parameter map id {map_id!r}"
+            )
+
+    def __contains__(self, map_id: str) -> bool:
+        return map_id.lower() in self._definitions
+
+    @property
+    def map_ids(self) -> List[str]:
+        return sorted(self._definitions)
+
+    def load_directory(self, path: Union[str, Path]) -> None:
+        """
+        Loads all .json and .toml files in a directory.
+        """
+        for file_path in sorted(Path(path).iterdir()):
+            if file_path.suffix in (".json", ".toml"):
+                self.load_file(file_path)
+
+    def load_file(self, path: Union[str, Path]) -> FirmwareDefinition:
+        """
+        Loads a firmware definition file and adds it to the registry.
+        """
+        path = Path(path)
+        content = path.read_bytes()
+        if path.suffix == ".toml":
+            definition = self._read_cache(content)
+            if definition is None:
+                definition = compile_definition(_load_toml(content))
+                self._write_cache(content, definition)
+        else:
+            definition = compile_definition(json.loads(content.decode("utf-8")))
+        self.add(definition)
+        logger.debug("Loaded firmware definition %s from %s", definition.map_id, path)
+        return definition
+
+    def _cache_path(self, content: bytes) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        digest = hashlib.sha256(content).hexdigest()
+        return self.cache_dir / f"firmware-{CACHE_VERSION}-{digest}.json"
+
+    def _read_cache(self, content: bytes) -> Optional[FirmwareDefinition]:
+        cache_path = self._cache_path(content)
+        if cache_path is None or not cache_path.exists():
+            return None
+        try:
+            with cache_path.open("rb") as f:
+                return compile_definition(json.loads(f.read().decode("utf-8")))
+        except (
+            OSError,
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            exceptions.DataError,
+        ):
+            logger.warning("Ignoring unreadable firmware cache file %s", cache_path)
+            return None
+
+    def _write_cache(self, content: bytes, definition: FirmwareDefinition) -> None:
+        cache_path = self._cache_path(content)
+        if cache_path is None:
+            return
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial file.
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(definition_to_dict(definition), f)
+            tmp_path.replace(cache_path)
+        except OSError:
+            logger.warning("Unable to write firmware cache file %s", cache_path)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cache_dir={self.cache_dir!r})"
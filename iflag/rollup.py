@@ -0,0 +1,166 @@
+"""
+Rollups of interval records over longer periods.
+
+The hourly, daily and monthly databases of a meter hold aggregates that can also be
+computed from the interval records. How each value is aggregated is taken from the
+`aggregate` of its `DatabaseRecordParameter` in the layout, so a rollup can replace
+reading those databases.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from iflag.data import DatabaseRecordParameter
+
+SUM = "sum"
+MINIMUM = "min"
+MAXIMUM = "max"
+AVERAGE = "average"
+AGGREGATES = {SUM, MINIMUM, MAXIMUM, AVERAGE}
+
+HOURLY = "hourly"
+DAILY = "daily"
+MONTHLY = "monthly"
+PERIODS = {HOURLY, DAILY, MONTHLY}
+
+
+def period_start(time: datetime, period: str) -> datetime:
+    """
+    Returns the start of the period that time is in.
+    """
+    if period == HOURLY:
+        return time.replace(minute=0, second=0, microsecond=0)
+    if period == DAILY:
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == MONTHLY:
+        return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"{period!r} is not a valid period")
+
+
+def _get(record: Any, name: str) -> Any:
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name, None)
+
+
+class _Accumulator:
+    __slots__ = ("count", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.total = Decimal(0)
+        self.minimum: Optional[Decimal] = None
+        self.maximum: Optional[Decimal] = None
+
+    def add(self, value: Decimal) -> None:
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def result(self, aggregate: str) -> Optional[Decimal]:
+        if not self.count:
+            return None
+        if aggregate == SUM:
+            return self.total
+        if aggregate == MINIMUM:
+            return self.minimum
+        if aggregate == MAXIMUM:
+            return self.maximum
+        return self.total / self.count
+
+
+class Rollup:
+    """
+    Aggregates of interval records per hour, day or month, maintained incrementally as
+    records are added. Records are dicts or namedtuples as returned by the database
+    reads, in any order.
+
+    A record is counted in the period where its interval starts. As interval records
+    are stamped with the time the interval ends, the time is moved back by the end
+    offset before the period is found, so the record ending at 01:00 is in the hour
+    from 00:00.
+
+    :param parameters: Record layout with `aggregate` set on the values to roll up.
+    :param period: hourly, daily or monthly.
+    :param time_field: Name of the field with the time of the record.
+    :param end_offset: How far before the time of a record its interval starts to
+        count. Use timedelta(0) if the time is the start of the interval.
+    """
+
+    def __init__(
+        self,
+        parameters: Sequence[DatabaseRecordParameter],
+        period: str = DAILY,
+        time_field: str = "end_date",
+        end_offset: timedelta = timedelta(seconds=1),
+    ):
+        if period not in PERIODS:
+            raise ValueError(f"{period!r} is not a valid period")
+        self.period = period
+        self.time_field = time_field
+        self.end_offset = end_offset
+        self.aggregates = {
+            parameter.name: parameter.aggregate
+            for parameter in parameters
+            if parameter.aggregate is not None
+        }
+        if not self.aggregates:
+            raise ValueError("No parameters in the layout have an aggregate")
+        self._periods: Dict[datetime, Dict[str, _Accumulator]] = {}
+        self._counts: Dict[datetime, int] = {}
+
+    def add(self, record: Any) -> None:
+        time = _get(record, self.time_field)
+        if time is None:
+            return
+        start = period_start(time - self.end_offset, self.period)
+        accumulators = self._periods.get(start)
+        if accumulators is None:
+            accumulators = {name: _Accumulator() for name in self.aggregates}
+            self._periods[start] = accumulators
+            self._counts[start] = 0
+        self._counts[start] += 1
+        for name, accumulator in accumulators.items():
+            value = _get(record, name)
+            if value is not None:
+                accumulator.add(value)
+
+    def add_all(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.add(record)
+
+    def _result(self, start: datetime) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"period": start, "records": self._counts[start]}
+        for name, accumulator in self._periods[start].items():
+            result[name] = accumulator.result(self.aggregates[name])
+        return result
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        Returns the aggregates of all periods, oldest first. Each result has the start
+        of the `period`, the number of `records` and a value per aggregated field.
+        """
+        return [self._result(start) for start in sorted(self._periods)]
+
+    def pop_complete(self, before: datetime) -> List[Dict[str, Any]]:
+        """
+        Returns and removes the periods that start before the period of before, which
+        can no longer receive records. Used to keep a rollup running over a stream of
+        records with bounded memory.
+        """
+        limit = period_start(before, self.period)
+        complete = sorted(start for start in self._periods if start < limit)
+        results = [self._result(start) for start in complete]
+        for start in complete:
+            del self._periods[start]
+            del self._counts[start]
+        return results
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(period={self.period!r}, "
+            f"aggregates={self.aggregates!r})"
+        )
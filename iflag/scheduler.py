@@ -0,0 +1,193 @@
+"""
+Scheduling of meter collection jobs.
+
+Many meters sit behind the same modem gateway, with the same host but different ports,
+and a gateway starts to time out if too many connections are opened to it at once.
+The `Scheduler` decides which job to start next: jobs run in order of priority and
+deadline, but a job whose host is at its limit is passed over for the next job on
+another host, so all gateways are kept busy without being overloaded.
+"""
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple, Any, Callable
+
+import attr
+
+
+@attr.s(auto_attribs=True)
+class Job:
+    """
+    A job to be scheduled.
+
+    :param host: Host the job connects to. Limits are per host.
+    :param item: The work to do, for example a `MeterSession`.
+    :param priority: Lower priorities are started first.
+    :param deadline: `time.monotonic()` time after which the job is not started.
+    """
+
+    host: str
+    item: Any
+    priority: int = 0
+    deadline: Optional[float] = None
+
+    @property
+    def sort_key(self) -> Tuple[int, float]:
+        deadline = self.deadline if self.deadline is not None else float("inf")
+        return self.priority, deadline
+
+
+class Scheduler:
+    """
+    Queues jobs and hands out the next job that may be started.
+
+    :param max_active: Maximum number of jobs running at the same time.
+    :param max_active_per_host: Maximum number of jobs running against the same host.
+        None means no limit per host.
+    :param connection_rate: Maximum number of jobs started per second, on average.
+        None means no limit.
+    :param connection_burst: Number of jobs that can be started at once before the
+        connection rate applies.
+    """
+
+    def __init__(
+        self,
+        max_active: int = 1000,
+        max_active_per_host: Optional[int] = None,
+        connection_rate: Optional[float] = None,
+        connection_burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_active < 1 or (
+            max_active_per_host is not None and max_active_per_host < 1
+        ):
+            raise ValueError("Concurrency limits must be at least 1")
+        if connection_rate is not None and connection_rate <= 0:
+            raise ValueError("connection_rate must be positive")
+        self.max_active = max_active
+        self.max_active_per_host = max_active_per_host
+        self.connection_rate = connection_rate
+        self.connection_burst = max(connection_burst, 1)
+        self._clock = clock
+
+        self._counter = itertools.count()
+        # Queued jobs per host as heaps of (sort key, sequence, job).
+        self._queues: Dict[str, List[Tuple[Tuple[int, float], int, Job]]] = {}
+        # Heads of the host queues that may be started. Entries are not removed when
+        # a host fills up or its head changes, they are checked when popped.
+        self._ready: List[Tuple[Tuple[int, float], int, str]] = []
+        self._active: Dict[str, int] = {}
+        self._active_count = 0
+        self._queued_count = 0
+        self._tokens = float(self.connection_burst)
+        self._tokens_updated = clock()
+        self.expired: List[Job] = []
+
+    def __len__(self) -> int:
+        """
+        Number of queued jobs.
+        """
+        return self._queued_count
+
+    @property
+    def active(self) -> int:
+        return self._active_count
+
+    def add(self, job: Job) -> None:
+        entry = (job.sort_key, next(self._counter), job)
+        queue = self._queues.setdefault(job.host, [])
+        heapq.heappush(queue, entry)
+        self._queued_count += 1
+        if queue[0] is entry and self._has_capacity(job.host):
+            heapq.heappush(self._ready, (entry[0], entry[1], job.host))
+
+    def next_job(self) -> Optional[Job]:
+        """
+        Returns the next job to start and counts it as active, or None if no job may
+        be started now. Jobs whose deadline has passed are moved to `expired`.
+        """
+        while self._ready:
+            if self._active_count >= self.max_active or not self._take_token():
+                return None
+            _, sequence, host = heapq.heappop(self._ready)
+            queue = self._queues.get(host)
+            if not queue or queue[0][1] != sequence or not self._has_capacity(host):
+                # Stale entry, the host is full or its head has changed.
+                self._return_token()
+                continue
+
+            _, _, job = heapq.heappop(queue)
+            self._queued_count -= 1
+            if queue:
+                heapq.heappush(self._ready, (queue[0][0], queue[0][1], host))
+            else:
+                del self._queues[host]
+
+            if job.deadline is not None and self._clock() > job.deadline:
+                self._return_token()
+                self.expired.append(job)
+                continue
+
+            self._active[host] = self._active.get(host, 0) + 1
+            self._active_count += 1
+            return job
+        return None
+
+    def release(self, job: Job) -> None:
+        """
+        Marks a job returned by next_job as finished.
+        """
+        count = self._active[job.host] - 1
+        if count:
+            self._active[job.host] = count
+        else:
+            del self._active[job.host]
+        self._active_count -= 1
+        queue = self._queues.get(job.host)
+        if queue:
+            heapq.heappush(self._ready, (queue[0][0], queue[0][1], job.host))
+
+    def time_until_ready(self) -> Optional[float]:
+        """
+        Seconds until the connection rate allows the next job to start. None if
+        nothing is queued that could start.
+        """
+        if not self._ready or self._active_count >= self.max_active:
+            return None
+        if self.connection_rate is None:
+            return 0.0
+        self._refill_tokens()
+        return max(0.0, (1 - self._tokens) / self.connection_rate)
+
+    def _has_capacity(self, host: str) -> bool:
+        if self.max_active_per_host is None:
+            return True
+        return self._active.get(host, 0) < self.max_active_per_host
+
+    def _refill_tokens(self) -> None:
+        now = self._clock()
+        self._tokens = min(
+            float(self.connection_burst),
+            self._tokens + (now - self._tokens_updated) * self.connection_rate,
+        )
+        self._tokens_updated = now
+
+    def _take_token(self) -> bool:
+        if self.connection_rate is None:
+            return True
+        self._refill_tokens()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _return_token(self) -> None:
+        if self.connection_rate is not None:
+            self._tokens += 1
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(max_active={self.max_active!r}, "
+            f"max_active_per_host={self.max_active_per_host!r}, "
+            f"connection_rate={self.connection_rate!r})"
+        )
@@ -0,0 +1,143 @@
+"""
+Spooling of raw database records to disk.
+
+A full read of the interval database can return hundreds of thousands of records.
+`RecordSpool` holds the raw records of a read in memory up to a budget and moves them
+to a temporary file when the budget is exceeded. Records are only decoded when they
+are iterated, one at a time, so a read needs little more memory than the budget no
+matter how many records it returns.
+"""
+import os
+import tempfile
+from typing import Any, Callable, IO, Iterable, Iterator, Optional, Sequence
+
+# Number of records read from the file at a time.
+READ_RECORDS = 1024
+
+
+class RecordSpool:
+    """
+    Raw records of the same size, in memory until more than memory_budget bytes are
+    written and in a temporary file after that. The file is removed on close.
+
+    :param memory_budget: Bytes of record data to hold in memory.
+    :param directory: Directory of the temporary file. The default temporary directory
+        is used if None.
+    """
+
+    def __init__(self, memory_budget: int, directory: Optional[str] = None):
+        if memory_budget < 0:
+            raise ValueError("memory_budget can not be negative")
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.record_size = 0
+        self._record_count = 0
+        self._buffer = bytearray()
+        self._file: Optional[IO[bytes]] = None
+
+    def __len__(self) -> int:
+        return self._record_count
+
+    @property
+    def spilled(self) -> bool:
+        """
+        True if the records have been moved to a file.
+        """
+        return self._file is not None
+
+    def write(self, records: Sequence[bytes]) -> None:
+        for record in records:
+            if not self.record_size:
+                self.record_size = len(record)
+            elif len(record) != self.record_size:
+                raise ValueError(
+                    f"Record of {len(record)} bytes in a spool of {self.record_size} "
+                    f"byte records"
+                )
+        self._record_count += len(records)
+        if self._file is not None:
+            # Iterating moves the position of the file.
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(b"".join(records))
+            return
+        self._buffer += b"".join(records)
+        if len(self._buffer) > self.memory_budget:
+            self._file = tempfile.TemporaryFile(
+                prefix="iflag-spool-", dir=self.directory
+            )
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def __iter__(self) -> Iterator[bytes]:
+        size = self.record_size
+        if not size:
+            # Nothing was written.
+            return
+        if self._file is None:
+            buffer = self._buffer
+            for offset in range(0, len(buffer), size):
+                yield bytes(buffer[offset : offset + size])
+            return
+        self._file.flush()
+        position = 0
+        while True:
+            # Each iterator keeps its own position so iterators can be interleaved.
+            self._file.seek(position)
+            chunk = self._file.read(size * READ_RECORDS)
+            if not chunk:
+                return
+            position += len(chunk)
+            for offset in range(0, len(chunk), size):
+                yield chunk[offset : offset + size]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(records={len(self)}, "
+            f"memory_budget={self.memory_budget!r}, spilled={self.spilled!r})"
+        )
+
+
+class SpooledRecords:
+    """
+    Records of a database read that are decoded from a `RecordSpool` each time they
+    are iterated. Close it, or use it as a context manager, to remove the spool file.
+    """
+
+    def __init__(
+        self, spool: RecordSpool, decode: Callable[[Iterable[bytes]], Iterator[Any]]
+    ):
+        self.spool = spool
+        self._decode = decode
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._decode(self.spool))
+
+    def __len__(self) -> int:
+        return len(self.spool)
+
+    @property
+    def spilled(self) -> bool:
+        return self.spool.spilled
+
+    def close(self) -> None:
+        self.spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(spool={self.spool!r})"
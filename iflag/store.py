@@ -0,0 +1,579 @@
+"""
+Compact in-memory store of decoded database records.
+
+Records are kept per meter and database in columns of typed arrays instead of dicts
+of Decimals. Integer arrays start with 16 bit items and are widened when a value does
+not fit. Decimals are stored as integers scaled by a power of ten per column. The
+record time and optionally monotone counters are delta encoded, with the absolute
+value stored every `BLOCK` records so ranges can be decoded without starting from the
+first record. A field with a value that does not fit in 64 bits, like a Decimal with
+many decimals, is kept in a list of objects instead.
+
+Records are merged and dropped per column, without converting the stored records back
+to dicts.
+"""
+import calendar
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from iflag import exceptions
+from iflag.data import DatabaseRecordParameter, Null2, Null4
+
+BLOCK = 128
+_TYPECODES = ("h", "i", "q")
+_MAX_INT = 2 ** 63 - 1
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _int_array(values: Iterable[int]) -> array:
+    """
+    Returns the values in the narrowest array that holds them.
+    """
+    values = list(values)
+    for typecode in _TYPECODES:
+        try:
+            return array(typecode, values)
+        except OverflowError:
+            pass
+    raise OverflowError("Values do not fit in a 64 bit array")
+
+
+class _IntColumn:
+    """
+    Integers in an array that is widened as needed. With delta only the difference to
+    the previous value is stored, except for the first value of each block. Missing
+    values are stored like the previous value, or 0 without delta, and their indexes
+    are kept in a set.
+
+    Values that are dropped from the front are only removed from the arrays a whole
+    block at a time, as the rest of the block is decoded from its base. offset is the
+    array index of the first value that is kept.
+    """
+
+    def __init__(self, delta: bool = False):
+        self.delta = delta
+        self.clear()
+
+    def clear(self) -> None:
+        self.values = array(_TYPECODES[0])
+        self.bases = array("q")
+        self.missing: Set[int] = set()
+        self.offset = 0
+        self._last = 0
+
+    def __len__(self) -> int:
+        return len(self.values) - self.offset
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.values.itemsize * len(self.values)
+            + self.bases.itemsize * len(self.bases)
+            # Rough size of a set entry.
+            + 40 * len(self.missing)
+        )
+
+    def convert(self, values: List[Any]) -> Optional[List[Optional[int]]]:
+        """
+        Returns the values to pass to extend, or None if they can't be stored.
+        """
+        if any(value is not None and not isinstance(value, int) for value in values):
+            return None
+        return values if self.fits(values) else None
+
+    def fits(self, values: Sequence[Optional[int]], factor: int = 1) -> bool:
+        """
+        Checks that the values can be appended without a value or difference that
+        does not fit in 64 bits, after the stored values are multiplied by factor.
+        """
+        last = self._last * factor
+        index = len(self.values)
+        for value in values:
+            if value is None:
+                value = last if self.delta else 0
+            stored = value - last if self.delta and index % BLOCK else value
+            if not -_MAX_INT - 1 <= stored <= _MAX_INT:
+                return False
+            last = value
+            index += 1
+        return True
+
+    def extend(self, values: Iterable[Optional[int]]) -> None:
+        for value in values:
+            self.append(value)
+
+    def append(self, value: Optional[int]) -> None:
+        index = len(self.values)
+        if value is None:
+            self.missing.add(index)
+            value = self._last if self.delta else 0
+        if not self.delta:
+            self._store(value)
+            return
+        if index % BLOCK == 0:
+            self.bases.append(value)
+            self._store(0)
+        else:
+            self._store(value - self._last)
+        self._last = value
+
+    def _store(self, value: int) -> None:
+        try:
+            self.values.append(value)
+        except OverflowError:
+            position = _TYPECODES.index(self.values.typecode)
+            if position + 1 == len(_TYPECODES):
+                raise
+            self.values = array(_TYPECODES[position + 1], self.values)
+            self._store(value)
+
+    def max_abs(self) -> int:
+        return max(
+            (abs(value) for values in (self.values, self.bases) for value in values),
+            default=0,
+        )
+
+    def multiply(self, factor: int) -> None:
+        """
+        Multiplies all values by factor. Check that they fit with max_abs first.
+        """
+        self.values = _int_array(value * factor for value in self.values)
+        self.bases = array("q", (value * factor for value in self.bases))
+        self._last *= factor
+
+    def truncate(self, length: int) -> None:
+        """
+        Removes the values from index length.
+        """
+        if length == 0:
+            # Also remove the dropped values, the next values can be older than them.
+            self.clear()
+            return
+        end = self.offset + length
+        self._last = self._decode(end - 1, end)[0] if end > 0 else 0
+        del self.values[end:]
+        if self.delta:
+            del self.bases[(end + BLOCK - 1) // BLOCK :]
+        self.missing = {index for index in self.missing if index < end}
+
+    def drop_front(self, count: int) -> None:
+        """
+        Removes the first count values.
+        """
+        start = self.offset + count
+        cut = start - start % BLOCK if self.delta else start
+        del self.values[:cut]
+        if self.delta:
+            del self.bases[: cut // BLOCK]
+        self.missing = {index - cut for index in self.missing if index >= start}
+        self.offset = start - cut
+
+    def find(self, value: int, right: bool = False) -> int:
+        """
+        Finds the position of value in a sorted delta column like bisect. Only the
+        block that holds it is decoded.
+        """
+        block = bisect_right(self.bases, value) - 1
+        if block < 0:
+            return 0
+        start = block * BLOCK
+        values = self._decode(start, min(start + BLOCK, len(self.values)))
+        bisect = bisect_right if right else bisect_left
+        return max(0, start + bisect(values, value) - self.offset)
+
+    def _decode(self, start: int, stop: int) -> List[int]:
+        if not self.delta:
+            return list(self.values[start:stop])
+        out = []
+        index = start - start % BLOCK
+        value = 0
+        for index in range(index, stop):
+            if index % BLOCK == 0:
+                value = self.bases[index // BLOCK]
+            else:
+                value += self.values[index]
+            if index >= start:
+                out.append(value)
+        return out
+
+    def get_range(self, start: int, stop: int) -> List[Optional[int]]:
+        start += self.offset
+        stop += self.offset
+        out: List[Optional[int]] = list(self._decode(start, stop))
+        if self.missing:
+            for index in range(start, stop):
+                if index in self.missing:
+                    out[index - start] = None
+        return out
+
+
+class _DecimalColumn:
+    """
+    Decimals stored as integers scaled by 10 ** scale. The scale grows when a value
+    with more decimals is added.
+    """
+
+    def __init__(self, delta: bool = False):
+        self.delta = delta
+        self.scale = 0
+        self.column = _IntColumn(delta)
+
+    def __len__(self) -> int:
+        return len(self.column)
+
+    @property
+    def nbytes(self) -> int:
+        return self.column.nbytes
+
+    def convert(self, values: List[Any]) -> Optional[Tuple[int, List[Optional[int]]]]:
+        """
+        Returns the scale and scaled values to pass to extend, or None if they can't
+        be stored as 64 bit integers.
+        """
+        scale = self.scale
+        for value in values:
+            if value is None:
+                continue
+            if not isinstance(value, Decimal) or not value.is_finite():
+                return None
+            scale = max(scale, -value.normalize().as_tuple().exponent)
+        factor = 10 ** (scale - self.scale)
+        if factor != 1 and self.column.max_abs() * factor > _MAX_INT:
+            return None
+        scaled = [
+            None if value is None else int(value.scaleb(scale)) for value in values
+        ]
+        if not self.column.fits(scaled, factor):
+            return None
+        return scale, scaled
+
+    def extend(self, converted: Tuple[int, List[Optional[int]]]) -> None:
+        scale, scaled = converted
+        if scale != self.scale:
+            self.column.multiply(10 ** (scale - self.scale))
+            self.scale = scale
+        self.column.extend(scaled)
+
+    def truncate(self, length: int) -> None:
+        self.column.truncate(length)
+
+    def drop_front(self, count: int) -> None:
+        self.column.drop_front(count)
+
+    def get_range(self, start: int, stop: int) -> List[Optional[Decimal]]:
+        return [
+            None if value is None else Decimal(value).scaleb(-self.scale)
+            for value in self.column.get_range(start, stop)
+        ]
+
+
+class _TimeColumn:
+    """
+    Datetimes stored as seconds since the epoch.
+    """
+
+    def __init__(self, delta: bool = False):
+        self.column = _IntColumn(delta)
+
+    def __len__(self) -> int:
+        return len(self.column)
+
+    @property
+    def nbytes(self) -> int:
+        return self.column.nbytes
+
+    def convert(self, values: List[Any]) -> Optional[List[Optional[int]]]:
+        if any(
+            value is not None and not isinstance(value, datetime) for value in values
+        ):
+            return None
+        seconds = [None if value is None else _to_seconds(value) for value in values]
+        return seconds if self.column.fits(seconds) else None
+
+    def extend(self, converted: List[Optional[int]]) -> None:
+        self.column.extend(converted)
+
+    def truncate(self, length: int) -> None:
+        self.column.truncate(length)
+
+    def drop_front(self, count: int) -> None:
+        self.column.drop_front(count)
+
+    def get_range(self, start: int, stop: int) -> List[Optional[datetime]]:
+        return [
+            None if value is None else _from_seconds(value)
+            for value in self.column.get_range(start, stop)
+        ]
+
+
+class _ObjectColumn:
+    """
+    Values of other types in a list. Also used for values that don't fit the typed
+    column of their field.
+    """
+
+    def __init__(self, delta: bool = False, values: Optional[List[Any]] = None):
+        self.values: List[Any] = values if values is not None else []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return 8 * len(self.values)
+
+    def convert(self, values: List[Any]) -> List[Any]:
+        return values
+
+    def extend(self, converted: List[Any]) -> None:
+        self.values.extend(converted)
+
+    def truncate(self, length: int) -> None:
+        del self.values[length:]
+
+    def drop_front(self, count: int) -> None:
+        del self.values[:count]
+
+    def get_range(self, start: int, stop: int) -> List[Any]:
+        return self.values[start:stop]
+
+
+_COLUMN_CLASSES = {Decimal: _DecimalColumn, datetime: _TimeColumn, int: _IntColumn}
+
+
+def _to_seconds(value: datetime) -> int:
+    return calendar.timegm(value.timetuple())
+
+
+def _from_seconds(value: int) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+def _get(record: Any, name: str) -> Any:
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name, None)
+
+
+class RecordTable:
+    """
+    Records of one meter and database, ordered by time. Records with the same time as
+    a stored record replace it.
+
+    :param parameters: Record layout of the records. Null parameters are not stored.
+    :param time_field: Name of the Date field the records are ordered by.
+    :param delta_fields: Names of fields that only grow, like counters, to store as
+        differences to the previous record.
+    """
+
+    def __init__(
+        self,
+        parameters: Sequence[DatabaseRecordParameter],
+        time_field: str = "end_date",
+        delta_fields: Sequence[str] = (),
+    ):
+        self.parameters = parameters
+        self.time_field = time_field
+        self.delta_fields = tuple(delta_fields)
+        self.names = [
+            parameter.name
+            for parameter in parameters
+            if parameter.data_class not in (Null2, Null4)
+            and parameter.name != time_field
+        ]
+        if time_field not in {parameter.name for parameter in parameters}:
+            raise exceptions.DataError(f"{time_field!r} is not in the record layout")
+        self._value_types = {
+            parameter.name: parameter.data_class.VALUE_TYPE for parameter in parameters
+        }
+        self._clear()
+
+    def _clear(self) -> None:
+        self._times = _IntColumn(delta=True)
+        self._columns = {
+            name: _COLUMN_CLASSES.get(self._value_types[name], _ObjectColumn)(
+                name in self.delta_fields
+            )
+            for name in self.names
+        }
+        self._last_time: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the stored values.
+        """
+        return self._times.nbytes + sum(
+            column.nbytes for column in self._columns.values()
+        )
+
+    def add(self, records: Iterable[Any]) -> None:
+        """
+        Adds decoded records, as dicts or namedtuples, in any order. Values that don't
+        fit the typed column of their field, like Decimals with too many decimals, move
+        the field to a column of objects.
+        """
+        # Keep the last of records with the same time.
+        rows: Dict[int, Any] = {}
+        for record in records:
+            time = _get(record, self.time_field)
+            if not isinstance(time, datetime):
+                raise exceptions.DataError(f"Record has no {self.time_field!r}")
+            rows[_to_seconds(time)] = record
+        if not rows:
+            return
+        new_times = sorted(rows)
+
+        # Stored records from the first one that is not older than the new records
+        # are merged with them. Nothing is merged when all new records are newer.
+        start = len(self)
+        if self._last_time is not None and new_times[0] <= self._last_time:
+            start = self._times.find(new_times[0])
+        stored_times = self._times.get_range(start, len(self))
+        merged: List[Tuple[int, Optional[int]]] = []
+        position = 0
+        for seconds in new_times:
+            while position < len(stored_times) and stored_times[position] < seconds:
+                merged.append((stored_times[position], position))
+                position += 1
+            if position < len(stored_times) and stored_times[position] == seconds:
+                position += 1
+            merged.append((seconds, None))
+        merged.extend(
+            (stored_times[index], index)
+            for index in range(position, len(stored_times))
+        )
+
+        for name, column in self._columns.items():
+            stored = column.get_range(start, len(self))
+            values = [
+                _get(rows[seconds], name) if index is None else stored[index]
+                for seconds, index in merged
+            ]
+            column.truncate(start)
+            converted = column.convert(values)
+            if converted is None:
+                column = _ObjectColumn(values=column.get_range(0, start) + values)
+                self._columns[name] = column
+            else:
+                column.extend(converted)
+
+        self._times.truncate(start)
+        self._times.extend(seconds for seconds, _ in merged)
+        self._last_time = merged[-1][0]
+
+    def _index(self, time: datetime, right: bool = False) -> int:
+        return self._times.find(_to_seconds(time), right)
+
+    def _rows(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        rows = [
+            {self.time_field: _from_seconds(seconds)}
+            for seconds in self._times.get_range(start, stop)
+        ]
+        for name, column in self._columns.items():
+            for row, value in zip(rows, column.get_range(start, stop)):
+                if value is not None:
+                    row[name] = value
+        return rows
+
+    def range(
+        self, since: Optional[datetime] = None, until: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the records with a time between since and until, both inclusive, as
+        dicts ordered by time. None values are left out like in decoded records.
+        """
+        start = 0 if since is None else self._index(since)
+        stop = len(self) if until is None else self._index(until, right=True)
+        if start >= stop:
+            return []
+        return self._rows(start, stop)
+
+    def drop_before(self, time: datetime) -> None:
+        """
+        Removes the records older than time.
+        """
+        start = self._index(time)
+        if start == 0:
+            return
+        if start >= len(self):
+            self._clear()
+            return
+        self._times.drop_front(start)
+        for column in self._columns.values():
+            column.drop_front(start)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(records={len(self)}, "
+            f"time_field={self.time_field!r})"
+        )
+
+
+class RecordStore:
+    """
+    Record tables by meter and database.
+
+    :param delta_fields: Default delta fields of new tables.
+    """
+
+    def __init__(self, time_field: str = "end_date", delta_fields: Sequence[str] = ()):
+        self.time_field = time_field
+        self.delta_fields = delta_fields
+        self._tables: Dict[Tuple[str, str], RecordTable] = {}
+
+    def table(
+        self,
+        meter: str,
+        database: str,
+        parameters: Optional[Sequence[DatabaseRecordParameter]] = None,
+    ) -> RecordTable:
+        """
+        Returns the table of a meter and database. The record layout is needed to
+        create a new table.
+        """
+        key = (meter, database)
+        table = self._tables.get(key)
+        if table is None:
+            if parameters is None:
+                raise exceptions.CorusClientError(
+                    f"No records stored for {database!r} of {meter!r}"
+                )
+            table = RecordTable(parameters, self.time_field, self.delta_fields)
+            self._tables[key] = table
+        return table
+
+    def add(
+        self,
+        meter: str,
+        database: str,
+        parameters: Sequence[DatabaseRecordParameter],
+        records: Iterable[Any],
+    ) -> None:
+        self.table(meter, database, parameters).add(records)
+
+    def range(
+        self,
+        meter: str,
+        database: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        return self.table(meter, database).range(since, until)
+
+    def drop_before(self, time: datetime) -> None:
+        for table in self._tables.values():
+            table.drop_before(time)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(table.nbytes for table in self._tables.values())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(tables={len(self._tables)})"
@@ -0,0 +1,474 @@
+"""
+Fake Corus meters for tests and load tests.
+
+`FakeMeterServer` serves any number of `FakeMeter` on local TCP ports from a single
+background thread. The meters answer the wakeup, sign on, parameter reads and writes,
+record counts and database reads with the real framing. Database responses of many
+frames are sent one frame at a time, each after the ACK of the previous frame, like a
+device does.
+"""
+import heapq
+import itertools
+import selectors
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import attr
+
+from iflag import data, utils
+from iflag.data import DatabaseRecordParameter
+from iflag.messages import ReadDatabaseRequest, DATABASE_FRAME_PAYLOAD
+from iflag.protocol import (
+    SOH,
+    ETX,
+    ACK,
+    NACK,
+    BREAK,
+    WAKEUP,
+    WAKEUP_RESPONSE,
+    SIGN_ON,
+    SIGN_ON_ACK,
+    PASS_LENGTH,
+)
+
+READ_COMMAND = 0xBF
+WRITE_COMMAND = 0xFF
+DATABASE_COMMAND = 0xBE
+
+# A synthetic interval record of 20 bytes used by the load test.
+INTERVAL_LAYOUT = {
+    "interval": {
+        20: [
+            DatabaseRecordParameter(name="record_duration", data_class=data.Byte),
+            DatabaseRecordParameter(name="status", data_class=data.Byte),
+            DatabaseRecordParameter(name="end_date", data_class=data.Date),
+            DatabaseRecordParameter(
+                name="consumption_interval",
+                data_class=data.Word,
+                affected_by_pulse_input=True,
+            ),
+            DatabaseRecordParameter(
+                name="counter", data_class=data.ULong, affected_by_pulse_input=True
+            ),
+            DatabaseRecordParameter(name="temperature", data_class=data.Float1),
+            DatabaseRecordParameter(name="pressure", data_class=data.Float),
+            DatabaseRecordParameter(name="reserved", data_class=data.Null2),
+        ]
+    }
+}
+
+
+def interval_records(
+    count: int, newest: datetime, interval: timedelta = timedelta(hours=1)
+) -> List[bytes]:
+    """
+    Returns count records in the layout of `INTERVAL_LAYOUT`, newest first like a
+    device sends them.
+    """
+    records = []
+    for index in range(count):
+        end_date = newest - index * interval
+        records.append(
+            struct.pack("<BB", 60, 0)
+            + utils.date_to_byte(end_date)
+            + struct.pack(
+                "<HIhf",
+                index % 100,
+                1000000 - index,
+                1500 + index % 300,
+                1.01325,
+            )
+            + b"\x00\x00"
+        )
+    return records
+
+
+def database_frames(records: Sequence[bytes]) -> List[bytes]:
+    """
+    Splits records into database response frames. The first frame starts with the
+    record size and the frame number of the last frame has the high bit set. Without
+    records a single frame with record size 0 is returned.
+    """
+    record_size = len(records[0]) if records else 0
+    payload = bytes([record_size]) + b"".join(records)
+    chunks = [
+        payload[i : i + DATABASE_FRAME_PAYLOAD]
+        for i in range(0, len(payload), DATABASE_FRAME_PAYLOAD)
+    ]
+    frames = []
+    for frame_number, chunk in enumerate(chunks):
+        if frame_number == len(chunks) - 1:
+            frame_number |= 0b1000000000000000
+        frame_data = frame_number.to_bytes(2, "little") + chunk
+        frames.append(_frame(frame_data))
+    return frames
+
+
+def _frame(frame_data: bytes) -> bytes:
+    return utils.add_crc(bytes([SOH, len(frame_data)]) + frame_data + bytes([ETX]))
+
+
+@attr.s(auto_attribs=True)
+class FakeMeter:
+    """
+    Content of a fake meter. Database reads return all records of the database
+    regardless of the start and stop dates of the request.
+
+    :param parameters: Bytes of the parameter values by parameter id.
+    :param databases: Records of each database, newest first.
+    :param ident: Ident sent on sign on.
+    """
+
+    parameters: Dict[int, bytes] = attr.ib(factory=dict)
+    databases: Dict[str, List[bytes]] = attr.ib(factory=dict)
+    ident: bytes = b"/ACTARIS\r\n"
+    # Frames are built once per database and shared by all sessions.
+    _frames: Dict[str, List[bytes]] = attr.ib(factory=dict, init=False, repr=False)
+
+    def frames(self, database: str) -> List[bytes]:
+        frames = self._frames.get(database)
+        if frames is None:
+            frames = database_frames(self.databases.get(database, []))
+            self._frames[database] = frames
+        return frames
+
+
+class MeterConnection:
+    """
+    The meter side of one session, without I/O. Received bytes are passed to `feed`
+    which returns the bytes to answer with.
+    """
+
+    WAKEUP = "wakeup"
+    SIGN_ON = "sign_on"
+    SIGN_ON_ACK = "sign_on_ack"
+    PASS = "pass"
+    COMMAND = "command"
+    DATABASE = "database"
+    CLOSED = "closed"
+
+    _database_names = {
+        db_id: name for name, db_id in ReadDatabaseRequest.db_id_map.items()
+    }
+
+    def __init__(self, meter: FakeMeter):
+        self.meter = meter
+        self.state = self.WAKEUP
+        self._buffer = bytearray()
+        self._zeros = 0
+        self._frames: List[bytes] = []
+        self._frame_index = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.state == self.CLOSED
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        out = bytearray()
+        while self._buffer and not self.closed:
+            if not self._handlers[self.state](self, out):
+                break
+        return bytes(out)
+
+    def _take(self, length: int) -> Optional[bytes]:
+        if len(self._buffer) < length:
+            return None
+        taken = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return taken
+
+    def _handle_wakeup(self, out: bytearray) -> bool:
+        zeros = len(self._buffer) - len(self._buffer.lstrip(b"\x00"))
+        del self._buffer[:zeros]
+        self._zeros += zeros
+        if self._zeros >= len(WAKEUP):
+            out += WAKEUP_RESPONSE
+            self.state = self.SIGN_ON
+        elif self._buffer:
+            # Noise before a complete wakeup, start counting again.
+            del self._buffer[:1]
+            self._zeros = 0
+        return True
+
+    def _handle_sign_on(self, out: bytearray) -> bool:
+        end = self._buffer.find(SIGN_ON)
+        if end < 0:
+            return False
+        del self._buffer[: end + len(SIGN_ON)]
+        out += self.meter.ident
+        self.state = self.SIGN_ON_ACK
+        return True
+
+    def _handle_sign_on_ack(self, out: bytearray) -> bool:
+        if self._take(len(SIGN_ON_ACK)) is None:
+            return False
+        out += b"PASS12"
+        self.state = self.PASS
+        return True
+
+    def _handle_pass(self, out: bytearray) -> bool:
+        if self._take(PASS_LENGTH) is None:
+            return False
+        out += ACK
+        self.state = self.COMMAND
+        return True
+
+    def _handle_command(self, out: bytearray) -> bool:
+        start = self._buffer.find(bytes([SOH]))
+        if start < 0:
+            self._buffer.clear()
+            return False
+        del self._buffer[:start]
+        if len(self._buffer) < 3:
+            return False
+        if self._buffer[1] == BREAK[1]:
+            if self._take(len(BREAK)) is None:
+                return False
+            self.state = self.CLOSED
+            return True
+        frame = self._take(self._buffer[2] + 6)
+        if frame is None:
+            return False
+        if frame[-3] != ETX or not utils.crc_valid(frame[:-2], frame[-2:]):
+            out += NACK
+            return True
+
+        command, message = frame[1], frame[3:-3]
+        if command == READ_COMMAND:
+            out += self._read(message)
+        elif command == WRITE_COMMAND:
+            out += ACK
+        elif command == DATABASE_COMMAND:
+            out += self._read_database(message)
+        else:
+            out += NACK
+        return True
+
+    def _read(self, message: bytes) -> bytes:
+        values = []
+        position = 0
+        while position < len(message):
+            parameter_id = message[position]
+            # Ids from 239 are sent as two bytes with the high four bits set.
+            if parameter_id >= 0xF0:
+                parameter_id = (
+                    int.from_bytes(message[position : position + 2], "big") & 0x0FFF
+                )
+                position += 2
+            else:
+                position += 1
+            value = self.meter.parameters.get(parameter_id)
+            if value is None:
+                return NACK
+            values.append(value)
+        return _frame(b"".join(values))
+
+    def _read_database(self, message: bytes) -> bytes:
+        database = self._database_names.get(message[0] & 0b00001111)
+        if database is None:
+            return NACK
+        if message[0] & 0b00010000:
+            records = self.meter.databases.get(database, [])
+            record_size = len(records[0]) if records else 0
+            count = min(len(records), 0xFFFF)
+            return _frame(
+                (0b1000000000000000).to_bytes(2, "little")
+                + bytes([record_size])
+                + count.to_bytes(2, "little")
+            )
+        self._frames = self.meter.frames(database)
+        self._frame_index = 0
+        if len(self._frames) > 1:
+            self.state = self.DATABASE
+        return self._frames[0]
+
+    def _handle_database(self, out: bytearray) -> bool:
+        if self._buffer[0] == SOH:
+            # A new request or a break instead of an ACK ends the transfer.
+            self.state = self.COMMAND
+            return True
+        answer = self._take(1)
+        if answer == ACK:
+            self._frame_index += 1
+            if self._frame_index == len(self._frames) - 1:
+                self.state = self.COMMAND
+        elif answer != NACK:
+            return True
+        out += self._frames[self._frame_index]
+        return True
+
+    _handlers = {
+        WAKEUP: _handle_wakeup,
+        SIGN_ON: _handle_sign_on,
+        SIGN_ON_ACK: _handle_sign_on_ack,
+        PASS: _handle_pass,
+        COMMAND: _handle_command,
+        DATABASE: _handle_database,
+    }
+
+
+class _Client:
+    __slots__ = ("sock", "connection", "outgoing")
+
+    def __init__(self, sock: socket.socket, connection: MeterConnection):
+        self.sock = sock
+        self.connection = connection
+        self.outgoing = bytearray()
+
+
+class FakeMeterServer:
+    """
+    Serves fake meters on local TCP ports from a background thread, one port per
+    meter. Each meter accepts any number of concurrent sessions.
+
+        with FakeMeterServer([FakeMeter(databases=...)]) as server:
+            client = CorusClient.with_tcp_transport(server.addresses[0], layout)
+
+    :param meters: The meters to serve.
+    :param latency: Seconds each answer is delayed, to simulate the round trip time of
+        a modem link.
+    :param host: Address to listen on.
+    """
+
+    def __init__(
+        self, meters: Sequence[FakeMeter], latency: float = 0.0, host: str = "127.0.0.1"
+    ):
+        self.meters = list(meters)
+        self.latency = latency
+        self.host = host
+        self.addresses: List[Tuple[str, int]] = []
+        # Number of sessions that ended with a break.
+        self.completed_sessions = 0
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._listeners: List[socket.socket] = []
+        self._timers: List[Tuple[float, int, _Client, bytes]] = []
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        for meter in self.meters:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, 0))
+            listener.listen(socket.SOMAXCONN)
+            listener.setblocking(False)
+            self._selector.register(listener, selectors.EVENT_READ, meter)
+            self._listeners.append(listener)
+            self.addresses.append(listener.getsockname())
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._serve, name="fake-meters", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _serve(self) -> None:
+        assert self._selector is not None
+        try:
+            while not self._stopping:
+                timeout = 0.05
+                if self._timers:
+                    until_due = self._timers[0][0] - time.monotonic()
+                    timeout = min(timeout, max(0.0, until_due))
+                for key, mask in self._selector.select(timeout):
+                    if isinstance(key.data, FakeMeter):
+                        self._accept(key.fileobj, key.data)
+                        continue
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(client)
+                    if mask & selectors.EVENT_WRITE and client.sock.fileno() >= 0:
+                        self._flush(client)
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, client, data = heapq.heappop(self._timers)
+                    self._send_now(client, data)
+        finally:
+            for key in list(self._selector.get_map().values()):
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+            self._selector.close()
+            self._listeners.clear()
+            self._timers.clear()
+
+    def _accept(self, listener: socket.socket, meter: FakeMeter) -> None:
+        try:
+            sock, _ = listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, MeterConnection(meter))
+        self._selector.register(sock, selectors.EVENT_READ, client)
+
+    def _read(self, client: _Client) -> None:
+        try:
+            received = client.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            received = b""
+        if not received:
+            self._close(client)
+            return
+        answer = client.connection.feed(received)
+        if client.connection.closed:
+            self.completed_sessions += 1
+        if not answer:
+            return
+        if self.latency:
+            heapq.heappush(
+                self._timers,
+                (time.monotonic() + self.latency, next(self._sequence), client, answer),
+            )
+        else:
+            self._send_now(client, answer)
+
+    def _send_now(self, client: _Client, data: bytes) -> None:
+        if client.sock.fileno() < 0:
+            return
+        client.outgoing += data
+        self._flush(client)
+
+    def _flush(self, client: _Client) -> None:
+        try:
+            sent = client.sock.send(client.outgoing)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(client)
+            return
+        del client.outgoing[:sent]
+        events = selectors.EVENT_READ
+        if client.outgoing:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(client.sock, events, client)
+
+    def _close(self, client: _Client) -> None:
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(meters={len(self.meters)}, "
+            f"latency={self.latency!r})"
+        )
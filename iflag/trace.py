@@ -0,0 +1,70 @@
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Tuple, Iterator, List
+
+import attr
+
+SENT = "sent"
+RECEIVED = "received"
+
+
+@attr.s(auto_attribs=True)
+class TraceEntry:
+    """
+    A frame or message that was sent to or received from the device.
+    """
+
+    direction: str
+    timestamp: float
+    data: bytes
+
+    def __str__(self):
+        time_string = datetime.fromtimestamp(self.timestamp).isoformat(
+            timespec="milliseconds"
+        )
+        return f"{time_string} {self.direction:<8} {self.data.hex()}"
+
+
+class WireTrace:
+    """
+    Fixed size ring buffer of the most recent frames of a session. Recording only
+    stores a tuple of references so it is cheap enough to always be enabled. The
+    entries are only formatted when the trace is dumped, on error or on demand.
+
+    :param size: Number of frames to keep. 0 disables the trace.
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._entries: Deque[Tuple[str, float, bytes]] = deque(maxlen=size)
+
+    def sent(self, data: bytes) -> None:
+        if self.size:
+            self._entries.append((SENT, time.time(), data))
+
+    def received(self, data: bytes) -> None:
+        if self.size:
+            self._entries.append((RECEIVED, time.time(), data))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def entries(self) -> List[TraceEntry]:
+        return [TraceEntry(*entry) for entry in self._entries]
+
+    def format(self) -> str:
+        """
+        Formats the trace to a string with one frame per line.
+        """
+        return "\n".join(str(entry) for entry in self.entries)
+
+    def __iter__(self) -> Iterator[TraceEntry]:
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size!r})"
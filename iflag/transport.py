@@ -55,7 +55,7 @@ class BaseTransport:
                     in_data += b
                     continue
 
-        logger.debug(f"Received {in_data!r} over {self.__class__.__name__}")
+        logger.debug("Received %r over %s", in_data, self.__class__.__name__)
         return in_data
 
     def send(self, data: bytes):
@@ -65,7 +65,7 @@ class BaseTransport:
         :param data:
         """
         self._send(data)
-        logger.debug(f"Sent {data!r} over {self.__class__.__name__}")
+        logger.debug("Sent %r over %s", data, self.__class__.__name__)
 
     def _send(self, data: bytes):
         """
@@ -77,11 +77,33 @@ class BaseTransport:
 
     def recv(self, chars) -> bytes:
         """
-        Will receive data over the transport.
+        Will receive data over the transport. Blocks until all chars are received.
 
         :param chars:
         """
-        return self._recv(chars)
+        data = self._recv(chars)
+        while len(data) < chars:
+            more = self._recv(chars - len(data))
+            if not more:
+                raise exceptions.CommunicationError(
+                    f"Connection closed by device over {self.__class__.__name__}"
+                )
+            data += more
+        return data
+
+    def recv_some(self, max_chars: int = 4096) -> bytes:
+        """
+        Will receive the data that is available over the transport, at least 1 and
+        at most max_chars. Blocks until data is available.
+
+        :param max_chars:
+        """
+        data = self._recv(max_chars)
+        if not data:
+            raise exceptions.CommunicationError(
+                f"Connection closed by device over {self.__class__.__name__}"
+            )
+        return data
 
     def _recv(self, chars) -> bytes:
         """
@@ -109,7 +131,7 @@ class TcpTransport(BaseTransport):
         Connects the socket to the device network interface.
         """
         self.socket = self._get_socket()
-        logger.info(f"Connecting to {self.address}")
+        logger.info("Connecting to %s", self.address)
         try:
             self.socket.connect(self.address)
         except (OSError, IOError, socket.timeout, socket.error) as e:
@@ -120,7 +142,7 @@ class TcpTransport(BaseTransport):
         Closes the socket.
         """
         self.socket.close()
-        logger.info(f"Closed connection to {self.address}")
+        logger.info("Closed connection to %s", self.address)
 
     def _send(self, data: bytes):
         """
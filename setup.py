@@ -17,7 +17,8 @@ REQUIRED = ["attrs"]
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    "parquet": ["pyarrow"],
+    "toml": ["tomli; python_version < '3.11'"],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -78,7 +79,7 @@ setup(
     author_email=EMAIL,
     url=URL,
     packages=find_packages(exclude=("tests",)),
-    entry_points={},
+    entry_points={"console_scripts": ["iflag=iflag.cli:main"]},
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     include_package_data=True,
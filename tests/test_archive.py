@@ -0,0 +1,48 @@
+from datetime import datetime
+from decimal import Decimal
+
+from iflag import CorusClient
+from iflag.archive import RecordArchive
+
+from tests.test_client import FakeTransport, LAYOUT, event_frames, event_record
+
+
+def test_archive_records_of_read_and_decode_later(tmp_path):
+    archive = RecordArchive(tmp_path)
+    client = CorusClient(
+        FakeTransport(event_frames()), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    with archive.writer("meter-1", "event", LAYOUT) as writer:
+        records = client.read_database("event", archive=writer)
+
+    (segment,) = archive.segments("meter-1", "event")
+    assert segment.record_count == 3
+    assert segment.start == datetime(2020, 1, 1, 1)
+    assert segment.stop == datetime(2020, 1, 1, 3)
+    assert archive.meters() == ["meter-1"]
+
+    decoded = archive.read("meter-1", "event", LAYOUT, Decimal("1"))
+    assert list(decoded) == records
+
+    window = archive.read(
+        "meter-1", "event", LAYOUT, Decimal("1"), since=datetime(2020, 1, 1, 2)
+    )
+    assert [record["code"] for record in window] == [Decimal("30"), Decimal("20")]
+    assert archive.segments("meter-1", "event", until=datetime(2019, 1, 1)) == []
+
+
+def test_archive_records_without_date(tmp_path):
+    archive = RecordArchive(tmp_path)
+    no_date = b"\xff" * 4 + (20).to_bytes(2, "little")
+    with archive.writer("meter-1", "event", LAYOUT) as writer:
+        writer.write([event_record(datetime(2020, 1, 1, 3), 30), no_date])
+
+    (segment,) = archive.segments("meter-1", "event")
+    assert segment.stop == segment.start == datetime(2020, 1, 1, 3)
+    window = archive.read(
+        "meter-1", "event", LAYOUT, Decimal("1"), since=datetime(2020, 1, 1, 2)
+    )
+    assert list(window) == [
+        {"date": datetime(2020, 1, 1, 3), "code": Decimal("30")},
+        {"code": Decimal("20")},
+    ]
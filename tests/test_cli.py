@@ -0,0 +1,80 @@
+import json
+import socket
+import threading
+from decimal import Decimal
+
+from iflag import cli
+
+from tests.test_multiplex import serve_events
+
+FIRMWARE = {
+    "map_id": "test",
+    "databases": {
+        "event": {
+            "6": [
+                {"name": "date", "data_class": "Date"},
+                {"name": "code", "data_class": "Word"},
+            ]
+        }
+    },
+}
+
+
+def test_parse_meter_list():
+    lines = ["# gateway 1\n", "10.0.0.1:4001 meter-1\n", "\n", "10.0.0.1:4002\n"]
+    assert cli.parse_meter_list(lines) == [
+        ("meter-1", ("10.0.0.1", 4001)),
+        ("10.0.0.1:4002", ("10.0.0.1", 4002)),
+    ]
+
+
+def test_main_reports_invalid_layout(tmp_path, capsys):
+    layout = tmp_path / "test.json"
+    layout.write_text("{")
+    meters = tmp_path / "meters.txt"
+    meters.write_text("127.0.0.1:4001\n")
+
+    code = cli.main(
+        ["--meters", str(meters), "--layout", str(layout), "--database", "event"]
+    )
+    assert code == 2
+    assert capsys.readouterr().err.startswith("iflag: Invalid layout file")
+
+
+def test_main_streams_records_as_ndjson(tmp_path, capsys):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    thread = threading.Thread(target=serve_events, args=(server, 1, []))
+    thread.start()
+    host, port = server.getsockname()
+
+    layout = tmp_path / "test.json"
+    layout.write_text(json.dumps(FIRMWARE))
+    meters = tmp_path / "meters.txt"
+    meters.write_text(f"{host}:{port} meter-1\n")
+
+    code = cli.main(
+        [
+            "--meters",
+            str(meters),
+            "--layout",
+            str(layout),
+            "--database",
+            "event",
+            "--pulse-weight",
+            "1",
+            "--timeout",
+            "5",
+        ]
+    )
+    thread.join(5)
+    server.close()
+
+    out, err = capsys.readouterr()
+    lines = [json.loads(line) for line in out.splitlines()]
+    assert code == 0
+    codes = [Decimal(line["record"]["code"]) for line in lines]
+    assert codes == [Decimal("30"), Decimal("20"), Decimal("10")]
+    assert lines[0]["meter"] == "meter-1"
+    assert "1/1 meters read, 3 records" in err
@@ -0,0 +1,391 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from iflag import CorusClient, data, exceptions, messages, parse, protocol, utils
+from iflag.cache import ParameterCache, STATIC
+from iflag.client import RetryPolicy
+from iflag.data import DatabaseRecordParameter
+from iflag.transport import BaseTransport
+
+
+class FakeTransport(BaseTransport):
+    """
+    Transport that returns predefined data and records what is sent.
+    """
+
+    def __init__(self, in_data: bytes = b"", chunk_size: int = 4096):
+        super().__init__()
+        self.in_data = in_data
+        self.chunk_size = chunk_size
+        self.sent = []
+        self.disconnects = 0
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def _send(self, data: bytes):
+        self.sent.append(data)
+
+    def _recv(self, chars) -> bytes:
+        chars = min(chars, self.chunk_size)
+        out, self.in_data = self.in_data[:chars], self.in_data[chars:]
+        return out
+
+
+# Wakeup response, ident, pass and ACK sent by a device during startup.
+SIGN_ON_RESPONSE = b"\x00\x00\x00/ACTARIS\r\nPASS12\x06"
+
+
+def database_frame(frame_number: int, payload: bytes, last: bool = False) -> bytes:
+    if last:
+        frame_number |= 0b1000000000000000
+    frame_data = frame_number.to_bytes(2, "little") + payload
+    return utils.add_crc(b"\x01" + len(frame_data).to_bytes(1, "big") + frame_data + b"\x03")
+
+
+LAYOUT = {
+    "event": {
+        6: [
+            DatabaseRecordParameter(name="date", data_class=data.Date),
+            DatabaseRecordParameter(name="code", data_class=data.Word),
+        ]
+    }
+}
+
+
+def event_record(date: datetime, code: int) -> bytes:
+    return utils.date_to_byte(date) + code.to_bytes(2, "little")
+
+
+def event_frames() -> bytes:
+    records = b"".join(
+        event_record(datetime(2020, 1, 1, hour), code)
+        for hour, code in ((3, 30), (2, 20), (1, 10))
+    )
+    # second record spans both frames
+    return database_frame(0, b"\x06" + records[:8]) + database_frame(
+        1, records[8:], last=True
+    )
+
+
+def test_read_event_database_across_frames():
+    transport = FakeTransport(event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    records = client.read_database("event")
+    assert records == [
+        {"date": datetime(2020, 1, 1, 3), "code": Decimal("30")},
+        {"date": datetime(2020, 1, 1, 2), "code": Decimal("20")},
+        {"date": datetime(2020, 1, 1, 1), "code": Decimal("10")},
+    ]
+    assert transport.sent[1:] == [b"\x06"]
+
+
+def test_read_empty_event_range():
+    empty_frame = database_frame(0, b"\x00", last=True)
+    client = CorusClient(
+        FakeTransport(empty_frame * 2), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    start = datetime(2020, 1, 2)
+    stop = datetime(2020, 1, 1)
+    assert client.read_database("event", start=start, stop=stop) == []
+    assert list(client.iter_database("event", start=start, stop=stop)) == []
+    assert client.protocol.is_idle
+
+
+def test_iter_database_is_lazy():
+    transport = FakeTransport(event_frames(), chunk_size=16)
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    records = client.iter_database("event")
+    assert next(records)["code"] == Decimal("30")
+    assert transport.in_data.startswith(b"\x01")  # second frame not read yet
+
+
+def test_invalid_database():
+    client = CorusClient(FakeTransport(), LAYOUT, input_pulse_weight=Decimal("1"))
+    with pytest.raises(exceptions.CorusClientError):
+        client.read_database("unknown")
+
+
+def test_wire_trace_keeps_recent_frames():
+    transport = FakeTransport(event_frames())
+    client = CorusClient(
+        transport, LAYOUT, input_pulse_weight=Decimal("1"), wire_trace_size=2
+    )
+    client.read_database("event")
+    entries = client.wire_trace.entries
+    assert [entry.direction for entry in entries] == ["sent", "received"]
+    assert entries[0].data == b"\x06"
+    assert entries[1].data.startswith(b"\x01")
+
+
+def test_startup_clears_wire_trace():
+    transport = FakeTransport(event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    client.read_database("event")
+    transport.in_data = SIGN_ON_RESPONSE
+    client.startup()
+    assert [entry.data for entry in client.wire_trace.entries][:2] == [
+        protocol.WAKEUP,
+        b"\x00\x00\x00",
+    ]
+
+
+def test_read_database_fields():
+    client = CorusClient(
+        FakeTransport(event_frames()), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    records = client.read_database("event", fields=["code"])
+    assert records == [
+        {"code": Decimal("30")},
+        {"code": Decimal("20")},
+        {"code": Decimal("10")},
+    ]
+
+
+def test_unknown_fields_are_rejected_before_sending():
+    transport = FakeTransport(event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    with pytest.raises(exceptions.CorusClientError):
+        client.read_database("event", fields=["code", "missing"])
+    assert transport.sent == []
+
+
+def test_read_database_columns_reduces_request_and_layout():
+    layout = {
+        "event": {
+            8: [
+                DatabaseRecordParameter(name="date", data_class=data.Date),
+                DatabaseRecordParameter(
+                    name="code", data_class=data.Word, option_bit=3
+                ),
+                DatabaseRecordParameter(
+                    name="extra", data_class=data.Word, option_bit=4
+                ),
+            ]
+        }
+    }
+    records = event_record(datetime(2020, 1, 1, 3), 30)
+    transport = FakeTransport(database_frame(0, b"\x06" + records, last=True))
+    client = CorusClient(transport, layout, input_pulse_weight=Decimal("1"))
+    result = client.read_database("event", columns=["code"])
+    assert result == [{"date": datetime(2020, 1, 1, 3), "code": Decimal("30")}]
+    assert transport.sent[0][4:8] == b"\xe9\xff\xff\xff"
+
+    with pytest.raises(exceptions.CorusClientError):
+        client.read_database("event", columns=["code"], fields=["extra"])
+    assert len(transport.sent) == 1
+
+    transport.in_data = database_frame(0, b"\x06" + records, last=True)
+    result = client.read_database("event", columns=["code"], fields=["code"])
+    assert result == [{"code": Decimal("30")}]
+
+    transport.in_data = database_frame(0, b"\x06" + records, last=True)
+    result = client.read_database("event", columns=["code"], fields=["date"])
+    assert result == [{"date": datetime(2020, 1, 1, 3)}]
+
+
+def test_count_records_and_progress():
+    count_frame = database_frame(0, b"\x06\x03\x00", last=True)
+    transport = FakeTransport(count_frame + event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    reports = []
+    records = client.read_database("event", count_records=True, progress=reports.append)
+    assert len(records) == 3
+    assert transport.sent[0][3] == 0b00010100
+    assert [(p.frames_received, p.records_received) for p in reports] == [(1, 1), (2, 3)]
+    assert reports[-1].expected_records == 3
+
+
+def test_database_count_estimates():
+    count = messages.DatabaseCount("interval", record_count=100, record_size=52)
+    assert count.total_bytes == 5200
+    assert count.frame_count == 21
+    assert count.estimated_transfer_time(bytes_per_second=1000, round_trip_time=1) > 21
+
+
+def test_corrupt_frame_is_retransmitted():
+    first, rest = event_frames()[:16], event_frames()[16:]
+    corrupt = first[:-1] + bytes([first[-1] ^ 0xFF])
+    transport = FakeTransport(corrupt + b"\x00\x00" + first + rest)
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    records = client.read_database("event")
+    assert len(records) == 3
+    assert transport.sent[1:] == [b"\x15", b"\x06"]
+
+
+def test_retries_exhausted():
+    frame = event_frames()[:16]
+    corrupt = frame[:-1] + bytes([frame[-1] ^ 0xFF])
+    transport = FakeTransport(corrupt * 2)
+    client = CorusClient(
+        transport,
+        LAYOUT,
+        input_pulse_weight=Decimal("1"),
+        retry_policy=RetryPolicy(max_retries=1),
+    )
+    with pytest.raises(exceptions.CorusClientError):
+        client.read_database("event")
+    assert transport.sent[1:] == [b"\x15"]
+
+
+def test_read_database_pipelined():
+    client = CorusClient(
+        FakeTransport(event_frames()), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    records = client.read_database("event", pipelined=True)
+    assert [record["code"] for record in records] == [
+        Decimal("30"),
+        Decimal("20"),
+        Decimal("10"),
+    ]
+
+
+def test_read_databases_in_one_session():
+    transport = FakeTransport(event_frames() + event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    results = client.read_databases(
+        [("event", None, None), ("event", datetime(2020, 1, 1), None)]
+    )
+    assert [len(records) for records in results] == [3, 3]
+
+
+def test_read_databases_validates_before_sending():
+    transport = FakeTransport()
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    with pytest.raises(exceptions.CorusClientError):
+        client.read_databases([("event", None, None), ("daily", None, None)])
+    assert transport.sent == []
+
+
+def test_read_database_named_tuples():
+    transport = FakeTransport(event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    records = client.read_database("event", named_tuples=True)
+    assert records[0].date == datetime(2020, 1, 1, 3)
+    assert records[0].code == Decimal("30")
+    assert type(records[0]) is type(records[2])
+
+    # The cached decoders are kept apart by the record type.
+    transport.in_data = event_frames()
+    assert client.read_database("event")[0] == {
+        "date": datetime(2020, 1, 1, 3),
+        "code": Decimal("30"),
+    }
+    transport.in_data = event_frames()
+    assert type(client.read_database("event", named_tuples=True)[0]) is type(
+        records[0]
+    )
+
+
+def test_named_tuples_with_invalid_names_are_rejected_before_sending():
+    layout = {
+        "event": {
+            6: [
+                DatabaseRecordParameter(name="date", data_class=data.Date),
+                DatabaseRecordParameter(name="class", data_class=data.Word),
+            ]
+        }
+    }
+    transport = FakeTransport(event_frames())
+    client = CorusClient(transport, layout, input_pulse_weight=Decimal("1"))
+    with pytest.raises(exceptions.DataError):
+        client.read_database("event", named_tuples=True)
+    assert transport.sent == []
+    with pytest.raises(exceptions.DataError):
+        parse.RecordDecoder(layout["event"][6], named_tuples=True)
+
+
+def response_frame(frame_data: bytes) -> bytes:
+    return utils.add_crc(
+        b"\x01" + len(frame_data).to_bytes(1, "big") + frame_data + b"\x03"
+    )
+
+
+def test_startup_signs_on():
+    transport = FakeTransport(SIGN_ON_RESPONSE)
+    client = CorusClient(transport)
+    client.startup()
+    assert transport.sent == [
+        protocol.WAKEUP,
+        protocol.SIGN_ON,
+        protocol.SIGN_ON_ACK,
+        b"PASS12",
+    ]
+    assert client.protocol.is_idle
+
+
+def test_parameter_cache_leaves_out_none_data():
+    serial = data.IFlagParameter(id=0x10, data_class=data.Byte)
+    status = data.IFlagParameter(id=0x20, data_class=data.Byte)
+    transport = FakeTransport(response_frame(b"\xff\x02"))
+    cache = ParameterCache(ttls={serial.id: STATIC})
+    client = CorusClient(transport, parameter_cache=cache)
+
+    assert client.read_parameters([serial, status]) == {0x20: 2}
+    assert client.read_parameters([serial]) == {}
+    assert len(transport.sent) == 1
+
+
+def test_parameter_cache_only_reads_misses_and_is_invalidated_by_writes():
+    serial = data.IFlagParameter(id=0x10, data_class=data.Byte)
+    status = data.IFlagParameter(id=0x20, data_class=data.Byte)
+    transport = FakeTransport(
+        response_frame(b"\x01\x02") + response_frame(b"\x03") + b"\x06"
+        + response_frame(b"\x05\x06")
+    )
+    cache = ParameterCache(ttls={serial.id: STATIC})
+    client = CorusClient(transport, parameter_cache=cache)
+
+    assert client.read_parameters([serial, status]) == {0x10: 1, 0x20: 2}
+    assert client.read_parameters([serial, status]) == {0x10: 1, 0x20: 3}
+    assert transport.sent[-1] == messages.ReadRequest([status.id]).to_bytes()
+
+    client.write_parameters([(serial, 5)])
+    assert client.read_parameters([serial, status]) == {0x10: 5, 0x20: 6}
+
+
+def test_take_while_stops_read_with_break():
+    records = [
+        event_record(datetime(2020, 1, 1, hour), code)
+        for hour, code in ((3, 30), (2, 20), (1, 10))
+    ]
+    transport = FakeTransport(
+        database_frame(0, b"\x06" + records[0] + records[1])
+        + database_frame(1, records[2], last=True),
+        chunk_size=20,
+    )
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    result = client.read_database("event", take_while=lambda r: r["code"] > 25)
+    assert [record["code"] for record in result] == [Decimal("30")]
+    assert transport.sent[1:] == [b"\x01B0\x03!1"]
+    assert transport.disconnects == 1
+
+
+@pytest.mark.parametrize("memory_budget, spilled", [(1000, False), (10, True)])
+def test_read_database_spooled(memory_budget, spilled):
+    client = CorusClient(
+        FakeTransport(event_frames()), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    with client.read_database("event", memory_budget=memory_budget) as records:
+        assert records.spilled is spilled
+        assert len(records) == 3
+        for _ in range(2):
+            assert [record["code"] for record in records] == [
+                Decimal("30"),
+                Decimal("20"),
+                Decimal("10"),
+            ]
+
+
+def test_read_database_spooled_without_records():
+    count_frame = database_frame(0, b"\x00", last=True)
+    client = CorusClient(
+        FakeTransport(count_frame), LAYOUT, input_pulse_weight=Decimal("1")
+    )
+    records = client.read_database("event", count_records=True, memory_budget=10)
+    assert list(records) == []
@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from iflag import CorusClient, data, utils
+from iflag.cache import ParameterCache
+from iflag.clock import ClockReading, plan_clock_write
+from iflag.data import IFlagParameter
+
+from tests.test_client import FakeTransport
+
+CLOCK = IFlagParameter(id=0x30, data_class=data.Date)
+
+
+def response_frame(frame_data: bytes) -> bytes:
+    return utils.add_crc(
+        b"\x01" + len(frame_data).to_bytes(1, "big") + frame_data + b"\x03"
+    )
+
+
+def test_reading_offset_uses_middle_of_request():
+    reading = ClockReading.from_exchange(
+        datetime(1970, 1, 1, 0, 0, 12), 10.0, 11.0, timezone.utc
+    )
+    assert reading.round_trip_time == 1.0
+    assert reading.reference_time == datetime(1970, 1, 1, 0, 0, 10, 500000)
+    assert reading.offset == 2.0
+
+
+def test_plan_clock_write_compensates_half_round_trip():
+    assert plan_clock_write(0.2, align=False, now=100.3) == pytest.approx((100.3, 100.4))
+    assert plan_clock_write(0.2, align=True, now=100.3) == pytest.approx((100.9, 101.0))
+
+
+def test_sync_clock_writes_when_out_of_tolerance():
+    meter_time = datetime(2020, 1, 1)
+    transport = FakeTransport(response_frame(utils.date_to_byte(meter_time)) + b"\x06")
+    client = CorusClient(transport)
+    result = client.sync_clock(CLOCK, align=False, timezone=timezone.utc)
+    assert result.synced
+    assert result.reading.meter_time == meter_time
+    written = utils.date_to_byte(result.written_time)
+    assert written in transport.sent[-1]
+
+
+def test_sync_clock_reads_clock_past_the_cache():
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    transport = FakeTransport(
+        response_frame(utils.date_to_byte(datetime(2020, 1, 1)))
+        + response_frame(utils.date_to_byte(now))
+    )
+    client = CorusClient(transport, parameter_cache=ParameterCache({CLOCK.id: 60}))
+    client.read_parameters([CLOCK])
+    result = client.sync_clock(CLOCK, tolerance=5, timezone=timezone.utc)
+    assert result.reading.meter_time == now
+    assert not result.synced
+    assert len(transport.sent) == 2
+
+
+def test_sync_clock_skips_clock_within_tolerance():
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    transport = FakeTransport(response_frame(utils.date_to_byte(now)))
+    client = CorusClient(transport)
+    result = client.sync_clock(CLOCK, tolerance=5, timezone=timezone.utc)
+    assert not result.synced
+    assert len(transport.sent) == 1
@@ -11,3 +11,29 @@ def test_index_from_bytes():
 def test_index9_from_bytes():
     input = b"\x14.\x00\x00\x00\x80\x1d,\x04"
     assert data.Index9.from_bytes(input).value == Decimal("11796.7")
+
+
+@pytest.mark.parametrize(
+    "data_class,input,expected",
+    [
+        (data.Word, b"\x10\x27", Decimal("10000")),
+        (data.Float1, b"\xb4\xf9", Decimal("-16.12")),
+        (data.Float2, b"\xe8\x83", Decimal("10")),
+        (data.Float3, b"\x0c\x40", Decimal("12")),
+    ],
+)
+def test_memoized_16_bit_values(data_class, input, expected):
+    first = data_class.from_bytes(input).value
+    second = data_class.from_bytes(input).value
+    assert first == expected
+    assert second is first
+
+
+@pytest.mark.parametrize(
+    "data_class",
+    [data.Word, data.EWord, data.ULong, data.EULong, data.Index9, data.CorusString],
+)
+def test_decode_from_memoryview(data_class):
+    in_bytes = bytes(range(0x41, 0x41 + data_class.LENGTH))
+    view = memoryview(in_bytes)
+    assert data_class.to_python(view) == data_class.to_python(in_bytes)
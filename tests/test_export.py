@@ -0,0 +1,101 @@
+import io
+import json
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from iflag import data
+from iflag.data import DatabaseRecordParameter
+from iflag.export import CsvRecordWriter, NdjsonRecordWriter, ParquetRecordWriter
+
+LAYOUT = [
+    DatabaseRecordParameter(name="status", data_class=data.Byte),
+    DatabaseRecordParameter(name="end_date", data_class=data.Date),
+    DatabaseRecordParameter(name="consumption", data_class=data.ULong),
+    DatabaseRecordParameter(name="none_data", data_class=data.Null2),
+]
+
+RECORDS = [
+    {"status": 0, "end_date": datetime(2020, 1, 1, 10), "consumption": Decimal("1.5")},
+    {"status": 1, "end_date": datetime(2020, 1, 1, 11)},
+]
+
+
+def test_csv_writer():
+    out = io.StringIO()
+    with CsvRecordWriter(out, LAYOUT) as writer:
+        for record in RECORDS:
+            writer.write(record)
+    assert out.getvalue().splitlines() == [
+        "status,end_date,consumption",
+        "0,2020-01-01T10:00:00,1.5",
+        "1,2020-01-01T11:00:00,",
+    ]
+    assert writer.records_written == 2
+
+
+def test_ndjson_writer():
+    out = io.StringIO()
+    with NdjsonRecordWriter(out, LAYOUT) as writer:
+        writer.write_batch(RECORDS)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[0] == {
+        "status": 0,
+        "end_date": "2020-01-01T10:00:00",
+        "consumption": "1.5",
+    }
+    assert lines[1]["consumption"] is None
+    assert len(lines) == 2
+
+
+def test_ndjson_writer_skips_empty_batch():
+    out = io.StringIO()
+    with NdjsonRecordWriter(out, LAYOUT) as writer:
+        writer.write_batch([])
+        writer.write_all([])
+    assert out.getvalue() == ""
+
+
+def test_writers_accept_namedtuple_records():
+    Record = namedtuple("Record", ["status", "end_date", "consumption", "none_data"])
+    records = [
+        Record(**{"consumption": None, "none_data": None, **record})
+        for record in RECORDS
+    ]
+
+    out = io.StringIO()
+    with NdjsonRecordWriter(out, LAYOUT) as writer:
+        writer.write_all(records)
+    assert [json.loads(line)["status"] for line in out.getvalue().splitlines()] == [
+        0,
+        1,
+    ]
+
+    out = io.StringIO()
+    with CsvRecordWriter(out, LAYOUT) as writer:
+        writer.write(records[0])
+    assert out.getvalue().splitlines()[1] == "0,2020-01-01T10:00:00,1.5"
+
+
+def test_parquet_writer_batches_and_buffered_records(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    path = str(tmp_path / "records.parquet")
+    with ParquetRecordWriter(path, LAYOUT, row_group_size=1) as writer:
+        writer.write_batch(RECORDS)
+        writer.write_batch([])
+        writer.write(RECORDS[0])
+    assert writer.records_written == 3
+
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.column_names == ["status", "end_date", "consumption"]
+    rows = table.to_pylist()
+    assert [row["status"] for row in rows] == [0, 1, 0]
+    assert rows[0]["end_date"] == datetime(2020, 1, 1, 10)
+    assert rows[0]["consumption"] == Decimal("1.5")
+    assert rows[1]["consumption"] is None
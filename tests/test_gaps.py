@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from iflag import CorusClient, messages
+from iflag.gaps import Gap, find_gaps, missing_record_count
+
+from tests.test_client import FakeTransport, LAYOUT, database_frame, event_frames
+
+HOUR = timedelta(hours=1)
+
+
+def hours(*values):
+    return [datetime(2020, 1, 1, value) for value in values]
+
+
+def test_find_gaps():
+    gaps = find_gaps(hours(1, 2, 5, 6, 8), HOUR, *hours(0, 10))
+    assert gaps == [
+        Gap(*hours(0, 0), HOUR),
+        Gap(*hours(3, 4), HOUR),
+        Gap(*hours(7, 7), HOUR),
+        Gap(*hours(9, 10), HOUR),
+    ]
+    assert missing_record_count(gaps) == 6
+    assert find_gaps(hours(0, 1, 2), HOUR, *hours(0, 2)) == []
+
+
+def test_find_gaps_aligns_window_to_records():
+    since = datetime(2020, 1, 1, 0, 30)
+    until = datetime(2020, 1, 1, 9, 30)
+    assert find_gaps(hours(*range(1, 10)), HOUR, since, until) == []
+    assert find_gaps(hours(2, 3, 8), HOUR, since, until) == [
+        Gap(*hours(1, 1), HOUR),
+        Gap(*hours(4, 7), HOUR),
+        Gap(*hours(9, 9), HOUR),
+    ]
+    assert find_gaps(hours(2), HOUR, since, datetime(2020, 1, 1, 0, 45)) == []
+
+
+def test_find_gaps_merges_close_gaps():
+    gaps = find_gaps(hours(1, 2, 5, 6, 8), HOUR, *hours(1, 8), merge_within=1)
+    assert gaps == [Gap(*hours(3, 4), HOUR), Gap(*hours(7, 7), HOUR)]
+    gaps = find_gaps(hours(1, 2, 5, 6, 8), HOUR, *hours(1, 8), merge_within=2)
+    assert gaps == [Gap(*hours(3, 7), HOUR)]
+
+
+def test_read_gaps_requests_each_gap():
+    transport = FakeTransport(event_frames() + event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    gaps = [Gap(*hours(1, 2), HOUR), Gap(*hours(5, 7), HOUR)]
+    records = client.read_gaps("event", gaps)
+    assert len(records) == 6
+    assert transport.sent[0] == messages.ReadDatabaseRequest(
+        "event", start=datetime(2020, 1, 1, 7), stop=datetime(2020, 1, 1, 5)
+    ).to_bytes()
+
+
+def test_read_gaps_without_records_on_the_meter():
+    empty_frame = database_frame(0, b"\x00", last=True)
+    transport = FakeTransport(empty_frame + event_frames())
+    client = CorusClient(transport, LAYOUT, input_pulse_weight=Decimal("1"))
+    gaps = [Gap(*hours(1, 2), HOUR), Gap(*hours(5, 7), HOUR)]
+    assert len(client.read_gaps("event", gaps)) == 3
@@ -0,0 +1,67 @@
+import socket
+from datetime import datetime
+from decimal import Decimal
+
+from iflag import CorusClient, data
+from iflag.data import IFlagParameter
+from iflag.loadtest import run_level
+from iflag.testing import (
+    FakeMeter,
+    FakeMeterServer,
+    INTERVAL_LAYOUT,
+    interval_records,
+)
+
+
+def test_sessions_against_fake_meters():
+    records = interval_records(100, newest=datetime(2020, 1, 1))
+    meters = [FakeMeter(databases={"interval": records}) for _ in range(3)]
+    with FakeMeterServer(meters) as server:
+        result = run_level(server.addresses, concurrency=2, timeout=5)
+
+    assert not result.errors
+    assert result.sessions == 3
+    assert result.records == 300
+    assert result.meters_per_minute > 0
+
+
+def test_fake_meter_answers_parameters_and_counts():
+    records = interval_records(3, newest=datetime(2020, 1, 1))
+    meter = FakeMeter(
+        parameters={0x5E: b"\x12\x34", 0x5F: b"\x01"},
+        databases={"interval": records},
+    )
+    with FakeMeterServer([meter]) as server:
+        client = CorusClient.with_tcp_transport(
+            server.addresses[0], INTERVAL_LAYOUT, input_pulse_weight=Decimal("1")
+        )
+        client.startup()
+        values = client.read_parameters(
+            [
+                IFlagParameter(id=0x5E, data_class=data.Word),
+                IFlagParameter(id=0x5F, data_class=data.Byte),
+            ]
+        )
+        count = client.count_database_records("interval")
+        decoded = client.read_database("interval")
+        client.shutdown()
+
+    assert count.record_count == 3
+    assert count.record_size == 20
+    assert values == {0x5E: Decimal(0x3412), 0x5F: 1}
+    assert [record["end_date"] for record in decoded] == [
+        datetime(2020, 1, 1, 0),
+        datetime(2019, 12, 31, 23),
+        datetime(2019, 12, 31, 22),
+    ]
+
+
+def test_failed_sessions_are_counted():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    address = server.getsockname()
+    server.close()
+
+    result = run_level([address], concurrency=1, timeout=5)
+    assert result.sessions == 1
+    assert sum(result.errors.values()) == 1
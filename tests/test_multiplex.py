@@ -0,0 +1,176 @@
+import socket
+import threading
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from iflag import messages
+from iflag.multiplex import Multiplexer, MeterSession, Operation, ReadDatabase, Steps
+from iflag.protocol import WAKEUP, SIGN_ON, SIGN_ON_ACK, ACK, BREAK
+
+from tests.test_client import LAYOUT, event_frames
+
+
+def recv_exactly(conn: socket.socket, length: int) -> bytes:
+    data = b""
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def sign_on(conn: socket.socket, received: list):
+    received.append(recv_exactly(conn, len(WAKEUP)))
+    conn.sendall(b"\x00\x00\x00")
+    received.append(recv_exactly(conn, len(SIGN_ON)))
+    conn.sendall(b"/ACTARIS\r\n")
+    received.append(recv_exactly(conn, len(SIGN_ON_ACK)))
+    conn.sendall(b"PASS12")
+    received.append(recv_exactly(conn, 6))
+    conn.sendall(ACK)
+
+
+def serve_events(
+    server: socket.socket,
+    connections: int,
+    received: list,
+    barrier: Optional[threading.Barrier] = None,
+):
+    """
+    Serves event database reads. With a barrier each connection waits until the
+    other servers have accepted a connection too.
+    """
+    request = messages.ReadDatabaseRequest(database="event").to_bytes()
+    frames = event_frames()
+    first_frame_length = frames[1] + 5
+    for _ in range(connections):
+        conn, _ = server.accept()
+        with conn:
+            if barrier is not None:
+                barrier.wait()
+            sign_on(conn, received)
+            received.append(recv_exactly(conn, len(request)))
+            conn.sendall(frames[:first_frame_length])
+            received.append(recv_exactly(conn, 1))
+            conn.sendall(frames[first_frame_length:])
+            received.append(recv_exactly(conn, len(BREAK)))
+
+
+def listen() -> socket.socket:
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(2)
+    return server
+
+
+def test_sessions_read_databases_concurrently():
+    servers = [listen() for _ in range(3)]
+    # Only passed when all three sessions are connected at the same time.
+    barrier = threading.Barrier(len(servers), timeout=5)
+    received = []
+    threads = [
+        threading.Thread(target=serve_events, args=(server, 1, received, barrier))
+        for server in servers
+    ]
+    for thread in threads:
+        thread.start()
+
+    operation = ReadDatabase("event", LAYOUT, input_pulse_weight=Decimal("1"))
+    multiplexer = Multiplexer(max_sessions=3)
+    for server in servers:
+        multiplexer.add(MeterSession(server.getsockname(), [operation], timeout=5))
+    sessions = multiplexer.run()
+    for thread in threads:
+        thread.join(5)
+    for server in servers:
+        server.close()
+
+    assert [session.error for session in sessions] == [None, None, None]
+    for session in sessions:
+        records = session.results[0]
+        assert [record["date"] for record in records] == [
+            datetime(2020, 1, 1, hour) for hour in (3, 2, 1)
+        ]
+    assert received[-1] == BREAK
+
+
+def test_records_are_passed_on_per_frame():
+    server = listen()
+    thread = threading.Thread(target=serve_events, args=(server, 1, []))
+    thread.start()
+
+    batches = []
+    operation = ReadDatabase(
+        "event",
+        LAYOUT,
+        input_pulse_weight=Decimal("1"),
+        on_records=lambda session, records: batches.append(records),
+    )
+    session = MeterSession(server.getsockname(), [operation], timeout=5)
+    multiplexer = Multiplexer()
+    multiplexer.add(session)
+    multiplexer.run()
+    thread.join(5)
+    server.close()
+
+    assert session.error is None
+    assert session.results == [3]
+    # The first frame holds one complete record, the second the other two.
+    assert [[record["code"] for record in batch] for batch in batches] == [
+        [Decimal("30")],
+        [Decimal("20"), Decimal("10")],
+    ]
+
+
+class FailingOperation(Operation):
+    def run(self, session: MeterSession) -> Steps:
+        raise KeyError("missing")
+        yield b""
+
+
+def serve_sign_on(server: socket.socket):
+    conn, _ = server.accept()
+    with conn:
+        sign_on(conn, [])
+        recv_exactly(conn, 1)
+
+
+def test_unexpected_error_only_fails_its_session():
+    failing_server, server = listen(), listen()
+    threads = [
+        threading.Thread(target=serve_sign_on, args=(failing_server,)),
+        threading.Thread(target=serve_events, args=(server, 1, [])),
+    ]
+    for thread in threads:
+        thread.start()
+
+    operation = ReadDatabase("event", LAYOUT, input_pulse_weight=Decimal("1"))
+    multiplexer = Multiplexer(max_sessions=2)
+    failing = MeterSession(failing_server.getsockname(), [FailingOperation()], 5)
+    session = MeterSession(server.getsockname(), [operation], timeout=5)
+    multiplexer.add(failing)
+    multiplexer.add(session)
+    multiplexer.run()
+    for thread in threads:
+        thread.join(5)
+    failing_server.close()
+    server.close()
+
+    assert isinstance(failing.error, KeyError)
+    assert session.error is None
+    assert len(session.results[0]) == 3
+
+
+def test_connection_refused_fails_session():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    address = server.getsockname()
+    server.close()
+
+    multiplexer = Multiplexer()
+    multiplexer.add(MeterSession(address, [], timeout=5))
+    (session,) = multiplexer.run()
+    assert session.error is not None
+    assert session.results == []
@@ -0,0 +1,82 @@
+import pytest
+
+from iflag import exceptions, utils
+from iflag.protocol import (
+    CorusProtocol,
+    SendData,
+    SignOnCompleted,
+    WakeupCompleted,
+    RecordsReceived,
+    DatabaseCompleted,
+    ResponseReceived,
+    ProtocolFailed,
+    ACK,
+    NACK,
+)
+
+
+def frame(frame_data: bytes) -> bytes:
+    return utils.add_crc(
+        b"\x01" + len(frame_data).to_bytes(1, "big") + frame_data + b"\x03"
+    )
+
+
+def feed_bytewise(protocol: CorusProtocol, data: bytes):
+    events = []
+    for i in range(len(data)):
+        events.extend(protocol.feed(data[i : i + 1]))
+    return events
+
+
+def test_wakeup_and_sign_on():
+    protocol = CorusProtocol()
+    assert protocol.wakeup() == bytes(200)
+    assert isinstance(protocol.feed(b"\x00\x00\x00")[-1], WakeupCompleted)
+
+    assert protocol.sign_on() == b"/?!\r\n"
+    events = feed_bytewise(protocol, b"/ACTARIS\r\n" + b"PASS12" + ACK)
+    sent = [event.data for event in events if isinstance(event, SendData)]
+    assert sent == [b"\x06\x30\x37\x36\x0d\x0a", b"PASS12"]
+    assert events[-1] == SignOnCompleted(b"/ACTARIS\r\n")
+    assert protocol.is_idle
+
+
+def test_database_frames_in_any_chunk_size():
+    data = frame(b"\x00\x00\x02" + b"abc") + frame(b"\x01\x80" + b"d")
+    protocol = CorusProtocol()
+    protocol.read_database(b"request")
+    events = feed_bytewise(protocol, data)
+    records = [
+        record
+        for event in events
+        if isinstance(event, RecordsReceived)
+        for record in event.records
+    ]
+    assert records == [b"ab", b"cd"]
+    assert [event.data for event in events if isinstance(event, SendData)] == [ACK]
+    assert events[-1] == DatabaseCompleted(frames_received=2, records_received=2)
+
+
+def test_corrupt_response_is_nacked():
+    good = frame(b"\x10\x20")
+    bad = good[:-1] + bytes([good[-1] ^ 0xFF])
+    protocol = CorusProtocol()
+    protocol.request(b"request")
+    events = protocol.feed(bad)
+    assert [event.data for event in events if isinstance(event, SendData)] == [NACK]
+    assert protocol.feed(good)[-1] == ResponseReceived(b"\x10\x20")
+
+
+def test_request_while_busy_is_rejected():
+    protocol = CorusProtocol()
+    protocol.request(b"request")
+    with pytest.raises(exceptions.ProtocolError):
+        protocol.request(b"request")
+
+
+def test_unexpected_wakeup_response_fails():
+    protocol = CorusProtocol()
+    protocol.wakeup()
+    event = protocol.feed(b"\x00\x01\x00")[-1]
+    assert isinstance(event, ProtocolFailed)
+    assert protocol.is_idle
@@ -0,0 +1,97 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+from iflag import data, exceptions
+from iflag.registry import FirmwareRegistry, compile_definition
+
+DEFINITION = {
+    "map_id": "B0040",
+    "parameters": {"pulse_weight": {"id": 1, "data_class": "Float"}},
+    "databases": {
+        "daily": {
+            "6": [
+                {"name": "end_date", "data_class": "Date"},
+                {
+                    "name": "consumption",
+                    "data_class": "Word",
+                    "affected_by_pulse_input": True,
+                    "multiplied": "10",
+                },
+            ]
+        }
+    },
+}
+
+
+DEFINITION_TOML = """
+map_id = "B0040"
+
+[parameters.pulse_weight]
+id = 1
+data_class = "Float"
+
+[[databases.daily.6]]
+name = "end_date"
+data_class = "Date"
+
+[[databases.daily.6]]
+name = "consumption"
+data_class = "Word"
+affected_by_pulse_input = true
+multiplied = "10"
+"""
+
+
+def test_load_and_cache(tmp_path):
+    path = tmp_path / "b0040.json"
+    path.write_text(json.dumps(DEFINITION))
+    cache_dir = tmp_path / "cache"
+
+    registry = FirmwareRegistry(cache_dir=cache_dir)
+    registry.load_directory(tmp_path)
+    definition = registry.get("b0040")
+    assert definition.parameters["pulse_weight"].data_class is data.Float
+    consumption = definition.database_layout["daily"][6][1]
+    assert consumption.multiplied == Decimal("10")
+    assert not cache_dir.exists()
+
+    toml_path = tmp_path / "b0040.toml"
+    toml_path.write_text(DEFINITION_TOML)
+    try:
+        from_toml = registry.load_file(toml_path)
+    except ImportError:
+        pytest.skip("TOML support is not installed")
+    assert from_toml == definition
+    assert len(list(cache_dir.iterdir())) == 1
+
+    cached = FirmwareRegistry(cache_dir=cache_dir).load_file(toml_path)
+    assert cached == definition
+
+
+def test_invalid_record_length(tmp_path):
+    definition = dict(DEFINITION, databases={"daily": {"7": DEFINITION["databases"]["daily"]["6"]}})
+    path = tmp_path / "b0040.json"
+    path.write_text(json.dumps(definition))
+    with pytest.raises(exceptions.DataError):
+        FirmwareRegistry().load_file(path)
+
+
+@pytest.mark.parametrize(
+    "databases",
+    [
+        {"dayly": DEFINITION["databases"]["daily"]},
+        {
+            "daily": {
+                "6": [
+                    {"name": "end_date", "data_class": "Date"},
+                    {"name": "consumption", "data_class": "Word", "option_bit": "3"},
+                ]
+            }
+        },
+    ],
+)
+def test_invalid_database_and_option_bit(databases):
+    with pytest.raises(exceptions.DataError):
+        compile_definition(dict(DEFINITION, databases=databases))
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from iflag import data, exceptions
+from iflag.data import DatabaseRecordParameter
+from iflag.registry import compile_definition
+from iflag.rollup import Rollup, HOURLY, DAILY
+
+PARAMETERS = [
+    DatabaseRecordParameter(name="end_date", data_class=data.Date),
+    DatabaseRecordParameter(name="consumption", data_class=data.Word, aggregate="sum"),
+    DatabaseRecordParameter(name="pressure", data_class=data.Float2, aggregate="max"),
+    DatabaseRecordParameter(
+        name="temperature", data_class=data.Float1, aggregate="average"
+    ),
+    DatabaseRecordParameter(name="status", data_class=data.Byte),
+]
+
+
+def records():
+    start = datetime(2020, 1, 1, 23)
+    for minutes, consumption, pressure, temperature in (
+        (30, 1, 2, 4),
+        (60, 2, 3, 6),
+        (90, 4, 1, None),
+    ):
+        yield {
+            "end_date": start + timedelta(minutes=minutes),
+            "consumption": Decimal(consumption),
+            "pressure": Decimal(pressure),
+            "temperature": None if temperature is None else Decimal(temperature),
+            "status": 0,
+        }
+
+
+def test_hourly_rollup_uses_interval_start():
+    rollup = Rollup(PARAMETERS, HOURLY)
+    rollup.add_all(records())
+    assert rollup.results() == [
+        {
+            "period": datetime(2020, 1, 1, 23),
+            "records": 2,
+            "consumption": Decimal(3),
+            "pressure": Decimal(3),
+            "temperature": Decimal(5),
+        },
+        {
+            "period": datetime(2020, 1, 2),
+            "records": 1,
+            "consumption": Decimal(4),
+            "pressure": Decimal(1),
+            "temperature": None,
+        },
+    ]
+
+
+def test_pop_complete_periods():
+    rollup = Rollup(PARAMETERS, DAILY)
+    rollup.add_all(records())
+    (day,) = rollup.pop_complete(datetime(2020, 1, 2, 12))
+    assert day["period"] == datetime(2020, 1, 1)
+    assert [result["period"] for result in rollup.results()] == [datetime(2020, 1, 2)]
+
+
+def test_registry_rejects_unknown_aggregate():
+    definition = {
+        "map_id": "test",
+        "databases": {
+            "interval": {"2": [{"name": "v", "data_class": "Word", "aggregate": "x"}]}
+        },
+    }
+    with pytest.raises(exceptions.DataError):
+        compile_definition(definition)
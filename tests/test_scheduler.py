@@ -0,0 +1,48 @@
+from iflag.scheduler import Scheduler, Job
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_priority_order_skips_full_hosts():
+    scheduler = Scheduler(max_active=3, max_active_per_host=1)
+    for host, item, priority in (
+        ("gw1", "a", 1),
+        ("gw1", "b", 0),
+        ("gw2", "c", 2),
+        ("gw3", "d", 3),
+    ):
+        scheduler.add(Job(host, item, priority=priority))
+
+    started = [scheduler.next_job() for _ in range(3)]
+    assert [job.item for job in started] == ["b", "c", "d"]
+    assert scheduler.next_job() is None
+
+    scheduler.release(started[0])
+    assert scheduler.next_job().item == "a"
+    assert len(scheduler) == 0
+
+
+def test_connection_rate_and_deadline():
+    clock = FakeClock()
+    scheduler = Scheduler(connection_rate=2, clock=clock)
+    scheduler.add(Job("gw1", "late", deadline=0.1))
+    scheduler.add(Job("gw1", "a"))
+    scheduler.add(Job("gw1", "b"))
+
+    assert scheduler.next_job().item == "late"
+    assert scheduler.next_job() is None
+    assert scheduler.time_until_ready() == 0.5
+
+    clock.now = 0.5
+    assert scheduler.next_job().item == "a"
+
+    scheduler = Scheduler(clock=clock)
+    scheduler.add(Job("gw1", "late", deadline=0.1))
+    assert scheduler.next_job() is None
+    assert [job.item for job in scheduler.expired] == ["late"]
@@ -0,0 +1,28 @@
+import pytest
+
+from iflag.spool import RecordSpool
+
+
+def test_spool_moves_records_to_file_over_budget(tmp_path):
+    records = [bytes([i]) * 4 for i in range(10)]
+    with RecordSpool(memory_budget=16, directory=str(tmp_path)) as spool:
+        spool.write(records[:4])
+        assert not spool.spilled
+        spool.write(records[4:6])
+        assert spool.spilled
+        first = iter(spool)
+        assert next(first) == records[0]
+        spool.write(records[6:])
+        assert list(spool) == records
+        assert next(first) == records[1]
+        assert len(spool) == 10
+
+    with pytest.raises(ValueError):
+        RecordSpool(memory_budget=16).write([b"\x00" * 4, b"\x00" * 5])
+
+
+def test_empty_spool():
+    with RecordSpool(memory_budget=16) as spool:
+        spool.write([])
+        assert list(spool) == []
+        assert len(spool) == 0
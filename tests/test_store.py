@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from iflag import data
+from iflag.data import DatabaseRecordParameter
+from iflag.store import RecordStore
+
+PARAMETERS = [
+    DatabaseRecordParameter(name="status", data_class=data.Byte),
+    DatabaseRecordParameter(name="end_date", data_class=data.Date),
+    DatabaseRecordParameter(name="consumption", data_class=data.Word),
+    DatabaseRecordParameter(name="counter", data_class=data.ULong),
+    DatabaseRecordParameter(name="none_data", data_class=data.Null2),
+]
+START = datetime(2020, 1, 1)
+
+
+def records(count, offset=0):
+    # Newest first, like a database read.
+    for index in reversed(range(offset, offset + count)):
+        record = {
+            "status": index % 3,
+            "end_date": START + timedelta(hours=index),
+            "counter": Decimal(1000000 + index * 7) / 100,
+        }
+        if index % 10:
+            record["consumption"] = Decimal(index % 50)
+        yield record
+
+
+def test_store_round_trip_and_range():
+    store = RecordStore(delta_fields=["counter"])
+    store.add("meter-1", "interval", PARAMETERS, records(300))
+    table = store.table("meter-1", "interval")
+    assert len(table) == 300
+    assert table.range() == sorted(records(300), key=lambda r: r["end_date"])
+
+    window = table.range(START + timedelta(hours=150), START + timedelta(hours=160))
+    assert [r["end_date"] for r in window] == [
+        START + timedelta(hours=hour) for hour in range(150, 161)
+    ]
+    assert window[0]["counter"] == Decimal("10010.50")
+    assert store.nbytes < 300 * 20
+
+
+def test_store_merges_older_records_and_drops_old():
+    store = RecordStore()
+    store.add("meter-1", "interval", PARAMETERS, records(10, offset=10))
+    store.add("meter-1", "interval", PARAMETERS, records(15))
+    table = store.table("meter-1", "interval")
+    assert len(table) == 20
+    assert table.range()[0]["end_date"] == START
+
+    store.drop_before(START + timedelta(hours=5))
+    assert len(table) == 15
+    assert table.range()[0]["end_date"] == START + timedelta(hours=5)
+
+
+def test_store_merges_and_drops_across_blocks():
+    store = RecordStore(delta_fields=["counter"])
+    store.add("meter-1", "interval", PARAMETERS, records(200, offset=300))
+    store.add("meter-1", "interval", PARAMETERS, records(400))
+    table = store.table("meter-1", "interval")
+    expected = sorted(records(500), key=lambda r: r["end_date"])
+    assert table.range() == expected
+
+    size = table.nbytes
+    table.drop_before(START + timedelta(hours=290))
+    assert table.range() == expected[290:]
+    assert table.nbytes < size
+    assert table.range(until=START + timedelta(hours=10)) == []
+
+    updated = {"end_date": START + timedelta(hours=295), "status": 7}
+    table.add([updated])
+    assert table.range(*[updated["end_date"]] * 2) == [updated]
+    assert len(table) == 210
+
+
+def test_values_that_dont_fit_are_kept_as_objects():
+    store = RecordStore(delta_fields=["counter"])
+    store.add("meter-1", "interval", PARAMETERS, records(5))
+    third = Decimal(1) / Decimal(3)
+    record = {"end_date": START + timedelta(hours=5), "counter": third, "status": 1}
+    store.add("meter-1", "interval", PARAMETERS, [record])
+
+    stored = store.range("meter-1", "interval")
+    assert len(stored) == 6
+    assert stored[-1] == record
+    assert stored[0] == sorted(records(5), key=lambda r: r["end_date"])[0]